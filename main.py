@@ -5,11 +5,14 @@ from scripts.utils.plotter import Plotter
 
 # In this example of code, we use the config file learn_low.yaml to train agents on low traffic
 
-config_parser = ConfigsParser('configs/learn_low.yaml')
-config_parser.parse()
+# The __main__ guard is needed when Agent_settings.Workers > 1, since worker processes may re-import this module
 
-p = Plotter()
-p.set_configs(config_parser.get_plotter_config())
+if __name__ == '__main__':
+    config_parser = ConfigsParser('configs/learn_low.yaml')
+    config_parser.parse()
 
-r = Runner(config_parser.get_runner_config(), p)
-r.run()
+    p = Plotter()
+    p.set_configs(config_parser.get_plotter_config())
+
+    r = Runner(config_parser.get_runner_config(), p)
+    r.run()
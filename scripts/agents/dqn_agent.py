@@ -1,21 +1,26 @@
 
 import os
-import pandas as pd
+import numpy as np
 
 from stable_baselines3 import DQN
 from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnv
 from sumo_rl import SumoEnvironment
 from scripts.agents.learning_agent import LearningAgent
+from scripts.custom.custom_dqn import AsyncDQN, PrioritizedDQN
+from scripts.custom.custom_replay_buffer import CompactReplayBuffer, PrioritizedReplayBuffer, get_memory_footprint
 from scripts.utils.config_values import Metric
+from scripts.utils.metrics_writer import MetricsWriter, get_metrics_writer, merge_statistics
+from scripts.utils.profiler import StepProfiler
 
 
 class DQNAgent(LearningAgent):
 
-    def __init__(self, config: dict, env: SumoEnvironment, name: str):
+    def __init__(self, config: dict, env: SumoEnvironment | VecEnv, name: str):
         """
         DQN Agent constructor
         :param config: dict containing the configuration of the DQN agent
-        :param env: Sumo Environment object
+        :param env: Sumo Environment object, or a VecEnv of Sumo Environments to train on many of them at once
         :param name: name of the agent, used for saving models, csvs and plots
         """
         super().__init__(config, env, name)
@@ -25,21 +30,67 @@ class DQNAgent(LearningAgent):
         Initialize the agent object using self.config
         """
 
-        self.agent = DQN(
+        self.agent = self._get_dqn_class()(
             env=self.env,
             policy="MlpPolicy",
             learning_rate=self.config["Alpha"],
+            buffer_size=self.config.get('Buffer_size', 1_000_000),
             learning_starts=0,
-            train_freq=(1, 'step'),
             target_update_interval=100,
-            gradient_steps=-1,
             gamma=self.config['Gamma'],
             exploration_fraction=self.config['Exp_fraction'],
             exploration_initial_eps=self.config['Init_epsilon'],
             exploration_final_eps=self.config['Final_epsilon'],
             verbose=0,
-            device='auto'
+            device='auto',
+            **self._get_replay_buffer_args(),
+            **self._get_train_args()
         )
+        print("Replay buffer of " + self.name + ": " + type(self.agent.replay_buffer).__name__ + ", "
+              + f"{get_memory_footprint(self.agent.replay_buffer) / 2 ** 20:.1f} MB")
+
+    def _get_dqn_class(self) -> type[DQN]:
+        """
+        Algorithm class of the training mode and of the replay buffer in self.config
+        :return: AsyncDQN with the asynchronous learner, PrioritizedDQN with the prioritized replay buffer,
+        DQN otherwise
+        """
+        if self.config.get('Async_learner', False):
+            return AsyncDQN
+        return PrioritizedDQN if self.config.get('Replay_buffer', 'default') == 'prioritized' else DQN
+
+    def _get_train_args(self) -> dict:
+        """
+        Arguments of DQN setting how many gradient steps are performed per transition collected, Update_to_data
+        in self.config. Without it, a gradient step per transition is performed after every step
+        :return: dict containing the arguments
+        """
+        update_to_data = self.config.get('Update_to_data')
+        if self.config.get('Async_learner', False):
+            return {'train_freq': (1, 'step'), 'gradient_steps': -1, 'update_to_data': update_to_data or 1.0,
+                    'sync_interval': self.config.get('Sync_interval', 100)}
+        if update_to_data is None:
+            return {'train_freq': (1, 'step'), 'gradient_steps': -1}
+
+        # each step collects a transition per environment
+        num_envs = self.env.num_envs if isinstance(self.env, VecEnv) else 1
+        if update_to_data >= 1:
+            return {'train_freq': (1, 'step'), 'gradient_steps': round(update_to_data * num_envs)}
+        return {'train_freq': (round(1 / update_to_data), 'step'), 'gradient_steps': num_envs}
+
+    def _get_replay_buffer_args(self) -> dict:
+        """
+        Arguments of DQN selecting the replay buffer in self.config
+        :return: dict containing the replay buffer class and its arguments, empty for the default buffer
+        """
+        replay_buffer = self.config.get('Replay_buffer', 'default')
+        if replay_buffer == 'compact':
+            return {'replay_buffer_class': CompactReplayBuffer}
+        if replay_buffer == 'prioritized':
+            return {'replay_buffer_class': PrioritizedReplayBuffer,
+                    'replay_buffer_kwargs': {'alpha': self.config.get('Priority_alpha', 0.6),
+                                             'beta': self.config.get('Priority_beta', 0.4)}}
+        return {}
 
     def run(self, learn: bool, out_path: str) -> str:
         """
@@ -55,28 +106,125 @@ class DQNAgent(LearningAgent):
         out_file = os.path.join(out_path, self.name)
         os.makedirs(os.path.dirname(out_file), exist_ok=True)
 
-        for curr_run in range(self.config['Runs']):
+        for curr_run in range(self.start_run, self.config['Runs']):
 
             if learn:
-                rows = []
+                num_envs = self.env.num_envs if isinstance(self.env, VecEnv) else 1
+                writers = [self._get_metrics_writer(out_file, curr_run, env_idx if num_envs > 1 else None)
+                           for env_idx in range(num_envs)]
 
-                # total_timesteps are the env total steps, which are total time / time per step
-                self.agent.learn(total_timesteps=self.env.sim_max_time // self.env.delta_time,
-                                 callback=SaveInfos(rows))
+                # Infos are streamed by the SaveInfos callback, so the environments don't need to keep them
+                self._set_env_attr('buffer_metrics', False)
 
-                df = pd.DataFrame.from_records(rows, columns={'step'}.union(Metric))
-                df.to_csv(out_file + "_ep" + str(curr_run) + ".csv")
+                # total_timesteps are the env total steps, which are total time / time per step, for every env
+                steps = ((self._get_env_attr('sim_max_time') - self._get_env_attr('begin_time'))
+                         // self._get_env_attr('delta_time'))
+                if isinstance(self.agent.replay_buffer, PrioritizedReplayBuffer):
+                    # the bias correction is annealed to full over the runs
+                    beta = self.config.get('Priority_beta', 0.4)
+                    self.agent.replay_buffer.beta = beta + (1 - beta) * curr_run / max(self.config['Runs'] - 1, 1)
+                callbacks = [SaveInfos(writers)]
+                if self.monitor is not None:
+                    callbacks.append(StopOnDivergence(self))
+                if self.profiler.enabled:
+                    callbacks.append(ProfileTraining(self.profiler))
+                try:
+                    self.agent.learn(total_timesteps=steps * num_envs, callback=callbacks)
+                finally:
+                    for writer in writers:
+                        writer.close()
+                self._checkpoint(curr_run)
+                self.profiler.end_episode(curr_run, steps * num_envs * self._get_env_attr('delta_time'))
+                summaries = [writer.summary() for writer in writers]
+                if self._end_episode(curr_run, {key: float(np.mean([summary[key] for summary in summaries]))
+                                                for key in summaries[0]},
+                                     merge_statistics([writer.statistics() for writer in writers])):
+                    break
             else:
                 done = False
                 state = self.env.reset()[0]
+                self.env.open_metrics(out_file, curr_run)
                 while not done:
-                    state, _, _, done, _ = self.env.step(self.agent.predict(state)[0])
+                    with self.profiler.phase('act'):
+                        if self.inference_client is not None:
+                            action = self.inference_client.act(state)
+                        else:
+                            action = self.agent.predict(state)[0]
+                    state, _, _, done, _ = self.env.step(action)
 
                 self.env.save_csv(out_file, curr_run)
+                self.profiler.end_episode(curr_run, self.env.sim_step - self.env.begin_time)
+                if self._end_episode(curr_run, self.env.metrics_summary, self.env.metrics_statistics):
+                    break
         self.env.close()
 
         return out_path
 
+    def _get_metrics_writer(self, out_file: str, curr_run: int, env_idx: int = None) -> MetricsWriter:
+        """
+        Builds the writer streaming the infos of one environment during a learning episode
+        :param out_file: path of the metrics file, without episode and extension
+        :param curr_run: number of the episode
+        :param env_idx: index of the environment in the VecEnv, None if there is only one environment
+        :return: MetricsWriter object
+        """
+        if env_idx is not None:
+            out_file += "_env" + str(env_idx)
+
+        return get_metrics_writer(out_file + "_ep" + str(curr_run),
+                                  self._get_env_attr('output_format'),
+                                  columns=['step'] + sorted(Metric),
+                                  flush_interval=self._get_env_attr('flush_interval'))
+
+    def _get_env_attr(self, name: str):
+        """
+        Reads an attribute of the environment, from the first one if self.env is a VecEnv
+        :param name: name of the attribute
+        :return: value of the attribute
+        """
+        if isinstance(self.env, VecEnv):
+            return self.env.get_attr(name, indices=0)[0]
+        return getattr(self.env, name)
+
+    def _set_env_attr(self, name: str, value) -> None:
+        """
+        Sets an attribute of the environment, of all of them if self.env is a VecEnv
+        :param name: name of the attribute
+        :param value: value of the attribute
+        """
+        if isinstance(self.env, VecEnv):
+            self.env.set_attr(name, value)
+        else:
+            setattr(self.env, name, value)
+
+    def predict_batch(self, observations: np.ndarray) -> np.ndarray:
+        """
+        Greedy actions of the trained agent for many observations at once, in a single forward pass
+        :param observations: 2d array, one observation per row
+        :return: array containing the action chosen for each observation
+        """
+        return self.agent.predict(observations, deterministic=True)[0]
+
+    def _save_checkpoint(self, path: str) -> None:
+        """
+        Saves the state of the agent needed to continue training, including the replay buffer
+        if Checkpoint_replay_buffer is set in the agent config
+        :param path: path of the checkpoint files, without extension
+        """
+        if self.config.get('Checkpoint_replay_buffer', False):
+            self.agent.save_replay_buffer(path + '_replay_buffer.pkl.tmp')
+            os.replace(path + '_replay_buffer.pkl.tmp', path + '_replay_buffer.pkl')
+        super()._save_checkpoint(path)
+
+    def _load_checkpoint(self, path: str) -> None:
+        """
+        Restores the state saved by _save_checkpoint
+        :param path: path of the checkpoint files, without extension
+        """
+        super()._load_checkpoint(path)
+        if self.config.get('Checkpoint_replay_buffer', False) and os.path.exists(path + '_replay_buffer.pkl'):
+            self.agent.load_replay_buffer(path + '_replay_buffer.pkl')
+
     def save(self, path: str) -> None:
         """
         Saves the trained agent to a file
@@ -91,28 +239,85 @@ class DQNAgent(LearningAgent):
         :param env: new custom to run the loaded agent on
         """
         self.env = env
-        self.agent = DQN.load(path, env=env)
+        self.agent = self._get_dqn_class().load(path, env=env)
 
 
 class SaveInfos(BaseCallback):
     """
     Custom callback to save env infos after each step
     """
-    def __init__(self, rows: list, verbose=0):
+    def __init__(self, writers: list[MetricsWriter], verbose=0):
         """
         Class constructor
-        :param rows: list to save infos to
+        :param writers: list containing one MetricsWriter per environment to stream infos to
         :param verbose: verbosity level,
                         0 -> no output, 1 -> info messages, 2 -> debug messages
         """
         super().__init__(verbose)
-        self.rows = rows
+        self.writers = writers
 
     def _on_step(self) -> bool:
         """
         Method executed after each step to save infos
         :return: True to continue simulation, False to stop simulation
         """
-        locals()
-        self.rows.append(self.locals['infos'][0])
+        for writer, info in zip(self.writers, self.locals['infos']):
+            writer.write(info)
+        return True
+
+
+class StopOnDivergence(BaseCallback):
+    """
+    Custom callback ending the learning episode as soon as one of the environments diverges
+    """
+    def __init__(self, agent: LearningAgent, verbose=0):
+        """
+        Class constructor
+        :param agent: agent whose convergence monitor checks the infos
+        :param verbose: verbosity level,
+                        0 -> no output, 1 -> info messages, 2 -> debug messages
+        """
+        super().__init__(verbose)
+        self.agent = agent
+
+    def _on_step(self) -> bool:
+        """
+        Method executed after each step to check the infos
+        :return: True to continue simulation, False to stop simulation
+        """
+        return not any([self.agent._diverged(info, env_idx) for env_idx, info in enumerate(self.locals['infos'])])
+
+
+class ProfileTraining(BaseCallback):
+    """
+    Callback timing the gradient updates of DQN as the 'learn' phase of a StepProfiler. Off-policy algorithms
+    train between the end of a rollout and the start of the next one
+    """
+    def __init__(self, profiler: StepProfiler, verbose=0):
+        """
+        Class constructor
+        :param profiler: enabled StepProfiler
+        :param verbose: verbosity level,
+                        0 -> no output, 1 -> info messages, 2 -> debug messages
+        """
+        super().__init__(verbose)
+        self.profiler = profiler
+        self._phase = None
+
+    def _on_rollout_end(self) -> None:
+        self._phase = self.profiler.phase('learn')
+        self._phase.__enter__()
+
+    def _on_rollout_start(self) -> None:
+        self._end_phase()
+
+    def _on_training_end(self) -> None:
+        self._end_phase()
+
+    def _end_phase(self) -> None:
+        if self._phase is not None:
+            self._phase.__exit__(None, None, None)
+            self._phase = None
+
+    def _on_step(self) -> bool:
         return True
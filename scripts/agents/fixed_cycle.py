@@ -7,14 +7,16 @@ from scripts.agents.learning_agent import LearningAgent
 
 class FixedCycleAgent(LearningAgent):
 
-    def __init__(self, config: dict, env: SumoEnvironment, name: str):
+    def __init__(self, config: dict, env: SumoEnvironment, name: str, metrics: list[str] = None):
         """
         Fixed cycle Agent constructor
         :param config: dict containing the configuration of the Fixed Cycle agent
         :param env: Sumo Environment object
         :param name: name of the agent, used for saving models, csvs and plots
+        :param metrics: system metrics saved in fast forward mode, None for all of them
         """
         super().__init__(config, env, name)
+        self.metrics = metrics
 
     def _init_agent(self):
         self.agent = None
@@ -30,17 +32,38 @@ class FixedCycleAgent(LearningAgent):
         out_path = os.path.join(out_path, self.name)
         out_file = os.path.join(out_path, self.name)
 
-        for curr_run in range(self.config['Runs']):
+        for curr_run in range(self.start_run, self.config['Runs']):
             done = False
             self.env.reset()
-            while not done:
-                done = self._step()
+            if self.config.get('Fast_forward', False):
+                # the info computed on reset has all the metrics, it's replaced by a sample of the requested ones
+                self.env.metrics.clear()
+                self.env.open_metrics(out_file, curr_run)
+                self.env.compute_system_metrics(self.metrics)
+                while not done:
+                    done = self._fast_forward_step()
+            else:
+                self.env.open_metrics(out_file, curr_run)
+                while not done:
+                    done = self._step()
             self.env.save_csv(out_file, curr_run)
+            self.profiler.end_episode(curr_run, self.env.sim_step - self.env.begin_time)
+            if self._end_episode(curr_run, self.env.metrics_summary, self.env.metrics_statistics):
+                break
 
         self.env.close()
 
         return out_path
 
+    def resume(self, learn: bool, out_path: str) -> None:
+        """
+        Prepares the agent to continue an interrupted run, skipping the episodes whose metrics files exist.
+        Fixed cycle has no state to restore
+        :param learn: if True, agent will learn. Value DOESN'T matter with Fixed Cycle
+        :param out_path: path containing the csv output files of all the agents
+        """
+        super().resume(False, out_path)
+
     def save(self, path: str) -> None:
         """
         Saves the trained agent to a file
@@ -67,3 +90,13 @@ class FixedCycleAgent(LearningAgent):
         self.env._compute_rewards()
         self.env._compute_info()
         return self.env._compute_dones()['__all__']
+
+    def _fast_forward_step(self) -> bool:
+        """
+        Advances the simulation by Sample_interval seconds (delta_time if missing) in a single SUMO call, then
+        computes only the system metrics in self.metrics. Observations and rewards are never computed
+        :return: bool, whether the simulation has terminated
+        """
+        self.env.fast_forward(self.config.get('Sample_interval', self.env.delta_time))
+        self.env.compute_system_metrics(self.metrics)
+        return self.env.sim_step >= self.env.sim_max_time
@@ -1,6 +1,12 @@
+import json
+import os
+import re
 
 from abc import ABC, abstractmethod
+from typing import Callable
 from sumo_rl import SumoEnvironment
+from scripts.utils.convergence_monitor import ConvergenceMonitor
+from scripts.utils.profiler import StepProfiler
 
 
 class LearningAgent(ABC):
@@ -16,6 +22,24 @@ class LearningAgent(ABC):
         self.env = env
         self.agent = None
         self.name = name
+        # first episode to run, moved forward when resuming
+        self.start_run = 0
+        # path of the checkpoint files without extension, None if checkpointing is disabled
+        self.checkpoint_path = None
+        self.checkpoint_interval = 1
+        # times the phases of run, disabled unless set_profiler is called
+        self.profiler = StepProfiler()
+        # means of the metrics of each episode run
+        self.episode_summaries: list[dict] = []
+        # means, minimums and maximums of the metrics of each episode run, when known
+        self.episode_statistics: list[dict] = []
+        # functions of the episode number and its summary, returning True to stop run
+        self.early_stopping: list[Callable[[int, dict], bool]] = []
+        self.stopped_early = False
+        # cuts diverged episodes short, None to always run whole episodes
+        self.monitor = None
+        # InferenceClient choosing the actions when testing, None to choose them with the agent's own model
+        self.inference_client = None
 
     @abstractmethod
     def _init_agent(self):
@@ -41,6 +65,147 @@ class LearningAgent(ABC):
         """
         pass
 
+    def set_profiler(self, profiler: StepProfiler) -> None:
+        """
+        Sets the profiler timing the phases of the agent and of its environment
+        :param profiler: StepProfiler object
+        """
+        self.profiler = profiler
+        # a VecEnv steps in other processes, so only the phases of the agent are timed
+        if hasattr(self.env, 'profiler'):
+            self.env.profiler = profiler
+
+    def set_inference_client(self, client) -> None:
+        """
+        Sets the client through which the actions are chosen when testing, by the server of the trained model
+        :param client: InferenceClient object
+        """
+        self.inference_client = client
+
+    def add_early_stopping(self, early_stopping: Callable[[int, dict], bool]) -> None:
+        """
+        Adds a rule deciding, after each episode, whether run must stop
+        :param early_stopping: function of the episode number and the means of its metrics, returning True to stop
+        """
+        self.early_stopping.append(early_stopping)
+
+    def set_convergence_monitor(self, monitor: ConvergenceMonitor) -> None:
+        """
+        Sets the monitor stopping run once training has converged and cutting diverged episodes short
+        :param monitor: ConvergenceMonitor object
+        """
+        self.monitor = monitor
+        self.add_early_stopping(monitor)
+
+    def _diverged(self, info: dict, env_idx: int = 0) -> bool:
+        """
+        Checks whether the current episode has diverged and must be cut short
+        :param info: info of the last step
+        :param env_idx: index of the environment, when more environments are stepped together
+        :return: True if the episode must be cut, False otherwise
+        """
+        if self.monitor is not None and self.monitor.check_step(info, env_idx):
+            print("Cutting diverged episode of " + self.name + " at step " + str(info.get('step')))
+            return True
+        return False
+
+    def _end_episode(self, curr_run: int, summary: dict, statistics: dict = None) -> bool:
+        """
+        Records the summary of an episode and checks the early stopping rule
+        :param curr_run: episode just completed
+        :param summary: means of the metrics of the episode
+        :param statistics: means, minimums and maximums of the metrics of the episode, None if unknown
+        :return: True if run must stop, False otherwise
+        """
+        self.episode_summaries.append(dict(summary, episode=curr_run))
+        if statistics is not None:
+            self.episode_statistics.append(dict(statistics, episode=curr_run))
+        # every rule is called, since rules like ConvergenceMonitor keep track of all the episodes
+        if any([early_stopping(curr_run, summary) for early_stopping in self.early_stopping]):
+            print("Stopping " + self.name + " early after episode " + str(curr_run))
+            self.stopped_early = True
+            return True
+        return False
+
+    def set_checkpoint(self, path: str, interval: int) -> None:
+        """
+        Enables periodic checkpointing of the agent state during run
+        :param path: path of the checkpoint files, without extension
+        :param interval: number of episodes between checkpoints
+        """
+        self.checkpoint_path = path
+        self.checkpoint_interval = interval
+
+    def _checkpoint(self, curr_run: int) -> None:
+        """
+        Saves a checkpoint at the end of an episode, every checkpoint_interval episodes.
+        The agent is saved first, then the episode counter, so that the counter never refers to a missing state
+        :param curr_run: episode just completed
+        """
+        if self.checkpoint_path is None or (curr_run + 1) % self.checkpoint_interval != 0:
+            return
+
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        self._save_checkpoint(self.checkpoint_path)
+
+        with open(self.checkpoint_path + '.json.tmp', 'w') as f:
+            json.dump({'episodes': curr_run + 1}, f)
+        os.replace(self.checkpoint_path + '.json.tmp', self.checkpoint_path + '.json')
+
+    def _save_checkpoint(self, path: str) -> None:
+        """
+        Saves the state of the agent needed to continue training
+        :param path: path of the checkpoint files, without extension
+        """
+        self.save(path + '.pkl.tmp')
+        os.replace(path + '.pkl.tmp', path + '.pkl')
+
+    def _load_checkpoint(self, path: str) -> None:
+        """
+        Restores the state saved by _save_checkpoint
+        :param path: path of the checkpoint files, without extension
+        """
+        self.load(path + '.pkl', self.env)
+
+    def resume(self, learn: bool, out_path: str) -> None:
+        """
+        Prepares the agent to continue an interrupted run.
+        If learning, the last checkpoint is restored and the episodes it covers are skipped; otherwise the agent
+        has no state to restore, and the episodes whose metrics files already exist are skipped
+        :param learn: if True, agent will learn
+        :param out_path: path containing the csv output files of all the agents
+        """
+        if not learn:
+            self.start_run = self._completed_episodes(os.path.join(out_path, self.name))
+        elif self.checkpoint_path is not None and os.path.exists(self.checkpoint_path + '.json'):
+            with open(self.checkpoint_path + '.json') as f:
+                self.start_run = json.load(f)['episodes']
+            self._load_checkpoint(self.checkpoint_path)
+
+        if self.start_run > 0:
+            print("Resuming " + self.name + " from episode " + str(self.start_run))
+
+    @staticmethod
+    def _completed_episodes(path: str) -> int:
+        """
+        Counts the episodes, starting from the first one, whose metrics files exist
+        :param path: path containing the csv output files of the agent
+        :return: number of consecutive episodes found
+        """
+        if not os.path.isdir(path):
+            return 0
+
+        episodes = set()
+        for file in os.listdir(path):
+            match = re.search(r'_ep(\d+)\.\w+$', file)
+            if match:
+                episodes.add(int(match.group(1)))
+
+        completed = 0
+        while completed in episodes:
+            completed += 1
+        return completed
+
     def save(self, path: str) -> None:
         """
         Saves the trained agent to a file
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+
+from sumo_rl import SumoEnvironment
+from sumo_rl.exploration import EpsilonGreedy
+from scripts.agents.learning_agent import LearningAgent
+from scripts.custom.custom_ql_agent import ArrayQTable, IndependentArrayQLAgents, SharedArrayQLAgent
+
+
+class MultiQLearningAgent(LearningAgent):
+    """
+    Q-Learning agent controlling all the traffic signals of a multi agent environment (single_agent=False).
+    If config['Shared'] is True all the signals share a single q-table, updated in batch, otherwise each signal
+    has its own table
+    """
+
+    def __init__(self, config: dict, env: SumoEnvironment, name: str):
+        """
+        Multi Q-Learning Agent constructor
+        :param config: dict containing the configuration of the QL_multi agent
+        :param env: Sumo Environment object, with single_agent=False
+        :param name: name of the agent, used for saving models, csvs and plots
+        """
+        super().__init__(config, env, name)
+
+    def _init_agent(self):
+        """
+        Initialize the agent object using self.config
+        """
+        self.agent = self._build_agent(self.config['Alpha'], self.config['Gamma'],
+                                       EpsilonGreedy(initial_epsilon=self.config['Init_epsilon'],
+                                                     min_epsilon=self.config['Min_epsilon'],
+                                                     decay=self.config['Decay']))
+
+    def _build_agent(self, alpha: float, gamma: float, exploration: EpsilonGreedy,
+                     q_tables: dict[str, ArrayQTable] = None) -> SharedArrayQLAgent | IndependentArrayQLAgents:
+        """
+        Builds the agent of all the traffic signals, starting from the states after a reset of self.env
+        :param alpha: learning rate
+        :param gamma: discount factor
+        :param exploration: exploration strategy
+        :param q_tables: tables to start from, a single one with key None if shared. New ones if None
+        :return: SharedArrayQLAgent or IndependentArrayQLAgents object
+        """
+        starting_states = self._encode(self.env.reset())
+        action_space = self.env.action_space
+
+        if self.config.get('Shared', False):
+            return SharedArrayQLAgent(starting_states, action_space, alpha, gamma, exploration,
+                                      q_tables.get(None) if q_tables is not None else None)
+        return IndependentArrayQLAgents(starting_states, action_space, alpha, gamma, exploration, q_tables)
+
+    def _encode(self, observations: dict[str, np.ndarray]) -> dict[str, tuple]:
+        """
+        Encodes the observations of the traffic signals
+        :param observations: observation of each traffic signal
+        :return: encoded state of each traffic signal
+        """
+        return {ts: self.env.encode(obs, ts) for ts, obs in observations.items()}
+
+    def run(self, learn: bool, out_path: str) -> str:
+        """
+        Run agents for number of episodes specified in self.config['Runs'] and save the csvs
+        :param learn: if True, agent will learn
+        :param out_path: path to save the csv file
+        :return: path containing the csv output files
+        """
+        if self.agent is None:
+            self._init_agent()
+
+        out_path = os.path.join(out_path, self.name)
+        out_file = os.path.join(out_path, self.name)
+
+        for curr_run in range(self.start_run, self.config['Runs']):
+            # the first episode starts from the reset done when the agent was built
+            if curr_run > self.start_run:
+                self.agent.observe(self._encode(self.env.reset()))
+            self.env.open_metrics(out_file, curr_run)
+
+            done = False
+            while not done:
+                with self.profiler.phase('act'):
+                    actions = self.agent.act()
+                observations, rewards, dones, info = self.env.step(actions)
+                done = dones['__all__']
+                states = self._encode(observations)
+                if learn:
+                    with self.profiler.phase('learn'):
+                        self.agent.learn(states, rewards)
+                else:
+                    self.agent.observe(states)
+                if self._diverged(info):
+                    break
+
+            self.env.save_csv(out_file, curr_run)
+            self._checkpoint(curr_run)
+            self.profiler.end_episode(curr_run, self.env.sim_step - self.env.begin_time)
+            if self._end_episode(curr_run, self.env.metrics_summary, self.env.metrics_statistics):
+                break
+        self.env.close()
+
+        return out_path
+
+    def save(self, path: str) -> None:
+        """
+        Saves the trained agent to a file, in numpy's npz format
+        :param path: path to save the trained agent to
+        """
+        exploration = self.agent.exploration
+
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     shared=isinstance(self.agent, SharedArrayQLAgent),
+                     ts_ids=np.array(list(self.agent.states if isinstance(self.agent, SharedArrayQLAgent)
+                                          else self.agent.agents)),
+                     alpha=self.agent.alpha,
+                     gamma=self.agent.gamma,
+                     initial_epsilon=exploration.initial_epsilon,
+                     min_epsilon=exploration.min_epsilon,
+                     decay=exploration.decay,
+                     **self.agent.to_arrays())
+
+    def load(self, path: str, env: SumoEnvironment) -> None:
+        """
+        Loads an agent from a file saved by save. The environment must have the same traffic signals
+        :param path: path to load the trained agent from
+        :param env: new custom to run the loaded agent on
+        """
+        self.env = env
+
+        with np.load(path) as data:
+            exploration = EpsilonGreedy(initial_epsilon=float(data['initial_epsilon']),
+                                        min_epsilon=float(data['min_epsilon']),
+                                        decay=float(data['decay']))
+            if bool(data['shared']):
+                self.config = dict(self.config, Shared=True)
+                q_tables = {None: ArrayQTable.from_arrays(data['states'], data['values'])}
+                epsilons = {None: float(data['epsilon'])}
+            else:
+                self.config = dict(self.config, Shared=False)
+                ts_ids = data['ts_ids'].tolist()
+                q_tables = {ts: ArrayQTable.from_arrays(data[f"states_{i}"], data[f"values_{i}"])
+                            for i, ts in enumerate(ts_ids)}
+                epsilons = dict(zip(ts_ids, data['epsilon'].tolist()))
+            alpha, gamma = float(data['alpha']), float(data['gamma'])
+
+        self.agent = self._build_agent(alpha, gamma, exploration, q_tables)
+        if isinstance(self.agent, SharedArrayQLAgent):
+            exploration.epsilon = epsilons[None]
+        else:
+            for ts, agent in self.agent.agents.items():
+                agent.exploration.epsilon = epsilons[ts]
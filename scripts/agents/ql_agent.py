@@ -1,10 +1,12 @@
 import os
 import pickle
+import zipfile
+import numpy as np
 
 from sumo_rl import SumoEnvironment
-from sumo_rl.agents import QLAgent
 from sumo_rl.exploration import EpsilonGreedy
 from scripts.agents.learning_agent import LearningAgent
+from scripts.custom.custom_ql_agent import ArrayQLAgent, ArrayQTable
 
 
 class QLearningAgent(LearningAgent):
@@ -23,7 +25,7 @@ class QLearningAgent(LearningAgent):
         Initialize the agent object using self.config
         """
 
-        self.agent = QLAgent(
+        self.agent = ArrayQLAgent(
             starting_state=self.env.encode(self.env.reset()[0], self.env.ts_ids[0]),
             state_space=self.env.observation_space,
             action_space=self.env.action_space,
@@ -47,51 +49,101 @@ class QLearningAgent(LearningAgent):
         out_path = os.path.join(out_path, self.name)
         out_file = os.path.join(out_path, self.name)
 
-        for curr_run in range(self.config['Runs']):
+        for curr_run in range(self.start_run, self.config['Runs']):
+            # the first episode starts from the reset done when the agent was built
+            if curr_run > self.start_run:
+                self.agent.observe(self.env.encode(self.env.reset()[0], self.env.ts_ids[0]))
+            self.env.open_metrics(out_file, curr_run)
 
             done = False
             while not done:
-                state, reward, _, done, _ = self.env.step(self.agent.act())
+                with self.profiler.phase('act'):
+                    if self.inference_client is not None and not learn:
+                        # the server encodes the raw observation itself
+                        action = self.inference_client.act(self.env.observations[self.env.ts_ids[0]])
+                    else:
+                        action = self.agent.act()
+                state, reward, _, done, info = self.env.step(action)
+                state = self.env.encode(state, self.env.ts_ids[0])
                 if learn:
-                    self.agent.learn(self.env.encode(state, self.env.ts_ids[0]), reward)
+                    with self.profiler.phase('learn'):
+                        self.agent.learn(state, reward)
+                else:
+                    self.agent.observe(state)
+                if self._diverged(info):
+                    break
 
             self.env.save_csv(out_file, curr_run)
-            self.env.reset()
+            self._checkpoint(curr_run)
+            self.profiler.end_episode(curr_run, self.env.sim_step - self.env.begin_time)
+            if self._end_episode(curr_run, self.env.metrics_summary, self.env.metrics_statistics):
+                break
         self.env.close()
 
         return out_path
 
+    def predict_batch(self, observations: np.ndarray) -> np.ndarray:
+        """
+        Greedy actions of the trained agent for many observations at once, with a single table lookup.
+        States never visited get action 0, as they would with an all zero row
+        :param observations: 2d array, one observation per row
+        :return: array containing the action chosen for each observation
+        """
+        q_table = self.agent.q_table
+        state_ids = np.array([q_table.index.get(self.env.encode(obs, self.env.ts_ids[0]), -1)
+                              for obs in observations])
+
+        actions = np.zeros(len(state_ids), dtype=np.int64)
+        known = state_ids >= 0
+        actions[known] = q_table.greedy_actions(state_ids[known])
+        return actions
+
     def save(self, path: str) -> None:
         """
-        Saves the trained agent to a file
+        Saves the trained agent to a file. The q-table arrays are written directly in numpy's npz format
         :param path: path to save the trained agent to
         """
-        data = {
-            'alpha': self.agent.alpha,
-            'gamma': self.agent.gamma,
-            'exploration_strategy': self.agent.exploration,
-            'q_table': self.agent.q_table}
+        exploration = self.agent.exploration
 
         with open(path, 'wb') as f:
-            pickle.dump(data, f)
+            np.savez(f,
+                     alpha=self.agent.alpha,
+                     gamma=self.agent.gamma,
+                     initial_epsilon=exploration.initial_epsilon,
+                     epsilon=exploration.epsilon,
+                     min_epsilon=exploration.min_epsilon,
+                     decay=exploration.decay,
+                     **self.agent.q_table.to_arrays())
 
     def load(self, path: str, env: SumoEnvironment) -> None:
         """
-        Loads an agent from a file
+        Loads an agent from a file. Files saved as pickled dicts by previous versions are supported too
         :param path: path to load the trained agent from
         :param env: new custom to run the loaded agent on
         """
-        with open(path, 'rb') as f:
-            data = pickle.load(f)
-
         self.env = env
 
-        self.agent = QLAgent(
+        if zipfile.is_zipfile(path):
+            with np.load(path) as data:
+                exploration = EpsilonGreedy(initial_epsilon=float(data['initial_epsilon']),
+                                            min_epsilon=float(data['min_epsilon']),
+                                            decay=float(data['decay']))
+                exploration.epsilon = float(data['epsilon'])
+                alpha, gamma = float(data['alpha']), float(data['gamma'])
+                q_table = ArrayQTable.from_arrays(data['states'], data['values'])
+        else:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            exploration = data['exploration_strategy']
+            alpha, gamma = data['alpha'], data['gamma']
+            q_table = ArrayQTable.from_dict(data['q_table'], self.env.action_space.n)
+
+        self.agent = ArrayQLAgent(
             starting_state=self.env.encode(self.env.reset()[0], self.env.ts_ids[0]),
             state_space=self.env.observation_space,
             action_space=self.env.action_space,
-            alpha=data['alpha'],
-            gamma=data['gamma'],
-            exploration_strategy=data['exploration_strategy']
+            alpha=alpha,
+            gamma=gamma,
+            exploration_strategy=exploration,
+            q_table=q_table
         )
-        self.agent.q_table = data['q_table']
@@ -1,13 +1,17 @@
 import os
 import pickle
+import numpy as np
 
 from sumo_rl import SumoEnvironment
-from linear_rl.true_online_sarsa import TrueOnlineSarsaLambda
 from scripts.agents.learning_agent import LearningAgent
+from scripts.custom.custom_true_online_sarsa import FourierTrueOnlineSarsaLambda, restore_true_online_sarsa
 
 
 class SarsaAgent(LearningAgent):
-    
+
+    # class of the SARSA agent built when loading a model
+    _sarsa_class = FourierTrueOnlineSarsaLambda
+
     def __init__(self, config: dict, env: SumoEnvironment, name: str):
         """
         SARSA-Learning Agent constructor
@@ -21,7 +25,7 @@ class SarsaAgent(LearningAgent):
         """
         Initialize the agent object using self.config
         """
-        self.agent = TrueOnlineSarsaLambda(
+        self.agent = FourierTrueOnlineSarsaLambda(
             state_space=self.env.observation_space,
             action_space=self.env.action_space,
             alpha=self.config['Alpha'],
@@ -44,42 +48,77 @@ class SarsaAgent(LearningAgent):
         out_path = os.path.join(out_path, self.name)
         out_file = os.path.join(out_path, self.name)
 
-        for curr_run in range(self.config['Runs']):
+        for curr_run in range(self.start_run, self.config['Runs']):
             obs, _ = self.env.reset()
+            self.env.open_metrics(out_file, curr_run)
             terminated, truncated = False, False
             
             while not (terminated or truncated):
-                action = self.agent.act(obs)
-                next_obs, reward, terminated, truncated, _ = self.env.step(action=action)
+                with self.profiler.phase('act'):
+                    if self.inference_client is not None and not learn:
+                        action = self.inference_client.act(obs)
+                    else:
+                        action = self.agent.act(obs)
+                next_obs, reward, terminated, truncated, info = self.env.step(action=action)
 
-                self.agent.learn(state=obs, action=action, reward=reward, next_state=next_obs, done=terminated)
+                if learn:
+                    with self.profiler.phase('learn'):
+                        self.agent.learn(state=obs, action=action, reward=reward, next_state=next_obs,
+                                         done=terminated)
                 obs = next_obs
+                if self._diverged(info):
+                    break
 
             self.env.save_csv(out_file, curr_run)
-            self.env.reset()
+            self._checkpoint(curr_run)
+            self.profiler.end_episode(curr_run, self.env.sim_step - self.env.begin_time)
+            if self._end_episode(curr_run, self.env.metrics_summary, self.env.metrics_statistics):
+                break
         self.env.close()
 
         return out_path
 
+    def predict_batch(self, observations: np.ndarray) -> np.ndarray:
+        """
+        Greedy actions of the trained agent for many observations at once, with a single matrix product
+        :param observations: 2d array, one observation per row
+        :return: array containing the action chosen for each observation
+        """
+        return self.agent.get_q_values(self.agent.compute_features(observations)).argmax(axis=1)
+
     def save(self, path: str) -> None:
         """
-        Saves the trained agent to a file
+        Saves the trained agent. The hyperparameters are pickled to path, while the weights, the Fourier
+        coefficients, the learning rates and, if not zero, the eligibility traces are saved next to it as .npy
+        files, so that they can be memory-mapped when loaded
         :param path: path to save the trained agent to
         """
-        data = {
-            'alpha': self.agent.alpha,
-            'gamma': self.agent.gamma,
-            'epsilon': self.agent.epsilon,
-            'lamb': self.agent.lamb,
-            'fourier_order': self.agent.basis.order,
+        arrays = {
+            'coeff': self.agent.basis.coeff,
+            'lr': self.agent.lr,
+            'theta': self.agent.theta
         }
+        # Traces are only needed to continue an episode, e.g. from a checkpoint
+        if self.agent.et.any():
+            arrays['et'] = self.agent.et
+
+        data = self._get_params()
+        data['arrays'] = {}
+        for name, array in arrays.items():
+            array_path = f"{os.path.splitext(path)[0]}_{name}.npy"
+            # Written to a new file and then renamed, so that a loaded model mapping the old file stays valid
+            with open(array_path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(array_path + '.tmp', array_path)
+            data['arrays'][name] = os.path.basename(array_path)
 
         with open(path, 'wb') as f:
             pickle.dump(data, f)
 
     def load(self, path: str, env: SumoEnvironment) -> None:
         """
-        Loads an agent from a file
+        Loads an agent from a file. The arrays are memory-mapped copy-on-write, so they are read lazily
+        and the files are never modified
         :param path: path to load the trained agent from
         :param env: new custom to run the loaded agent on
         """
@@ -88,12 +127,32 @@ class SarsaAgent(LearningAgent):
 
         self.env = env
 
-        self.agent = TrueOnlineSarsaLambda(
-            state_space=self.env.observation_space,
-            action_space=self.env.action_space,
-            alpha=data['alpha'],
-            gamma=data['gamma'],
-            epsilon=data['epsilon'],
-            fourier_order=data['fourier_order'],
-            lamb=data['lamb']
-        )
+        if 'arrays' not in data:
+            # Models saved before the weights were stored only contain the hyperparameters
+            self.agent = self._sarsa_class(
+                state_space=self.env.observation_space,
+                action_space=self.env.action_space,
+                **data
+            )
+            return
+
+        arrays = {name: np.load(os.path.join(os.path.dirname(path), file), mmap_mode='c')
+                  for name, file in data.pop('arrays').items()}
+        self.agent = restore_true_online_sarsa(self._sarsa_class, self.env.observation_space, self.env.action_space,
+                                               data, **arrays)
+
+    def _get_params(self) -> dict:
+        """
+        Scalar attributes of the agent needed to restore it
+        :return: dict mapping attribute names to values
+        """
+        return {
+            'alpha': self.agent.alpha,
+            'gamma': self.agent.gamma,
+            'epsilon': self.agent.epsilon,
+            'lamb': self.agent.lamb,
+            'fourier_order': self.agent.basis.order,
+            'max_non_zero_fourier': self.agent.basis.max_non_zero,
+            'min_max_norm': self.agent.min_max_norm,
+            'q_old': self.agent.q_old
+        }
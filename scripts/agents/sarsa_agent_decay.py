@@ -1,5 +1,3 @@
-import pickle
-
 from sumo_rl import SumoEnvironment
 from scripts.custom.custom_true_online_sarsa import TrueOnlineSarsaLambdaDecay
 from scripts.agents.sarsa_agent import SarsaAgent
@@ -7,6 +5,9 @@ from scripts.agents.sarsa_agent import SarsaAgent
 
 class SarsaDecayAgent(SarsaAgent):
 
+    # class of the SARSA agent built when loading a model
+    _sarsa_class = TrueOnlineSarsaLambdaDecay
+
     def __init__(self, config: dict, env: SumoEnvironment, name: str):
         """
         SARSA-Learning Agent constructor
@@ -31,29 +32,12 @@ class SarsaDecayAgent(SarsaAgent):
             lamb=self.config['Lambda']
         )
 
-    def save(self, path: str) -> None:
+    def _get_params(self) -> dict:
         """
-        Saves the trained agent to a file
-        :param path: path to save the trained agent to
+        Scalar attributes of the agent needed to restore it
+        :return: dict mapping attribute names to values
         """
-        super().save(path)
-
-        with open(path, 'rb') as f:
-            data = pickle.load(f)
-            data['decay'] = self.agent.decay
-
-        with open(path, 'wb') as f:
-            pickle.dump(data, f)
-
-    def load(self, path: str, env: SumoEnvironment) -> None:
-        """
-        Loads an agent from a file
-        :param path: path to load the trained agent from
-        :param env: new custom to run the loaded agent on
-        """
-        super().load(path, env)
-
-        with open(path, 'rb') as f:
-            data = pickle.load(f)
-        self.agent.decay = data['decay']
-
+        params = super()._get_params()
+        params['decay'] = self.agent.decay
+        params['min_epsilon'] = self.agent.min_epsilon
+        return params
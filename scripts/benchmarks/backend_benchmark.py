@@ -0,0 +1,102 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from scripts.custom.custom_environment import CustomEnvironment
+
+# Route files for each traffic type, the same used by Runner
+_ROUTE_FILES = {
+    'low': 'big-intersection/BI_50_test.rou.xml',
+    'high': 'big-intersection/BI_150_test.rou.xml'
+}
+
+_BACKENDS = ('traci', 'libsumo')
+
+
+def _run_case(backend: str, traffic_type: str, num_seconds: int, delta_time: int) -> dict:
+    """
+    Runs one episode with random actions on BI.net.xml and measures its throughput.
+    It is executed in a fresh process, so that the backend selection doesn't leak between cases
+    :param backend: 'traci' or 'libsumo'
+    :param traffic_type: 'low' or 'high'
+    :param num_seconds: simulated seconds
+    :param delta_time: simulated seconds per step
+    :return: dict containing the results of the case
+    """
+    custom_env = CustomEnvironment(
+        route_file=_ROUTE_FILES[traffic_type],
+        gui=False,
+        num_seconds=num_seconds,
+        min_green=5,
+        max_green=50,
+        yellow_time=2,
+        delta_time=delta_time,
+        libsumo=backend == 'libsumo'
+    )
+    used_backend = 'libsumo' if custom_env.uses_libsumo() else 'traci'
+    env = custom_env.get_sumo_env(False)
+
+    env.reset()
+    steps = 0
+    done = False
+
+    start = time.perf_counter()
+    while not done:
+        _, _, _, done, _ = env.step(env.action_space.sample())
+        steps += 1
+    elapsed = time.perf_counter() - start
+
+    env.close()
+
+    return {
+        'backend': backend,
+        'used_backend': used_backend,
+        'traffic_type': traffic_type,
+        'steps': steps,
+        'seconds': elapsed,
+        'steps_per_second': steps / elapsed,
+        'sim_seconds_per_second': num_seconds / elapsed
+    }
+
+
+def run_benchmark(num_seconds: int, delta_time: int) -> list[dict]:
+    """
+    Benchmarks both backends under low and high traffic, one case at a time
+    :param num_seconds: simulated seconds per case
+    :param delta_time: simulated seconds per step
+    :return: list of the results of every case
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    for traffic_type in _ROUTE_FILES:
+        for backend in _BACKENDS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.append(pool.submit(_run_case, backend, traffic_type, num_seconds, delta_time).result())
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare TraCI and libsumo throughput on BI.net.xml')
+    parser.add_argument('--seconds', type=int, default=3600, help='simulated seconds per case')
+    parser.add_argument('--delta-time', type=int, default=5, help='simulated seconds per step')
+    parser.add_argument('--output', default=None, help='json file in which to save the results')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.seconds, args.delta_time)
+
+    print(f"{'traffic':<8} {'backend':<8} {'used':<8} {'steps/s':>10} {'sim s/s':>10}")
+    for result in results:
+        print(f"{result['traffic_type']:<8} {result['backend']:<8} {result['used_backend']:<8} "
+              f"{result['steps_per_second']:>10.1f} {result['sim_seconds_per_second']:>10.1f}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from scripts.benchmarks.throughput_benchmark import _AGENT_CONFIGS
+
+# Agents controlling every traffic signal of a grid, by name
+_CASES = {
+    'FIXED': {'Agent_type': 'FIXED'},
+    'QL_independent': dict(_AGENT_CONFIGS['QL'], Agent_type='QL_multi', Shared=False),
+    'QL_shared': dict(_AGENT_CONFIGS['QL'], Agent_type='QL_multi', Shared=True)
+}
+
+
+def _get_runner_config(case: str, grid_size: int, traffic_type: str, num_seconds: int, delta_time: int,
+                       libsumo: bool, out_dir: str) -> dict:
+    """
+    Builds the Agent_settings of a single instance of case on a grid_size x grid_size grid, running one episode
+    :param case: one of _CASES
+    :param grid_size: number of junctions per side of the grid
+    :param traffic_type: 'low' or 'high'
+    :param num_seconds: simulated seconds of the episode
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :param out_dir: directory in which to save csvs, models, networks and scenarios
+    :return: dict representing the runner configs
+    """
+    return {
+        'Output_csv': os.path.join(out_dir, 'csv'),
+        'Output_model': os.path.join(out_dir, 'models'),
+        'Environment': {
+            'Traffic_type': traffic_type,
+            'Gui': False,
+            'Num_seconds': num_seconds,
+            'Min_green': 5,
+            'Max_green': 50,
+            'Yellow_time': 2,
+            'Delta_time': delta_time,
+            'Libsumo': libsumo,
+            'Network': {'Grid_size': grid_size, 'Directory': os.path.join(out_dir, 'networks')},
+            'Scenario': {'Directory': os.path.join(out_dir, 'scenarios')}
+        },
+        'Instances': {
+            case: dict(_CASES[case], Runs=1)
+        }
+    }
+
+
+def _run_case(case: str, grid_size: int, traffic_type: str, num_seconds: int, delta_time: int, libsumo: bool,
+              out_dir: str) -> dict:
+    """
+    Runs case for one episode on a grid, measuring its throughput. It is executed in a fresh process, so that
+    the peak memory is the one of this case only
+    :param case: one of _CASES
+    :param grid_size: number of junctions per side of the grid
+    :param traffic_type: 'low' or 'high'
+    :param num_seconds: simulated seconds of the episode
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :param out_dir: directory in which to save csvs, models, networks and scenarios
+    :return: dict containing the results of the case
+    """
+    from scripts.utils.runner import Runner
+
+    configs = _get_runner_config(case, grid_size, traffic_type, num_seconds, delta_time, libsumo, out_dir)
+    # the network and the route file are generated here, so that they're not measured
+    runner = Runner(configs, None)
+
+    # the time includes the start of the simulation, like any real run
+    agent = runner._build_agent(case, configs['Instances'][case])
+    signals = len(agent.env.ts_ids)
+    start = time.perf_counter()
+    agent.run(True, configs['Output_csv'])
+    run_seconds = time.perf_counter() - start
+    steps = num_seconds // delta_time
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS. SUMO runs in a child process with TraCI
+    rss_unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'case': case,
+        'grid_size': grid_size,
+        'signals': signals,
+        'traffic_type': traffic_type,
+        'used_backend': 'libsumo' if runner.env.uses_libsumo() else 'traci',
+        'steps': steps,
+        'run_seconds': run_seconds,
+        'steps_per_second': steps / run_seconds,
+        # decisions taken per second, one per signal and step
+        'signal_steps_per_second': signals * steps / run_seconds,
+        'sim_seconds_per_second': num_seconds / run_seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_unit,
+        'peak_sumo_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / rss_unit
+    }
+
+
+def run_benchmark(cases: list[str], grid_sizes: list[int], traffic_type: str, num_seconds: int, delta_time: int,
+                  libsumo: bool = False) -> list[dict]:
+    """
+    Benchmarks every case on every grid size, one case at a time
+    :param cases: cases to benchmark, in _CASES
+    :param grid_sizes: numbers of junctions per side of the grids
+    :param traffic_type: 'low' or 'high'
+    :param num_seconds: simulated seconds per case
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :return: list of the results of every case
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        for grid_size in grid_sizes:
+            for case in cases:
+                case_dir = os.path.join(out_dir, str(grid_size), case)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    results.append(pool.submit(_run_case, case, grid_size, traffic_type, num_seconds, delta_time,
+                                               libsumo, case_dir).result())
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the throughput of the multi agent mode against the '
+                                                 'number of traffic signals, on generated grids')
+    parser.add_argument('--cases', nargs='+', choices=sorted(_CASES), default=sorted(_CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 2, 3, 4],
+                        help='junctions per side of the grids')
+    parser.add_argument('--traffic', choices=['low', 'high'], default='low')
+    parser.add_argument('--seconds', type=int, default=3600, help='simulated seconds per case')
+    parser.add_argument('--delta-time', type=int, default=5, help='simulated seconds per step')
+    parser.add_argument('--libsumo', action='store_true', help='use libsumo instead of TraCI when available')
+    parser.add_argument('--output', default=None, help='json file in which to save the results')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.cases, args.sizes, args.traffic, args.seconds, args.delta_time, args.libsumo)
+
+    print(f"{'signals':>7} {'case':<16} {'steps/s':>10} {'signal steps/s':>15} {'rss MB':>8} {'sumo MB':>8}")
+    for result in results:
+        print(f"{result['signals']:>7} {result['case']:<16} {result['steps_per_second']:>10.1f} "
+              f"{result['signal_steps_per_second']:>15.1f} {result['peak_rss_mb']:>8.1f} "
+              f"{result['peak_sumo_rss_mb']:>8.1f}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from scripts.utils.config_values import AgentType, Metric, TrafficType
+
+# Hyperparameters of each agent type, the same used by the learning configs
+_AGENT_CONFIGS = {
+    'FIXED': {},
+    'QL': {'Alpha': 0.3, 'Gamma': 0.75, 'Init_epsilon': 1.0, 'Min_epsilon': 0.1, 'Decay': 0.8},
+    'DQN': {'Alpha': 0.01, 'Gamma': 0.75, 'Init_epsilon': 1.0, 'Final_epsilon': 0.01, 'Exp_fraction': 0.9},
+    'SARSA': {'Alpha': 0.00005, 'Gamma': 0.9, 'Epsilon': 0.01, 'FourierOrder': 7, 'Lambda': 0.999},
+    'SARSA_decay': {'Alpha': 0.00005, 'Gamma': 0.9, 'Epsilon': 0.01, 'Decay': 0.99, 'FourierOrder': 7,
+                    'Lambda': 0.999},
+    'QL_multi': {'Alpha': 0.3, 'Gamma': 0.75, 'Init_epsilon': 1.0, 'Min_epsilon': 0.1, 'Decay': 0.8}
+}
+
+# Results compared with the baseline, True if higher is better
+_COMPARED = {
+    'steps_per_second': True,
+    'peak_rss_mb': False,
+    'save_seconds': False,
+    'load_seconds': False,
+    'plot_seconds': False
+}
+
+# Differences in seconds below this value are never regressions, since short timings are mostly noise
+_MIN_SECONDS_DELTA = 0.05
+
+
+def _get_runner_config(agent_type: str, traffic_type: str, num_seconds: int, delta_time: int, libsumo: bool,
+                       out_dir: str) -> dict:
+    """
+    Builds the Agent_settings of a single instance of agent_type, running one episode
+    :param agent_type: one of config_values.AgentType
+    :param traffic_type: one of config_values.TrafficType
+    :param num_seconds: simulated seconds of the episode
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :param out_dir: directory in which to save csvs and models
+    :return: dict representing the runner configs
+    """
+    return {
+        'Output_csv': os.path.join(out_dir, 'csv'),
+        'Output_model': os.path.join(out_dir, 'models'),
+        'Environment': {
+            'Traffic_type': traffic_type,
+            'Gui': False,
+            'Num_seconds': num_seconds,
+            'Min_green': 5,
+            'Max_green': 50,
+            'Yellow_time': 2,
+            'Delta_time': delta_time,
+            'Libsumo': libsumo
+        },
+        'Instances': {
+            agent_type: dict(_AGENT_CONFIGS[agent_type], Agent_type=agent_type, Runs=1)
+        }
+    }
+
+
+def _run_case(agent_type: str, traffic_type: str, num_seconds: int, delta_time: int, libsumo: bool,
+              out_dir: str) -> dict:
+    """
+    Trains agent_type for one episode on BI.net.xml, then saves, loads and plots it, measuring each phase.
+    It is executed in a fresh process, so that the peak memory is the one of this case only
+    :param agent_type: one of config_values.AgentType
+    :param traffic_type: one of config_values.TrafficType
+    :param num_seconds: simulated seconds of the episode
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :param out_dir: directory in which to save csvs, models and plots
+    :return: dict containing the results of the case
+    """
+    from scripts.utils.plotter import Plotter
+    from scripts.utils.runner import Runner
+
+    configs = _get_runner_config(agent_type, traffic_type, num_seconds, delta_time, libsumo, out_dir)
+    runner = Runner(configs, None)
+    agent_config = configs['Instances'][agent_type]
+
+    # the time includes the start of the simulation, like any real run
+    agent = runner._build_agent(agent_type, agent_config)
+    start = time.perf_counter()
+    csvs_path = agent.run(True, configs['Output_csv'])
+    run_seconds = time.perf_counter() - start
+    steps = num_seconds // delta_time
+
+    os.makedirs(configs['Output_model'], exist_ok=True)
+    start = time.perf_counter()
+    runner._save_agent_to_file(agent)
+    save_seconds = time.perf_counter() - start
+
+    # the environment is created first, so that only the loading of the model is measured
+    env = runner.env.get_sumo_env(agent_type == 'FIXED', single_agent=agent_type != 'QL_multi')
+    loaded_agent = type(agent)(agent_config, None, agent_type)
+    start = time.perf_counter()
+    loaded_agent.load(os.path.join(configs['Output_model'], agent_type + '.pkl'), env)
+    load_seconds = time.perf_counter() - start
+    env.close()
+
+    plotter = Plotter(output=os.path.join(out_dir, 'plots'), metrics=sorted(Metric))
+    start = time.perf_counter()
+    plotter.add_csv(csvs_path)
+    plotter.build_plot(agent_type)
+    plot_seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS. SUMO runs in a child process with TraCI
+    rss_unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'agent_type': agent_type,
+        'traffic_type': traffic_type,
+        'used_backend': 'libsumo' if runner.env.uses_libsumo() else 'traci',
+        'steps': steps,
+        'run_seconds': run_seconds,
+        'steps_per_second': steps / run_seconds,
+        'sim_seconds_per_second': num_seconds / run_seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_unit,
+        'peak_sumo_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / rss_unit,
+        'save_seconds': save_seconds,
+        'load_seconds': load_seconds,
+        'plot_seconds': plot_seconds
+    }
+
+
+def run_benchmark(agent_types: list[str], traffic_types: list[str], num_seconds: int, delta_time: int,
+                  libsumo: bool = False) -> list[dict]:
+    """
+    Benchmarks every agent type under every traffic type, one case at a time
+    :param agent_types: agent types to benchmark
+    :param traffic_types: traffic types to benchmark
+    :param num_seconds: simulated seconds per case
+    :param delta_time: simulated seconds per step
+    :param libsumo: if True, libsumo is used instead of TraCI when available
+    :return: list of the results of every case
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        for traffic_type in traffic_types:
+            for agent_type in agent_types:
+                case_dir = os.path.join(out_dir, traffic_type, agent_type)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    results.append(pool.submit(_run_case, agent_type, traffic_type, num_seconds, delta_time,
+                                               libsumo, case_dir).result())
+
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """
+    Compares the results with a baseline, cases are matched by agent and traffic type
+    :param results: results of run_benchmark
+    :param baseline: results of a previous run_benchmark
+    :param tolerance: relative change allowed before a result is a regression, e.g. 0.1 for 10%
+    :return: list of messages describing the regressions, empty if there are none
+    """
+    baseline_cases = {(case['agent_type'], case['traffic_type']): case for case in baseline}
+    regressions = []
+
+    for result in results:
+        case = baseline_cases.get((result['agent_type'], result['traffic_type']))
+        if case is None:
+            continue
+
+        for key, higher_is_better in _COMPARED.items():
+            if key not in case:
+                continue
+            old, new = case[key], result[key]
+            if key.endswith('_seconds') and abs(new - old) < _MIN_SECONDS_DELTA:
+                continue
+            if (new < old * (1 - tolerance)) if higher_is_better else (new > old * (1 + tolerance)):
+                regressions.append(f"{result['agent_type']} on {result['traffic_type']} traffic: "
+                                   f"{key} {old:.3f} -> {new:.3f}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the throughput of every agent type on BI.net.xml')
+    parser.add_argument('--agents', nargs='+', choices=sorted(AgentType), default=sorted(AgentType))
+    # generated scenarios need a spec, so only the fixed route files are benchmarked
+    parser.add_argument('--traffic', nargs='+', choices=sorted(TrafficType - {'scenario'}), default=['low', 'high'])
+    parser.add_argument('--seconds', type=int, default=3600, help='simulated seconds per case')
+    parser.add_argument('--delta-time', type=int, default=5, help='simulated seconds per step')
+    parser.add_argument('--libsumo', action='store_true', help='use libsumo instead of TraCI when available')
+    parser.add_argument('--output', default=None, help='json file in which to save the results')
+    parser.add_argument('--baseline', default=None, help='json file of a previous run to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change allowed before a result is a regression')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.agents, args.traffic, args.seconds, args.delta_time, args.libsumo)
+
+    print(f"{'traffic':<8} {'agent':<12} {'steps/s':>10} {'rss MB':>8} {'sumo MB':>8} "
+          f"{'save s':>8} {'load s':>8} {'plot s':>8}")
+    for result in results:
+        print(f"{result['traffic_type']:<8} {result['agent_type']:<12} {result['steps_per_second']:>10.1f} "
+              f"{result['peak_rss_mb']:>8.1f} {result['peak_sumo_rss_mb']:>8.1f} {result['save_seconds']:>8.3f} "
+              f"{result['load_seconds']:>8.3f} {result['plot_seconds']:>8.3f}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
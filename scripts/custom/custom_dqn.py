@@ -0,0 +1,304 @@
+import copy
+import threading
+import numpy as np
+import torch as th
+
+from torch.nn import functional as F
+from stable_baselines3 import DQN
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.utils import polyak_update
+from scripts.custom.custom_replay_buffer import PrioritizedReplayBuffer
+
+
+class PrioritizedDQN(DQN):
+    """
+    DQN trained on a custom_replay_buffer.PrioritizedReplayBuffer: the Huber loss of each transition is weighted
+    by its importance sampling weight, and the absolute TD errors become the new priorities of the transitions.
+    With any other replay buffer, the gradient steps are the ones of DQN
+    """
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        """
+        Performs gradient steps on batches sampled by priority
+        :param gradient_steps: number of gradient steps
+        :param batch_size: number of transitions per batch
+        """
+        self.policy.set_training_mode(True)
+        self._update_learning_rate(self.policy.optimizer)
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data, weights, indices = self._sample(batch_size)
+
+            with th.no_grad():
+                next_q_values = self.q_net_target(replay_data.next_observations).max(dim=1)[0].reshape(-1, 1)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            current_q_values = th.gather(self.q_net(replay_data.observations), dim=1,
+                                         index=replay_data.actions.long())
+
+            # Huber loss of each transition, weighted to correct the bias of the prioritized sampling
+            elementwise_loss = F.smooth_l1_loss(current_q_values, target_q_values, reduction='none')
+            loss = (th.as_tensor(weights, device=self.device).reshape(-1, 1) * elementwise_loss).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            if indices is not None:
+                self._update_priorities(indices,
+                                        (current_q_values - target_q_values).detach().abs().cpu().numpy().reshape(-1))
+
+        self._n_updates += gradient_steps
+
+        self.logger.record('train/n_updates', self._n_updates, exclude='tensorboard')
+        self.logger.record('train/loss', np.mean(losses))
+
+    def _sample(self, batch_size: int) -> tuple[ReplayBufferSamples, np.ndarray, np.ndarray | None]:
+        """
+        Samples a batch from the replay buffer
+        :param batch_size: number of transitions
+        :return: ReplayBufferSamples object, importance sampling weights and indices of the transitions, which are
+        None if the buffer isn't prioritized
+        """
+        if isinstance(self.replay_buffer, PrioritizedReplayBuffer):
+            return self.replay_buffer.sample_prioritized(batch_size, self._vec_normalize_env)
+        return self.replay_buffer.sample(batch_size, self._vec_normalize_env), np.ones(batch_size, np.float32), None
+
+    def _update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """
+        Updates the priorities of the transitions of a batch
+        :param indices: indices of the transitions, as returned by _sample
+        :param td_errors: absolute TD errors of the transitions
+        """
+        self.replay_buffer.update_priorities(indices, td_errors)
+
+
+class AsyncDQN(PrioritizedDQN):
+    """
+    DQN whose gradient steps run in a learner thread, concurrently with the collection of the transitions in the
+    thread calling learn, instead of alternating with it. The collector acts with a copy of the policy, to which
+    the learner publishes its weights every sync_interval gradient steps. The learner performs update_to_data
+    gradient steps per transition collected: it waits for the collector when ahead of the budget, and performs
+    the steps left at the end of learn, so that every call trains as much as in lockstep. Torch and the
+    communication with SUMO release the GIL, so the two threads actually run in parallel.
+    The target network is updated by the learner, every target_update_interval gradient steps
+    """
+
+    def __init__(self, *args, update_to_data: float = 1.0, sync_interval: int = 100, **kwargs):
+        """
+        AsyncDQN constructor, all the arguments but update_to_data and sync_interval are passed to DQN, whose
+        train_freq and gradient_steps are unused
+        :param update_to_data: gradient steps per transition collected
+        :param sync_interval: gradient steps between the publications of the weights to the collector
+        """
+        self.update_to_data = update_to_data
+        self.sync_interval = sync_interval
+        # the actor is copied from the policy when the model is set up
+        self.actor_policy = None
+        self._learner = None
+        self._learner_error = None
+        self._stopping = False
+        self._draining = False
+        self._async_updates = 0
+        self._start_timesteps = 0
+        self._buffer_lock = threading.Lock()
+        self._policy_lock = threading.Lock()
+        self._condition = threading.Condition()
+        super().__init__(*args, **kwargs)
+
+    def _setup_model(self) -> None:
+        """
+        Builds the model and the copy of the policy used by the collector
+        """
+        super()._setup_model()
+        self.actor_policy = copy.deepcopy(self.policy)
+
+    def _excluded_save_params(self) -> list[str]:
+        """
+        Attributes not saved with the model: the threading ones and the copy of the policy, rebuilt on load
+        :return: names of the attributes
+        """
+        return [*super()._excluded_save_params(), 'actor_policy', '_learner', '_learner_error', '_buffer_lock',
+                '_policy_lock', '_condition']
+
+    def learn(self, total_timesteps: int, callback=None, log_interval: int = 4, tb_log_name: str = 'run',
+              reset_num_timesteps: bool = True, progress_bar: bool = False) -> 'AsyncDQN':
+        """
+        Collects total_timesteps transitions while the learner thread trains on them, then waits for the learner
+        to complete its budget
+        :param total_timesteps: number of transitions to collect, over all the environments
+        :param callback: callbacks of the collection, as in DQN
+        :param log_interval: episodes between logs
+        :param tb_log_name: name of the tensorboard run
+        :param reset_num_timesteps: whether to reset the number of timesteps
+        :param progress_bar: whether to show a progress bar
+        :return: the trained model
+        """
+        try:
+            super().learn(total_timesteps, callback, log_interval, tb_log_name, reset_num_timesteps, progress_bar)
+        except BaseException:
+            self._stop_learner(False)
+            raise
+        self._stop_learner(True)
+        if self._learner_error is not None:
+            raise self._learner_error
+
+        return self
+
+    def _setup_learn(self, *args, **kwargs):
+        """
+        Sets up learn as DQN does, then starts the learner thread, once the number of timesteps has been reset
+        :return: total timesteps and callback, as returned by DQN
+        """
+        result = super()._setup_learn(*args, **kwargs)
+        self._publish()
+        self._stopping = False
+        self._draining = False
+        self._learner_error = None
+        self._async_updates = 0
+        # the budget of the learner only counts the transitions of this call
+        self._start_timesteps = self.num_timesteps
+        self._learner = threading.Thread(target=self._learn_loop, name='dqn-learner', daemon=True)
+        self._learner.start()
+        return result
+
+    def _stop_learner(self, drain: bool) -> None:
+        """
+        Stops the learner thread and waits for it
+        :param drain: if True, the learner performs the gradient steps left in its budget before stopping
+        """
+        if self._learner is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._draining = drain
+            self._condition.notify()
+        self._learner.join()
+        self._learner = None
+
+    def _budget(self) -> int:
+        """
+        Gradient steps the learner may perform now
+        :return: number of gradient steps
+        """
+        return int(self.update_to_data * (self.num_timesteps - self._start_timesteps)) - self._async_updates
+
+    def _learn_loop(self) -> None:
+        """
+        Body of the learner thread: performs the gradient steps of its budget until learn ends, then the steps left
+        if draining
+        """
+        try:
+            while True:
+                with self._condition:
+                    while self._budget() <= 0 and not self._stopping and self._learner_error is None:
+                        self._condition.wait()
+                    budget = self._budget()
+                    if budget <= 0 or self._learner_error is not None or (self._stopping and not self._draining):
+                        return
+                # gradient steps until the next publication or target update, whichever comes first
+                steps = min(budget, self.sync_interval - self._async_updates % self.sync_interval,
+                            self.target_update_interval - self._async_updates % self.target_update_interval)
+                super().train(steps, self.batch_size)
+                self._async_updates += steps
+                if self._async_updates % self.target_update_interval == 0:
+                    polyak_update(self.q_net.parameters(), self.q_net_target.parameters(), self.tau)
+                    polyak_update(self.batch_norm_stats, self.batch_norm_stats_target, 1.0)
+                if self._async_updates % self.sync_interval == 0:
+                    self._publish()
+        except BaseException as error:
+            # raised again by learn, the collection stops at the next step
+            self._learner_error = error
+        finally:
+            self._publish()
+
+    def _publish(self) -> None:
+        """
+        Copies the weights of the policy to the one of the collector
+        """
+        with self._policy_lock:
+            self.actor_policy.load_state_dict(self.policy.state_dict())
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        """
+        Called by the collection loop of learn after each rollout: the gradient steps are left to the learner
+        thread, which is woken up since its budget has grown
+        :param gradient_steps: ignored
+        :param batch_size: ignored
+        """
+        if self._learner is None:
+            # e.g. called directly by the user
+            super().train(gradient_steps, batch_size)
+            return
+        if self._learner_error is not None:
+            raise self._learner_error
+        with self._condition:
+            self._condition.notify()
+
+    def _on_step(self) -> None:
+        """
+        Updates the exploration rate after each step of the collection. The target network is updated by the
+        learner
+        """
+        if self._learner is None:
+            super()._on_step()
+            return
+        self._n_calls += 1
+        self.exploration_rate = self.exploration_schedule(self._current_progress_remaining)
+        self.logger.record('rollout/exploration_rate', self.exploration_rate)
+
+    def _store_transition(self, replay_buffer, buffer_action: np.ndarray, new_obs: np.ndarray, reward: np.ndarray,
+                          dones: np.ndarray, infos: list[dict]) -> None:
+        """
+        Adds a transition to the replay buffer, while the learner isn't sampling from it
+        :param replay_buffer: replay buffer of the model
+        :param buffer_action: action taken in each environment
+        :param new_obs: next observation of each environment
+        :param reward: reward of each environment
+        :param dones: whether the episode of each environment ended
+        :param infos: info of each environment
+        """
+        with self._buffer_lock:
+            super()._store_transition(replay_buffer, buffer_action, new_obs, reward, dones, infos)
+
+    def _sample(self, batch_size: int) -> tuple[ReplayBufferSamples, np.ndarray, np.ndarray | None]:
+        """
+        Samples a batch from the replay buffer, while the collector isn't adding to it
+        :param batch_size: number of transitions
+        :return: ReplayBufferSamples object, importance sampling weights and indices of the transitions, which are
+        None if the buffer isn't prioritized
+        """
+        with self._buffer_lock:
+            return super()._sample(batch_size)
+
+    def _update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """
+        Updates the priorities of the transitions of a batch, while the collector isn't adding to the buffer
+        :param indices: indices of the transitions, as returned by _sample
+        :param td_errors: absolute TD errors of the transitions
+        """
+        with self._buffer_lock:
+            super()._update_priorities(indices, td_errors)
+
+    def predict(self, observation: np.ndarray, state: tuple = None, episode_start: np.ndarray = None,
+                deterministic: bool = False) -> tuple[np.ndarray, tuple | None]:
+        """
+        Epsilon greedy actions of DQN. While learning, the greedy ones are taken with the weights last published
+        by the learner
+        :param observation: observation, or batch of observations
+        :param state: unused, for recurrent policies
+        :param episode_start: unused, for recurrent policies
+        :param deterministic: if True, actions are always greedy
+        :return: actions and state
+        """
+        if self._learner is None:
+            return super().predict(observation, state, episode_start, deterministic)
+        if not deterministic and np.random.rand() < self.exploration_rate:
+            if self.actor_policy.is_vectorized_observation(observation):
+                return np.array([self.action_space.sample() for _ in range(observation.shape[0])]), state
+            return np.array(self.action_space.sample()), state
+        with self._policy_lock:
+            return self.actor_policy.predict(observation, state, episode_start, deterministic)
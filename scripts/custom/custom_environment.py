@@ -1,5 +1,248 @@
+import os
+import warnings
+import numpy as np
+import sumo_rl.environment.env as sumo_env_module
+import traci
 
+from functools import partial
+
+from stable_baselines3.common.vec_env import SubprocVecEnv
 from sumo_rl import SumoEnvironment
+from scripts.utils.metrics_writer import get_metrics_writer
+from scripts.utils.profiler import StepProfiler
+from scripts.utils.snapshot_cache import SnapshotCache
+
+
+class CustomSumoEnvironment(SumoEnvironment):
+    """
+    SumoEnvironment that can stream the infos of each step to a MetricsWriter instead of keeping them
+    in memory until the end of the episode. SUMO steps, observations, rewards, infos and metrics saving
+    are timed by self.profiler, which does nothing unless an enabled StepProfiler is set.
+    If a snapshot path is given, every episode starts from the state of the simulation at begin_time, simulated
+    only once and then loaded from the snapshot.
+    If keep_alive is True, close leaves SUMO running and reset reloads it instead of starting a new process, so the
+    environment can be reused by many agents: shutdown must be called to stop SUMO
+    """
+
+    def __init__(self, *args, flush_interval: int = 1000, output_format: str = 'csv', snapshot_path: str = None,
+                 keep_alive: bool = False, **kwargs):
+        """
+        CustomSumoEnvironment constructor, all the arguments but flush_interval, output_format, snapshot_path and
+        keep_alive are passed to SumoEnvironment
+        :param flush_interval: number of rows buffered by the metrics writer before being written to file
+        :param output_format: format of the metrics files, one of config_values.OutputFormat
+        :param snapshot_path: path of the state saved after the warm up (until begin_time), None for no warm up
+        :param keep_alive: if True, SUMO is reloaded on reset instead of restarted, and only stopped by shutdown
+        """
+        self.flush_interval = flush_interval
+        self.output_format = output_format
+        self.snapshot_path = snapshot_path
+        self.keep_alive = keep_alive
+        self.buffer_metrics = True
+        self.metrics_writer = None
+        # means of the metrics of the last episode streamed to a metrics writer
+        self.metrics_summary = {}
+        # means, minimums and maximums of the same metrics
+        self.metrics_statistics = {}
+        self.profiler = StepProfiler()
+        super().__init__(*args, **kwargs)
+
+    def open_metrics(self, out_csv_name: str, episode: int) -> None:
+        """
+        Starts streaming the infos of the current episode to the same file save_csv would write, with the
+        extension of self.output_format. Infos already collected in the current episode (e.g. the one computed
+        on reset) are written first
+        :param out_csv_name: path of the csv file, without connection, episode and extension
+        :param episode: number of the episode
+        """
+        self.close_metrics()
+        self.metrics_writer = get_metrics_writer(out_csv_name + f"_conn{self.label}_ep{episode}",
+                                                 self.output_format, flush_interval=self.flush_interval)
+        for info in self.metrics:
+            self.metrics_writer.write(info)
+        self.metrics.clear()
+
+    def close_metrics(self) -> None:
+        """
+        Flushes and closes the metrics writer, if any, and keeps the summary of its metrics
+        """
+        if self.metrics_writer is not None:
+            self.metrics_summary = self.metrics_writer.summary()
+            self.metrics_statistics = self.metrics_writer.statistics()
+            self.metrics_writer.close()
+            self.metrics_writer = None
+
+    def _start_simulation(self) -> None:
+        """
+        Starts SUMO, or reloads it if it was kept alive. With a snapshot path, the simulation is then brought to
+        begin_time: the first time by simulating the warm up and saving its state, then by loading the saved state
+        """
+        begin_time = self.begin_time
+        if self.snapshot_path is not None:
+            # SUMO must start from 0 to simulate the warm up, begin_time is only used by the traffic signals
+            self.begin_time = 0
+        try:
+            if self.sumo is not None:
+                self._reload_simulation()
+            else:
+                super()._start_simulation()
+        finally:
+            self.begin_time = begin_time
+
+        if self.snapshot_path is None:
+            return
+
+        with self.profiler.phase('warmup'):
+            if self._load_snapshot():
+                return
+            self.sumo.simulationStep(begin_time)
+            # saved with another name and then renamed, so that other processes never load a partial file
+            temp_path = self.snapshot_path.replace('.xml.gz', f".{os.getpid()}.tmp.xml.gz")
+            self.sumo.simulation.saveState(temp_path)
+            os.replace(temp_path, self.snapshot_path)
+
+    def _load_snapshot(self) -> bool:
+        """
+        Loads the snapshot of the warm up, if it exists
+        :return: True if the snapshot was loaded, False if the warm up must be simulated
+        """
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            self.sumo.simulation.loadState(self.snapshot_path)
+        except Exception:
+            # evicted by another process after the existence check, since the net or route file changed
+            if os.path.exists(self.snapshot_path):
+                raise
+            return False
+        return True
+
+    def _reload_simulation(self) -> None:
+        """
+        Reloads the running SUMO with the options SumoEnvironment._start_simulation starts it with, which is much
+        faster than starting a new process
+        """
+        args = ["-n", self._net, "-r", self._route,
+                "--max-depart-delay", str(self.max_depart_delay),
+                "--waiting-time-memory", str(self.waiting_time_memory),
+                "--time-to-teleport", str(self.time_to_teleport)]
+        if self.begin_time > 0:
+            args += ["-b", str(self.begin_time)]
+        if self.sumo_seed == "random":
+            args.append("--random")
+        else:
+            args += ["--seed", str(self.sumo_seed)]
+        if not self.sumo_warnings:
+            args.append("--no-warnings")
+        if self.additional_sumo_cmd is not None:
+            args += self.additional_sumo_cmd.split()
+        if self.use_gui:
+            args += ["--start", "--quit-on-end"]
+
+        with self.profiler.phase('reload'):
+            # libsumo has a single simulation per process, TraCI reloads the one of this connection
+            if sumo_env_module.LIBSUMO:
+                self.sumo.simulation.load(args)
+            else:
+                self.sumo.load(args)
+
+    def _sumo_step(self) -> None:
+        with self.profiler.phase('sumo_step'):
+            super()._sumo_step()
+
+    def _compute_observations(self) -> dict:
+        with self.profiler.phase('observations'):
+            return super()._compute_observations()
+
+    def _compute_rewards(self) -> dict:
+        with self.profiler.phase('rewards'):
+            return super()._compute_rewards()
+
+    def _compute_info(self) -> dict:
+        """
+        Computes the info of the current step, streaming it to the metrics writer if one is open.
+        Infos are dropped instead of buffered if self.buffer_metrics is False
+        :return: dict containing the info
+        """
+        with self.profiler.phase('info'):
+            info = super()._compute_info()
+            if self.metrics_writer is not None:
+                self.metrics_writer.write(self.metrics.pop())
+            elif not self.buffer_metrics:
+                self.metrics.clear()
+        return info
+
+    def fast_forward(self, seconds: float) -> None:
+        """
+        Advances the simulation by seconds (at most until the end of the episode) with a single SUMO call.
+        Traffic signals are not updated, so it's only meant for fixed cycle
+        :param seconds: simulated seconds to advance
+        """
+        with self.profiler.phase('sumo_step'):
+            self.sumo.simulationStep(min(self.sim_step + seconds, self.sim_max_time))
+
+    def compute_system_metrics(self, metrics: list[str] = None) -> dict:
+        """
+        Computes only the requested system metrics of the current step, the same computed by _compute_info,
+        and stores them like it does. Vehicle speeds and waiting times are only queried if needed
+        :param metrics: metrics in config_values.Metric to compute, None for all of them
+        :return: dict containing the step and the metrics
+        """
+        with self.profiler.phase('info'):
+            info = {'step': self.sim_step}
+            metrics = set(metrics) if metrics is not None else None
+            vehicles = self.sumo.vehicle.getIDList()
+
+            if metrics is None or metrics & {'system_total_stopped', 'system_mean_speed'}:
+                speeds = [self.sumo.vehicle.getSpeed(vehicle) for vehicle in vehicles]
+                if metrics is None or 'system_total_stopped' in metrics:
+                    # In SUMO, a vehicle is considered halting if its speed is below 0.1 m/s
+                    info['system_total_stopped'] = sum(int(speed < 0.1) for speed in speeds)
+                if metrics is None or 'system_mean_speed' in metrics:
+                    info['system_mean_speed'] = 0.0 if len(vehicles) == 0 else np.mean(speeds)
+
+            if metrics is None or metrics & {'system_total_waiting_time', 'system_mean_waiting_time'}:
+                waiting_times = [self.sumo.vehicle.getWaitingTime(vehicle) for vehicle in vehicles]
+                if metrics is None or 'system_total_waiting_time' in metrics:
+                    info['system_total_waiting_time'] = sum(waiting_times)
+                if metrics is None or 'system_mean_waiting_time' in metrics:
+                    info['system_mean_waiting_time'] = 0.0 if len(vehicles) == 0 else np.mean(waiting_times)
+
+            if self.metrics_writer is not None:
+                self.metrics_writer.write(info)
+            elif self.buffer_metrics:
+                self.metrics.append(info)
+        return info
+
+    def save_csv(self, out_csv_name: str, episode: int) -> None:
+        """
+        Saves the infos of the episode. If they were streamed, it just closes the metrics writer
+        :param out_csv_name: path of the csv file, without connection, episode and extension
+        :param episode: number of the episode
+        """
+        with self.profiler.phase('save_csv'):
+            if self.metrics_writer is not None:
+                self.close_metrics()
+            else:
+                super().save_csv(out_csv_name, episode)
+
+    def close(self) -> None:
+        """
+        Closes the simulation, unless it's kept alive, and flushes the metrics streamed so far
+        """
+        if not self.keep_alive:
+            super().close()
+        self.close_metrics()
+
+    def shutdown(self) -> None:
+        """
+        Closes the simulation even if it's kept alive, and flushes the metrics streamed so far
+        """
+        super().close()
+        self.close_metrics()
+
+    def __del__(self) -> None:
+        self.shutdown()
 
 
 class CustomEnvironment:
@@ -14,7 +257,13 @@ class CustomEnvironment:
                  min_green: int,
                  max_green: int,
                  yellow_time: int,
-                 delta_time: int) -> None:
+                 delta_time: int,
+                 libsumo: bool = False,
+                 flush_interval: int = 1000,
+                 output_format: str = 'csv',
+                 warmup: int = 0,
+                 snapshot_dir: str = 'output/snapshots',
+                 net_file: str = 'big-intersection/BI.net.xml') -> None:
         """
         CustomEnvironment constructor
         :param route_file: Path to the route file
@@ -24,6 +273,13 @@ class CustomEnvironment:
         :param max_green: maximum time for green phase
         :param yellow_time: time for yellow phase
         :param delta_time: time used per step
+        :param libsumo: if True, SUMO runs in process through libsumo (when available) instead of TraCI
+        :param flush_interval: number of metrics rows buffered before being written to the csv files
+        :param output_format: format of the metrics files, one of config_values.OutputFormat
+        :param warmup: simulated seconds before the start of every episode, 0 for no warm up. The state
+                       after the warm up is saved in snapshot_dir and loaded by the following episodes
+        :param snapshot_dir: directory containing the snapshots of the warmed up simulations
+        :param net_file: path to the net file
         """
         self.route_file = route_file
         self.gui = gui
@@ -32,15 +288,28 @@ class CustomEnvironment:
         self.max_green = max_green
         self.yellow_time = yellow_time
         self.delta_time = delta_time
+        self.libsumo = libsumo
+        self.flush_interval = flush_interval
+        self.output_format = output_format
+        self.warmup = warmup
+        self.snapshot_cache = SnapshotCache(snapshot_dir)
+        self.net_file = net_file
 
-    def get_sumo_env(self, fixed: bool) -> SumoEnvironment:
+    def get_sumo_env(self, fixed: bool, sumo_seed: int | str = 'random', single_agent: bool = True,
+                     keep_alive: bool = False) -> CustomSumoEnvironment:
         """
         Get the sumo custom
         :param fixed: True for fixed cycle, False for learning agent
-        :return: Corresponding SumoEnvironment
+        :param sumo_seed: seed used by SUMO, 'random' for a random seed at every episode
+        :param single_agent: if True, only the first traffic signal is controlled through the gym interface,
+                             otherwise actions, observations and rewards are dicts with an entry per traffic signal
+        :param keep_alive: if True, SUMO is reloaded on reset instead of restarted, and stopped by shutdown only
+        :return: Corresponding CustomSumoEnvironment
         """
-        return SumoEnvironment(
-            net_file="big-intersection/BI.net.xml",
+        self.uses_libsumo()
+
+        return CustomSumoEnvironment(
+            net_file=self.net_file,
             route_file=self.route_file,
             use_gui=self.gui,
             num_seconds=self.num_seconds,
@@ -51,5 +320,68 @@ class CustomEnvironment:
             fixed_ts=fixed,
             add_per_agent_info=False,
             sumo_warnings=False,
-            single_agent=True,
+            single_agent=single_agent,
+            sumo_seed=sumo_seed,
+            flush_interval=self.flush_interval,
+            output_format=self.output_format,
+            begin_time=self.warmup,
+            snapshot_path=self.get_snapshot_path(sumo_seed),
+            keep_alive=keep_alive,
         )
+
+    def get_snapshot_path(self, sumo_seed: int | str = 'random') -> str | None:
+        """
+        Path of the snapshot of the warm up of the simulations with a SUMO seed
+        :param sumo_seed: seed used by SUMO, 'random' for a random seed at every episode
+        :return: path of the snapshot, None if there is no warm up
+        """
+        if self.warmup <= 0:
+            return None
+        # the warm up runs before the traffic signals are set up, so it only depends on SUMO's inputs
+        return self.snapshot_cache.get_path(self.net_file, self.route_file, {
+            'warmup': self.warmup,
+            'sumo_seed': sumo_seed if sumo_seed != 'random' else None
+        })
+
+    def uses_libsumo(self) -> bool:
+        """
+        Selects the backend used by the SumoEnvironments created from now on in this process.
+        libsumo is used if it was requested and it can be imported, otherwise it falls back to TraCI.
+        libsumo doesn't support the gui, so TraCI is always used when gui is True
+        :return: True if libsumo is the selected backend, False if TraCI is
+        """
+        use_libsumo = self.libsumo
+        if use_libsumo and self.gui:
+            warnings.warn('libsumo does not support the gui, falling back to TraCI')
+            use_libsumo = False
+        if use_libsumo:
+            try:
+                import libsumo
+            except ImportError:
+                warnings.warn('libsumo is not available, falling back to TraCI')
+                use_libsumo = False
+
+        # sumo_rl picks its backend once, at import time, from this variable and the module globals below.
+        # The variable is kept in sync so that subprocesses importing sumo_rl make the same choice
+        if use_libsumo:
+            os.environ['LIBSUMO_AS_TRACI'] = '1'
+            sumo_env_module.traci = libsumo
+        else:
+            os.environ.pop('LIBSUMO_AS_TRACI', None)
+            sumo_env_module.traci = traci
+        sumo_env_module.LIBSUMO = use_libsumo
+
+        return use_libsumo
+
+    def get_sumo_vec_env(self, fixed: bool, num_envs: int, sumo_seed: int | str = 'random') -> SubprocVecEnv:
+        """
+        Get num_envs sumo environments, each one stepping in its own subprocess with its own SUMO instance.
+        With a 'random' seed every environment draws a new seed at every episode, as a single environment does,
+        otherwise environment i uses sumo_seed + i, so that the environments still generate different traffic
+        :param fixed: True for fixed cycle, False for learning agent
+        :param num_envs: number of environments to run in parallel
+        :param sumo_seed: seed used by SUMO, 'random' for a random seed at every episode
+        :return: SubprocVecEnv wrapping the environments
+        """
+        seeds = ['random'] * num_envs if sumo_seed == 'random' else [sumo_seed + i for i in range(num_envs)]
+        return SubprocVecEnv([partial(self.get_sumo_env, fixed, seed) for seed in seeds])
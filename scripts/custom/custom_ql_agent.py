@@ -0,0 +1,326 @@
+import copy
+import numpy as np
+
+from gymnasium import spaces
+from sumo_rl.exploration import EpsilonGreedy
+
+
+class ArrayQTable:
+    """
+    Q-table storing the values of all the states in a single 2d numpy array. Each encoded state gets
+    a dense integer id from a hash index, which is its row in the array. Rows are allocated doubling
+    the capacity, so adding a state is amortized O(1).
+    It supports q_table[state] like the dict used by sumo_rl's QLAgent, so it works with its exploration strategies
+    """
+
+    def __init__(self, n_actions: int, capacity: int = 1024):
+        """
+        ArrayQTable constructor
+        :param n_actions: number of actions
+        :param capacity: number of states allocated at the beginning
+        """
+        self.n_actions = n_actions
+        self.index: dict[tuple, int] = {}
+        self.states: list[tuple] = []
+        self.values = np.zeros((capacity, n_actions))
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, state: tuple) -> bool:
+        return state in self.index
+
+    def __getitem__(self, state: tuple) -> np.ndarray:
+        """
+        Q-values of a state, the state is added if it's not in the table yet
+        :param state: encoded state
+        :return: view of the row of the state
+        """
+        return self.values[self.get_id(state)]
+
+    def get_id(self, state: tuple) -> int:
+        """
+        Id of a state, the state is added if it's not in the table yet
+        :param state: encoded state
+        :return: row of the state in self.values
+        """
+        state_id = self.index.get(state)
+        if state_id is None:
+            state_id = len(self.states)
+            if state_id == len(self.values):
+                self._grow()
+            self.index[state] = state_id
+            self.states.append(state)
+        return state_id
+
+    def greedy_actions(self, state_ids: np.ndarray) -> np.ndarray:
+        """
+        Best actions of many states at once
+        :param state_ids: ids of the states
+        :return: array containing the action with the highest value for each state
+        """
+        return self.values[state_ids].argmax(axis=1)
+
+    def _grow(self) -> None:
+        """
+        Doubles the number of allocated states
+        """
+        values = np.zeros((2 * len(self.values), self.n_actions))
+        values[:len(self.values)] = self.values
+        self.values = values
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Arrays representing the table, used to save it
+        :return: dict containing the encoded states (one per row) and their values
+        """
+        return {
+            'states': np.asarray(self.states, dtype=np.int64).reshape(len(self.states), -1),
+            'values': self.values[:len(self.states)]
+        }
+
+    @classmethod
+    def from_arrays(cls, states: np.ndarray, values: np.ndarray) -> 'ArrayQTable':
+        """
+        Builds a table from the arrays returned by to_arrays
+        :param states: encoded states, one per row
+        :param values: values of the states, one row per state
+        :return: ArrayQTable object
+        """
+        table = cls(values.shape[1], max(len(values), 1))
+        table.values[:len(values)] = values
+        table.states = [tuple(state) for state in states.tolist()]
+        table.index = {state: state_id for state_id, state in enumerate(table.states)}
+        return table
+
+    @classmethod
+    def from_dict(cls, q_table: dict, n_actions: int) -> 'ArrayQTable':
+        """
+        Builds a table from a dict mapping states to lists of values, as the one of sumo_rl's QLAgent
+        :param q_table: dict containing the q-table
+        :param n_actions: number of actions
+        :return: ArrayQTable object
+        """
+        table = cls(n_actions, max(len(q_table), 1))
+        for state, values in q_table.items():
+            table[state][:] = values
+        return table
+
+
+class ArrayQLAgent:
+    """
+    Q-Learning agent with the same interface of sumo_rl's QLAgent, backed by an ArrayQTable
+    """
+
+    def __init__(self, starting_state: tuple, state_space: spaces.Space, action_space: spaces.Discrete,
+                 alpha: float = 0.5, gamma: float = 0.95, exploration_strategy=EpsilonGreedy(),
+                 q_table: ArrayQTable = None):
+        """
+        ArrayQLAgent constructor
+        :param starting_state: encoded starting state
+        :param state_space: observation space of the environment
+        :param action_space: action space of the environment
+        :param alpha: learning rate
+        :param gamma: discount factor
+        :param exploration_strategy: exploration strategy, e.g. sumo_rl's EpsilonGreedy
+        :param q_table: table to start from, a new one is created if None
+        """
+        self.state = starting_state
+        self.state_space = state_space
+        self.action_space = action_space
+        self.action = None
+        self.alpha = alpha
+        self.gamma = gamma
+        self.q_table = q_table if q_table is not None else ArrayQTable(action_space.n)
+        self.exploration = exploration_strategy
+        self.acc_reward = 0
+        self._state_id = self.q_table.get_id(self.state)
+
+    def act(self) -> int:
+        """
+        Chooses an action for the current state
+        :return: chosen action
+        """
+        self.action = self.exploration.choose(self.q_table, self.state, self.action_space)
+        return self.action
+
+    def observe(self, state: tuple) -> None:
+        """
+        Moves to a new state without learning, e.g. when testing or after a reset
+        :param state: encoded state
+        """
+        self.state = state
+        self._state_id = self.q_table.get_id(state)
+
+    def learn(self, next_state: tuple, reward: float, done: bool = False) -> None:
+        """
+        Updates the value of the last action taken and moves to next_state
+        :param next_state: encoded state reached
+        :param reward: reward received
+        :param done: whether the episode is over, unused like in sumo_rl's QLAgent
+        """
+        next_state_id = self.q_table.get_id(next_state)
+        values = self.q_table.values
+
+        values[self._state_id, self.action] += self.alpha * (
+            reward + self.gamma * values[next_state_id].max() - values[self._state_id, self.action])
+
+        self.state = next_state
+        self._state_id = next_state_id
+        self.acc_reward += reward
+
+
+class SharedArrayQLAgent:
+    """
+    Q-Learning agent controlling many traffic signals with a single ArrayQTable, so every signal learns from the
+    experience of all the others. All the signals act with a single table lookup and their updates are applied
+    together, as a batch. Signals must have the same observation and action spaces
+    """
+
+    def __init__(self, starting_states: dict[str, tuple], action_space: spaces.Discrete, alpha: float = 0.5,
+                 gamma: float = 0.95, exploration_strategy=EpsilonGreedy(), q_table: ArrayQTable = None):
+        """
+        SharedArrayQLAgent constructor
+        :param starting_states: encoded starting state of each traffic signal
+        :param action_space: action space of the traffic signals
+        :param alpha: learning rate
+        :param gamma: discount factor
+        :param exploration_strategy: sumo_rl's EpsilonGreedy, its epsilon decays once per step of all the signals
+        :param q_table: table to start from, a new one is created if None
+        """
+        self.action_space = action_space
+        self.alpha = alpha
+        self.gamma = gamma
+        self.q_table = q_table if q_table is not None else ArrayQTable(action_space.n)
+        self.exploration = exploration_strategy
+        self.actions: dict[str, int] = {}
+        self.acc_reward = 0
+        self.states: dict[str, tuple] = {}
+        self._state_ids: dict[str, int] = {}
+        self._acting: list[str] = []
+        self.observe(starting_states)
+
+    def observe(self, states: dict[str, tuple]) -> None:
+        """
+        Moves the traffic signals to their new states without learning. Only the signals in states act next
+        :param states: encoded state of each traffic signal
+        """
+        self.states.update(states)
+        self._state_ids.update({ts: self.q_table.get_id(state) for ts, state in states.items()})
+        self._acting = list(states)
+
+    def act(self) -> dict[str, int]:
+        """
+        Chooses an action for each acting traffic signal, epsilon greedy
+        :return: dict containing the action of each acting traffic signal
+        """
+        state_ids = np.array([self._state_ids[ts] for ts in self._acting], dtype=np.int64)
+        actions = self.q_table.greedy_actions(state_ids)
+        explore = np.random.rand(len(actions)) < self.exploration.epsilon
+        actions[explore] = np.random.randint(self.action_space.n, size=int(explore.sum()))
+
+        exploration = self.exploration
+        exploration.epsilon = max(exploration.epsilon * exploration.decay, exploration.min_epsilon)
+        self.actions = dict(zip(self._acting, actions.tolist()))
+        return self.actions
+
+    def learn(self, next_states: dict[str, tuple], rewards: dict[str, float]) -> None:
+        """
+        Updates the values of the last actions of the traffic signals in next_states, all at once, and moves
+        them to their new states
+        :param next_states: encoded state reached by each traffic signal
+        :param rewards: reward received by each traffic signal
+        """
+        ts_ids = [ts for ts in next_states if ts in self.actions]
+        state_ids = np.array([self._state_ids[ts] for ts in ts_ids], dtype=np.int64)
+        actions = np.array([self.actions[ts] for ts in ts_ids], dtype=np.int64)
+        reward = np.array([rewards[ts] for ts in ts_ids])
+        # the new states are added first, since adding states can reallocate the values
+        next_state_ids = np.array([self.q_table.get_id(next_states[ts]) for ts in ts_ids], dtype=np.int64)
+        values = self.q_table.values
+
+        # signals in the same state taking the same action add up their updates
+        np.add.at(values, (state_ids, actions), self.alpha * (
+            reward + self.gamma * values[next_state_ids].max(axis=1) - values[state_ids, actions]))
+
+        self.acc_reward += reward.sum()
+        self.observe(next_states)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Arrays representing the learned values, used to save them
+        :return: dict containing the arrays
+        """
+        return dict(self.q_table.to_arrays(), epsilon=self.exploration.epsilon)
+
+
+class IndependentArrayQLAgents:
+    """
+    Independent Q-Learning agents, one ArrayQLAgent with its own table and exploration per traffic signal,
+    with the same interface of SharedArrayQLAgent
+    """
+
+    def __init__(self, starting_states: dict[str, tuple], action_space: spaces.Discrete, alpha: float = 0.5,
+                 gamma: float = 0.95, exploration_strategy=EpsilonGreedy(), q_tables: dict[str, ArrayQTable] = None):
+        """
+        IndependentArrayQLAgents constructor
+        :param starting_states: encoded starting state of each traffic signal
+        :param action_space: action space of the traffic signals
+        :param alpha: learning rate
+        :param gamma: discount factor
+        :param exploration_strategy: sumo_rl's EpsilonGreedy, copied for each traffic signal
+        :param q_tables: table to start from of each traffic signal, new ones are created if None
+        """
+        q_tables = q_tables if q_tables is not None else {}
+        self.agents = {
+            ts: ArrayQLAgent(starting_state=state, state_space=None, action_space=action_space, alpha=alpha,
+                             gamma=gamma, exploration_strategy=copy.copy(exploration_strategy),
+                             q_table=q_tables.get(ts))
+            for ts, state in starting_states.items()
+        }
+        self.alpha = alpha
+        self.gamma = gamma
+        self.exploration = exploration_strategy
+        self._acting = list(starting_states)
+
+    @property
+    def acc_reward(self) -> float:
+        return sum(agent.acc_reward for agent in self.agents.values())
+
+    def observe(self, states: dict[str, tuple]) -> None:
+        """
+        Moves the traffic signals to their new states without learning. Only the signals in states act next
+        :param states: encoded state of each traffic signal
+        """
+        for ts, state in states.items():
+            self.agents[ts].observe(state)
+        self._acting = list(states)
+
+    def act(self) -> dict[str, int]:
+        """
+        Chooses an action for each acting traffic signal with its own agent
+        :return: dict containing the action of each acting traffic signal
+        """
+        return {ts: self.agents[ts].act() for ts in self._acting}
+
+    def learn(self, next_states: dict[str, tuple], rewards: dict[str, float]) -> None:
+        """
+        Updates the agent of each traffic signal in next_states
+        :param next_states: encoded state reached by each traffic signal
+        :param rewards: reward received by each traffic signal
+        """
+        for ts, state in next_states.items():
+            if self.agents[ts].action is not None:
+                self.agents[ts].learn(state, rewards[ts])
+        self.observe(next_states)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Arrays representing the learned values, used to save them. The arrays of the i-th traffic signal
+        end with _<i>, in the order of self.agents
+        :return: dict containing the arrays
+        """
+        arrays = {'epsilon': np.array([agent.exploration.epsilon for agent in self.agents.values()])}
+        for i, agent in enumerate(self.agents.values()):
+            arrays.update({f"{key}_{i}": array for key, array in agent.q_table.to_arrays().items()})
+        return arrays
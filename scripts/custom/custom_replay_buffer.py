@@ -0,0 +1,328 @@
+import numpy as np
+
+from gymnasium import spaces
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+
+def get_memory_footprint(buffer: ReplayBuffer) -> int:
+    """
+    Bytes allocated by the arrays of a replay buffer, including the observations of the episode starts and the
+    priorities of the custom buffers
+    :param buffer: ReplayBuffer object
+    :return: number of bytes
+    """
+    footprint = sum(value.nbytes for value in vars(buffer).values() if isinstance(value, np.ndarray))
+    if isinstance(buffer, CompactReplayBuffer):
+        footprint += sum(obs.nbytes for obs in buffer.start_observations.values())
+    if isinstance(buffer, PrioritizedReplayBuffer):
+        footprint += buffer.priorities.tree.nbytes
+    return footprint
+
+
+class CompactReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer storing every observation once: the observation of a transition is the next observation of the
+    previous transition of the same environment, so only the first observations of the episodes are stored apart.
+    Observations of bounded spaces, like the ones of SUMO-RL in [0, 1], are stored as float16, actions in the
+    smallest integer type and dones as booleans. Compared to the default buffer of stable-baselines3 it takes about
+    a quarter of the memory, and unlike its optimize_memory_usage it handles episode ends and timeouts.
+    The oldest transition of a full buffer is never sampled, since its observation has been overwritten
+    """
+
+    def __init__(self, buffer_size: int, observation_space: spaces.Box, action_space: spaces.Discrete,
+                 device: str = 'auto', n_envs: int = 1, optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True):
+        """
+        CompactReplayBuffer constructor, with the arguments stable-baselines3 passes to its replay buffers
+        :param buffer_size: maximum number of transitions stored, over all the environments
+        :param observation_space: observation space of the environments
+        :param action_space: action space of the environments
+        :param device: PyTorch device of the sampled batches
+        :param n_envs: number of environments
+        :param optimize_memory_usage: ignored, observations are always shared
+        :param handle_timeout_termination: if True, episodes ended by the time limit aren't treated as terminal
+        """
+        # the arrays of ReplayBuffer are replaced, so only the ones of BaseBuffer are initialized
+        super(ReplayBuffer, self).__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = False
+        self.handle_timeout_termination = handle_timeout_termination
+
+        self.obs_dtype = self._get_obs_dtype(observation_space)
+        # next observation of each transition, which is also the observation of the following one
+        self.next_observations = np.zeros((self.buffer_size, n_envs, *self.obs_shape), dtype=self.obs_dtype)
+        # True where the observation isn't the previous next observation, i.e. at the start of an episode
+        self.starts = np.zeros((self.buffer_size, n_envs), dtype=bool)
+        self.start_observations: dict[tuple[int, int], np.ndarray] = {}
+        self.actions = np.zeros((self.buffer_size, n_envs, self.action_dim),
+                                dtype=np.min_scalar_type(action_space.n - 1))
+        self.rewards = np.zeros((self.buffer_size, n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, n_envs), dtype=bool)
+        self.timeouts = np.zeros((self.buffer_size, n_envs), dtype=bool)
+        # next observation of the last transition of each environment, None before the first one
+        self._last_next_observations = None
+
+    @staticmethod
+    def _get_obs_dtype(observation_space: spaces.Box) -> np.dtype:
+        """
+        Type used to store the observations: float16 if the observation space is bounded within its range,
+        the type of the space otherwise
+        :param observation_space: observation space of the environments
+        :return: numpy dtype
+        """
+        float16 = np.finfo(np.float16)
+        if observation_space.is_bounded() and observation_space.low.min() >= float16.min \
+                and observation_space.high.max() <= float16.max:
+            return np.dtype(np.float16)
+        return observation_space.dtype
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray, reward: np.ndarray, done: np.ndarray,
+            infos: list[dict]) -> None:
+        """
+        Adds a transition of every environment
+        :param obs: observation of each environment
+        :param next_obs: next observation of each environment, the terminal one if the episode ended
+        :param action: action taken in each environment
+        :param reward: reward of each environment
+        :param done: whether the episode of each environment ended
+        :param infos: info of each environment
+        """
+        obs = np.asarray(obs).reshape((self.n_envs, *self.obs_shape)).astype(self.obs_dtype)
+        next_obs = np.asarray(next_obs).reshape((self.n_envs, *self.obs_shape)).astype(self.obs_dtype)
+
+        # episodes can also be restarted without being done, e.g. by a new call to learn, so the observations
+        # are compared instead of relying on done
+        if self._last_next_observations is None:
+            starts = np.ones(self.n_envs, dtype=bool)
+        else:
+            starts = (obs != self._last_next_observations).reshape(self.n_envs, -1).any(axis=1)
+
+        for env_idx in range(self.n_envs):
+            self.start_observations.pop((self.pos, env_idx), None)
+            if starts[env_idx]:
+                self.start_observations[(self.pos, env_idx)] = obs[env_idx].copy()
+
+        self.starts[self.pos] = starts
+        self.next_observations[self.pos] = next_obs
+        self.actions[self.pos] = np.asarray(action).reshape((self.n_envs, self.action_dim))
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        if self.handle_timeout_termination:
+            self.timeouts[self.pos] = [info.get('TimeLimit.truncated', False) for info in infos]
+        self._last_next_observations = next_obs
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def sample(self, batch_size: int, env: VecNormalize = None) -> ReplayBufferSamples:
+        """
+        Samples transitions uniformly, never the oldest one of a full buffer
+        :param batch_size: number of transitions
+        :param env: VecNormalize normalizing the observations and rewards, if any
+        :return: ReplayBufferSamples object
+        """
+        if self.full:
+            batch_inds = (np.random.randint(1, self.buffer_size, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch_inds = np.random.randint(0, self.pos, size=batch_size)
+        return self._get_samples(batch_inds, np.random.randint(0, self.n_envs, size=batch_size), env)
+
+    def _get_samples(self, batch_inds: np.ndarray, env_indices: np.ndarray = None,
+                     env: VecNormalize = None) -> ReplayBufferSamples:
+        """
+        Builds the batch of some transitions
+        :param batch_inds: positions of the transitions
+        :param env_indices: environments of the transitions, random if None
+        :param env: VecNormalize normalizing the observations and rewards, if any
+        :return: ReplayBufferSamples object
+        """
+        if env_indices is None:
+            env_indices = np.random.randint(0, self.n_envs, size=len(batch_inds))
+
+        obs = self.next_observations[(batch_inds - 1) % self.buffer_size, env_indices]
+        for i in np.flatnonzero(self.starts[batch_inds, env_indices]):
+            obs[i] = self.start_observations[(batch_inds[i], env_indices[i])]
+
+        data = (
+            self._normalize_obs(obs.astype(np.float32), env),
+            self.actions[batch_inds, env_indices].astype(np.int64),
+            self._normalize_obs(self.next_observations[batch_inds, env_indices].astype(np.float32), env),
+            # only the dones not due to timeouts are terminal
+            (self.dones[batch_inds, env_indices] & ~self.timeouts[batch_inds, env_indices])
+            .astype(np.float32).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env)
+        )
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+    def reset(self) -> None:
+        """
+        Empties the buffer
+        """
+        super().reset()
+        self.start_observations.clear()
+        self._last_next_observations = None
+
+
+class SumTree:
+    """
+    Binary tree whose leaves are the priorities of the transitions and whose nodes are the sums of their
+    children, stored in a single array with the root at index 1. Updates and stratified sampling process
+    whole batches one level at a time
+    """
+
+    def __init__(self, capacity: int):
+        """
+        SumTree constructor
+        :param capacity: number of leaves
+        """
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self) -> float:
+        """
+        Sum of all the priorities
+        :return: value of the root
+        """
+        return float(self.tree[1])
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """
+        Sets the priorities of some leaves and updates the sums above them
+        :param indices: indices of the leaves, without duplicates
+        :param priorities: new priorities
+        """
+        nodes = indices + self.leaves
+        self.tree[nodes] = priorities
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Priorities of some leaves
+        :param indices: indices of the leaves
+        :return: priorities
+        """
+        return self.tree[indices + self.leaves]
+
+    def sample(self, batch_size: int) -> np.ndarray:
+        """
+        Draws leaves with probability proportional to their priority, one from each of batch_size equal
+        segments of the total
+        :param batch_size: number of leaves drawn
+        :return: indices of the leaves
+        """
+        targets = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * (self.total() / batch_size)
+        nodes = np.ones(batch_size, dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            # subtrees without priority are never entered, even when rounding errors point to them
+            right = ((targets > self.tree[left]) | (self.tree[left] == 0)) & (self.tree[left + 1] > 0)
+            targets -= self.tree[left] * right
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(CompactReplayBuffer):
+    """
+    CompactReplayBuffer sampling transitions with probability proportional to their priority raised to alpha,
+    the absolute TD error of their last update, as in Prioritized Experience Replay (Schaul et al. 2016).
+    New transitions get the highest priority seen so far, so that they're sampled at least once. Batches come
+    with the importance sampling weights correcting the bias, with exponent beta, and with the indices to pass
+    to update_priorities after the update. It's used by custom_dqn.PrioritizedDQN
+    """
+
+    def __init__(self, buffer_size: int, observation_space: spaces.Box, action_space: spaces.Discrete,
+                 device: str = 'auto', n_envs: int = 1, optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True, alpha: float = 0.6, beta: float = 0.4,
+                 epsilon: float = 1e-6):
+        """
+        PrioritizedReplayBuffer constructor, with the arguments stable-baselines3 passes to its replay buffers
+        :param buffer_size: maximum number of transitions stored, over all the environments
+        :param observation_space: observation space of the environments
+        :param action_space: action space of the environments
+        :param device: PyTorch device of the sampled batches
+        :param n_envs: number of environments
+        :param optimize_memory_usage: ignored, observations are always shared
+        :param handle_timeout_termination: if True, episodes ended by the time limit aren't treated as terminal
+        :param alpha: how much prioritization is used, 0 for uniform sampling
+        :param beta: exponent of the importance sampling weights, 1 to fully correct the bias
+        :param epsilon: added to the TD errors, so that no transition has zero probability
+        """
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs, optimize_memory_usage,
+                         handle_timeout_termination)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        # a leaf per position and environment
+        self.priorities = SumTree(self.buffer_size * n_envs)
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray, reward: np.ndarray, done: np.ndarray,
+            infos: list[dict]) -> None:
+        """
+        Adds a transition of every environment with the highest priority, and removes the priority of the oldest
+        transitions, whose observation has just been overwritten
+        :param obs: observation of each environment
+        :param next_obs: next observation of each environment, the terminal one if the episode ended
+        :param action: action taken in each environment
+        :param reward: reward of each environment
+        :param done: whether the episode of each environment ended
+        :param infos: info of each environment
+        """
+        pos = self.pos
+        super().add(obs, next_obs, action, reward, done, infos)
+
+        env_indices = np.arange(self.n_envs)
+        self.priorities.update(pos * self.n_envs + env_indices, np.full(self.n_envs, self.max_priority ** self.alpha))
+        if self.full:
+            self.priorities.update(self.pos * self.n_envs + env_indices, np.zeros(self.n_envs))
+
+    def sample(self, batch_size: int, env: VecNormalize = None) -> ReplayBufferSamples:
+        """
+        Samples transitions by priority, without the weights. Use sample_prioritized to train on them
+        :param batch_size: number of transitions
+        :param env: VecNormalize normalizing the observations and rewards, if any
+        :return: ReplayBufferSamples object
+        """
+        return self.sample_prioritized(batch_size, env)[0]
+
+    def sample_prioritized(self, batch_size: int,
+                           env: VecNormalize = None) -> tuple[ReplayBufferSamples, np.ndarray, np.ndarray]:
+        """
+        Samples transitions by priority
+        :param batch_size: number of transitions
+        :param env: VecNormalize normalizing the observations and rewards, if any
+        :return: ReplayBufferSamples object, importance sampling weights normalized by the largest one of the
+        batch, and indices of the transitions
+        """
+        indices = self.priorities.sample(batch_size)
+        probabilities = self.priorities.get(indices) / self.priorities.total()
+        # probabilities are never 0 but for rounding errors of the sum tree
+        weights = (self.size() * self.n_envs * np.maximum(probabilities, 1e-12)) ** -self.beta
+        samples = self._get_samples(indices // self.n_envs, indices % self.n_envs, env)
+        return samples, (weights / weights.max()).astype(np.float32), indices
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """
+        Sets the priorities of sampled transitions from their new TD errors
+        :param indices: indices of the transitions, as returned by sample_prioritized
+        :param td_errors: absolute TD errors of the transitions
+        """
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        # the same transition can be sampled more than once, only one of its errors is kept
+        indices, unique = np.unique(indices, return_index=True)
+        self.priorities.update(indices, priorities[unique] ** self.alpha)
+
+    def reset(self) -> None:
+        """
+        Empties the buffer
+        """
+        super().reset()
+        self.priorities = SumTree(self.buffer_size * self.n_envs)
+        self.max_priority = 1.0
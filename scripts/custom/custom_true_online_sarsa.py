@@ -1,16 +1,201 @@
+import numpy as np
 
-from linear_rl.true_online_sarsa import TrueOnlineSarsaLambda
+from itertools import combinations, product
+from gymnasium import spaces
 
 
-class TrueOnlineSarsaLambdaDecay(TrueOnlineSarsaLambda):
+class VectorizedFourierBasis:
     """
-    TrueOnlineSarsaLambda wrapper to implement epsilon greedy to SARSA
+    Fourier basis with the same coefficients, in the same order, of linear_rl's FourierBasis. The coefficient
+    matrix is built once with array operations and stored already multiplied by pi, so the features of any
+    number of states are a single matrix product
     """
 
-    def __init__(self, state_space, action_space, basis='fourier', min_max_norm=False, alpha=0.0001, lamb=0.9,
-                 gamma=0.99, epsilon=0.05, fourier_order=7, max_non_zero_fourier=2, decay=0.99, min_epsilon=0.01):
-        super().__init__(state_space, action_space, basis, min_max_norm, alpha, lamb, gamma, epsilon, fourier_order,
-                         max_non_zero_fourier)
+    def __init__(self, state_dim: int, order: int, max_non_zero: int = 2, coeff: np.ndarray = None):
+        """
+        VectorizedFourierBasis constructor
+        :param state_dim: dimension of the states
+        :param order: order of the basis
+        :param max_non_zero: maximum number of state variables combined in a basis function
+        :param coeff: coefficients to use instead of building them, e.g. the ones of a saved agent
+        """
+        self.state_dim = state_dim
+        self.order = order
+        self.max_non_zero = min(max_non_zero, state_dim)
+        self.coeff = coeff if coeff is not None else self._build_coefficients()
+        self.pi_coeff = np.pi * self.coeff
+
+    def _build_coefficients(self) -> np.ndarray:
+        """
+        Builds the coefficients: the bias, then for each number i of non-zero variables, for each combination
+        of i variables, all their values in [1, order]
+        :return: 2d array, one row per basis function
+        """
+        blocks = [np.zeros((1, self.state_dim))]
+        for i in range(1, self.max_non_zero + 1):
+            values = np.array(list(product(range(1, self.order + 1), repeat=i)))
+            for indices in combinations(range(self.state_dim), i):
+                block = np.zeros((len(values), self.state_dim))
+                block[:, indices] = values
+                blocks.append(block)
+        return np.concatenate(blocks)
+
+    def get_num_basis(self) -> int:
+        return len(self.coeff)
+
+    def get_features(self, states: np.ndarray) -> np.ndarray:
+        """
+        Features of one state, or of many states at once
+        :param states: state, or 2d array with one state per row
+        :return: features of the state, or 2d array with the features of each state
+        """
+        return np.cos(states @ self.pi_coeff.T)
+
+    def get_learning_rates(self, alpha: float) -> np.ndarray:
+        """
+        Learning rate of each basis function, alpha scaled by the norm of its coefficients
+        :param alpha: base learning rate
+        :return: array containing the learning rates
+        """
+        norms = np.linalg.norm(self.coeff, axis=1)
+        norms[norms == 0.] = 1.
+        return alpha / norms
+
+
+class FourierTrueOnlineSarsaLambda:
+    """
+    True Online SARSA(lambda) with a linear Fourier basis, equivalent to linear_rl's TrueOnlineSarsaLambda.
+    The weights and traces of all the actions are (actions, basis functions) matrices, so q-values and
+    updates of every action take a single operation, and the features of the last two states are cached
+    so that next_state's features are reused when it becomes the current state
+    """
+
+    def __init__(self, state_space: spaces.Box, action_space: spaces.Discrete, min_max_norm=False, alpha=0.0001,
+                 lamb=0.9, gamma=0.99, epsilon=0.05, fourier_order=7, max_non_zero_fourier=2,
+                 coeff: np.ndarray = None):
+        """
+        FourierTrueOnlineSarsaLambda constructor
+        :param state_space: observation space of the environment
+        :param action_space: action space of the environment
+        :param min_max_norm: if True, states are normalized with the bounds of state_space
+        :param alpha: base learning rate
+        :param lamb: trace decay
+        :param gamma: discount factor
+        :param epsilon: probability of taking a random action
+        :param fourier_order: order of the Fourier basis
+        :param max_non_zero_fourier: maximum number of state variables combined in a basis function
+        :param coeff: Fourier coefficients to use instead of building them, e.g. the ones of a saved agent
+        """
+        self.alpha = alpha
+        self.lamb = lamb
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.state_space = state_space
+        self.state_dim = state_space.shape[0]
+        self.action_space = action_space
+        self.action_dim = action_space.n
+        self.min_max_norm = min_max_norm
+        self.basis = VectorizedFourierBasis(self.state_dim, fourier_order, max_non_zero_fourier, coeff)
+        self.lr = self.basis.get_learning_rates(self.alpha)
+        self.num_basis = self.basis.get_num_basis()
+        self.et = np.zeros((self.action_dim, self.num_basis))
+        self.theta = np.zeros((self.action_dim, self.num_basis))
+        self.q_old = None
+        self.action = None
+        # (state bytes, features) of the last two states
+        self._features_cache = []
+
+    def learn(self, state: np.ndarray, action: int, reward: float, next_state: np.ndarray, done: bool) -> None:
+        """
+        True online SARSA(lambda) update of the weights of all the actions
+        :param state: state in which action was taken
+        :param action: action taken
+        :param reward: reward received
+        :param next_state: state reached
+        :param done: whether the episode is over
+        """
+        phi = self.get_features(state)
+        next_phi = self.get_features(next_state)
+        q = self.theta[action] @ phi
+        next_q = self.theta[self.get_action(next_phi)] @ next_phi if not done else 0.0
+        td_error = reward + self.gamma * next_q - q
+        if self.q_old is None:
+            self.q_old = q
+
+        trace_phi = self.et[action] @ phi
+        self.et *= self.lamb * self.gamma
+        self.et[action] += phi - (self.lr * self.gamma * self.lamb * trace_phi) * phi
+        self.theta += self.lr * (td_error + q - self.q_old) * self.et
+        self.theta[action] -= self.lr * (q - self.q_old) * phi
+
+        self.q_old = next_q
+        if done:
+            self.reset_traces()
+
+    def get_q_values(self, features: np.ndarray) -> np.ndarray:
+        """
+        Q-values of all the actions
+        :param features: features of a state, or 2d array with the features of each state
+        :return: q-values of the state, or 2d array with the q-values of each state
+        """
+        return features @ self.theta.T
+
+    def get_q_value(self, features: np.ndarray, action: int) -> float:
+        return self.theta[action] @ features
+
+    def compute_features(self, states: np.ndarray) -> np.ndarray:
+        """
+        Features of one state, or of many states at once, without caching
+        :param states: state, or 2d array with one state per row
+        :return: features of the state, or 2d array with the features of each state
+        """
+        if self.min_max_norm:
+            states = (states - self.state_space.low) / (self.state_space.high - self.state_space.low)
+        return self.basis.get_features(states)
+
+    def get_features(self, state: np.ndarray) -> np.ndarray:
+        """
+        Features of a state, reusing them if the state is one of the last two seen
+        :param state: state
+        :return: features of the state, they must not be modified
+        """
+        key = np.asarray(state).tobytes()
+        for cached_key, features in self._features_cache:
+            if cached_key == key:
+                return features
+
+        features = self.compute_features(np.asarray(state, dtype=float))
+        self._features_cache = [self._features_cache[-1], (key, features)] if self._features_cache \
+            else [(key, features)]
+        return features
+
+    def reset_traces(self) -> None:
+        self.q_old = None
+        self.et.fill(0.0)
+
+    def act(self, obs: np.ndarray) -> int:
+        return self.get_action(self.get_features(obs))
+
+    def get_action(self, features: np.ndarray) -> int:
+        """
+        Epsilon greedy action
+        :param features: features of the state
+        :return: chosen action
+        """
+        if np.random.rand() < self.epsilon:
+            return self.action_space.sample()
+        return int(self.get_q_values(features).argmax())
+
+
+class TrueOnlineSarsaLambdaDecay(FourierTrueOnlineSarsaLambda):
+    """
+    FourierTrueOnlineSarsaLambda wrapper to implement epsilon greedy to SARSA
+    """
+
+    def __init__(self, state_space, action_space, min_max_norm=False, alpha=0.0001, lamb=0.9, gamma=0.99,
+                 epsilon=0.05, fourier_order=7, max_non_zero_fourier=2, decay=0.99, min_epsilon=0.01, coeff=None):
+        super().__init__(state_space, action_space, min_max_norm, alpha, lamb, gamma, epsilon, fourier_order,
+                         max_non_zero_fourier, coeff)
         self.decay = decay
         self.min_epsilon = min_epsilon
 
@@ -18,3 +203,32 @@ class TrueOnlineSarsaLambdaDecay(TrueOnlineSarsaLambda):
         action = super().get_action(features)
         self.epsilon = max(self.epsilon * self.decay, self.min_epsilon)
         return action
+
+
+def restore_true_online_sarsa(agent_class: type, state_space: spaces.Box, action_space: spaces.Discrete,
+                              params: dict, coeff: np.ndarray, lr: np.ndarray, theta: np.ndarray,
+                              et: np.ndarray = None) -> FourierTrueOnlineSarsaLambda:
+    """
+    Rebuilds a trained FourierTrueOnlineSarsaLambda (or subclass) from its saved arrays, without computing
+    the Fourier coefficients again. The given arrays are used as they are, so memory-mapped arrays are not copied
+    :param agent_class: FourierTrueOnlineSarsaLambda or one of its subclasses
+    :param state_space: observation space of the environment
+    :param action_space: action space of the environment
+    :param params: scalar attributes of the agent, e.g. alpha, gamma, epsilon, lamb, fourier_order
+    :param coeff: Fourier coefficients, one row per basis function
+    :param lr: learning rate of each basis function
+    :param theta: weights, one row per action
+    :param et: eligibility traces, one row per action. If None, they start from zero
+    :return: agent_class object
+    """
+    params = dict(params)
+    q_old = params.pop('q_old', None)
+
+    agent = agent_class(state_space, action_space, coeff=coeff, **params)
+    agent.lr = lr
+    agent.theta = theta
+    if et is not None:
+        agent.et = et
+    agent.q_old = q_old
+
+    return agent
@@ -1,7 +1,12 @@
 
+import itertools
+import random
+import numpy as np
 import yaml
 
-from scripts.utils.config_values import Metric, TrafficType, AgentType
+from scripts.utils.config_values import Metric, TrafficType, AgentType, OutputFormat, Aggregation, ProfilingMode, \
+    SearchMode, ConfidenceLevel, ReplayBufferType, ServedAgentType
+from scripts.utils.scenario_generator import Movements
 
 
 class ConfigsParser:
@@ -10,6 +15,7 @@ class ConfigsParser:
     to check the config format to avoid errors during learning phase.
     It only checks if the mandatory parameters are set, if there are other
     useless parameters, they won't be considered at all.
+    Sweeps in Agent_settings are expanded into instances before the checks.
     """
 
     def __init__(self, yaml_file: str):
@@ -49,6 +55,11 @@ class ConfigsParser:
         temp_plotter_config = configs['Plotter_settings']
         temp_la_configs = configs['Agent_settings']
 
+        if 'Sweeps' in temp_la_configs:
+            if not all(self._check_sweep(sweep) for sweep in temp_la_configs['Sweeps'].values()):
+                raise Exception('bad config file format')
+            self._expand_sweeps(temp_la_configs)
+
         if not (self._check_plotter_config(temp_plotter_config) and
                 self._check_learning_agents_config(temp_la_configs)):
             raise Exception('bad config file format')
@@ -69,6 +80,17 @@ class ConfigsParser:
             return False
         if not all(item in Metric for item in configs['Metrics']):
             return False
+        if 'Workers' in configs and configs['Workers'] < 1:
+            return False
+        if 'Aggregation' in configs:
+            if configs['Aggregation'] not in Aggregation:
+                return False
+            if 'Window' not in configs:
+                return False
+            if configs['Window'] < 1:
+                return False
+            if 'Max_points' in configs and configs['Max_points'] < 1:
+                return False
 
         return True
 
@@ -82,6 +104,24 @@ class ConfigsParser:
             return False
         if 'Output_model' not in configs:
             return False
+        if 'Workers' in configs and configs['Workers'] < 1:
+            return False
+        if 'Flush_interval' in configs and configs['Flush_interval'] < 1:
+            return False
+        if 'Output_format' in configs and configs['Output_format'] not in OutputFormat:
+            return False
+        if 'Checkpoint_interval' in configs and configs['Checkpoint_interval'] < 1:
+            return False
+        if 'Profiling' in configs and configs['Profiling'] not in ProfilingMode:
+            return False
+        if 'Results_index' in configs and not isinstance(configs['Results_index'], str):
+            return False
+        if 'Early_stopping' in configs and not self._check_early_stopping(configs['Early_stopping']):
+            return False
+        if 'Convergence' in configs and not self._check_convergence(configs['Convergence']):
+            return False
+        if 'Evaluation' in configs and not self._check_evaluation(configs['Evaluation']):
+            return False
 
         if 'Environment' not in configs:
             return False
@@ -95,17 +135,27 @@ class ConfigsParser:
                 return False
             if instance['Agent_type'] not in AgentType:
                 return False
-            if instance['Agent_type'] == 'QL':
-                return self._check_ql(instance)
-            if instance['Agent_type'] == 'DQN':
-                return self._check_dqn(instance)
-            if instance['Agent_type'] == 'SARSA':
-                return self._check_sarsa(instance)
-            if instance['Agent_type'] == 'SARSA_decay':
-                return self._check_sarsa_decay(instance)
-            if instance['Agent_type'] == 'FIXED':
-                return self._check_fixed(instance)
-        return False
+            if 'Sumo_seed' in instance and not isinstance(instance['Sumo_seed'], int):
+                return False
+            if 'Inference_server' in instance and not self._check_inference_server(instance):
+                return False
+            # every instance is checked, sweeps can expand into many of them
+            if instance['Agent_type'] == 'QL' and not self._check_ql(instance):
+                return False
+            if instance['Agent_type'] == 'DQN' and not self._check_dqn(instance):
+                return False
+            if instance['Agent_type'] == 'SARSA' and not self._check_sarsa(instance):
+                return False
+            if instance['Agent_type'] == 'SARSA_decay' and not self._check_sarsa_decay(instance):
+                return False
+            if instance['Agent_type'] == 'QL_multi' and not self._check_ql_multi(instance):
+                return False
+            if instance['Agent_type'] == 'FIXED' and not self._check_fixed(instance):
+                return False
+            # the single agent interface only controls the first traffic signal of a grid
+            if 'Network' in configs['Environment'] and instance['Agent_type'] not in ('FIXED', 'QL_multi'):
+                return False
+        return len(configs['Instances']) > 0
 
     def _check_environment(self, config: dict) -> bool:
         """
@@ -140,6 +190,71 @@ class ConfigsParser:
             return False
         if config['Delta_time'] < config['Yellow_time']:
             return False
+        if 'Libsumo' in config and not isinstance(config['Libsumo'], bool):
+            return False
+        if 'Warmup' in config and config['Warmup'] < 0:
+            return False
+        if 'Network' in config and not self._check_network(config['Network']):
+            return False
+        if config['Traffic_type'] == 'scenario' and not self._check_scenario(config.get('Scenario'),
+                                                                             'Network' not in config):
+            return False
+
+        return True
+
+    def _check_network(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid generated grid network
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if not isinstance(config, dict):
+            return False
+        if 'Grid_size' not in config:
+            return False
+        # junctions are named with a letter per column
+        if not (1 <= config['Grid_size'] <= 26):
+            return False
+        if 'Length' in config and config['Length'] <= 0:
+            return False
+        if 'Lanes' in config and config['Lanes'] < 1:
+            return False
+
+        return True
+
+    def _check_scenario(self, config: dict, big_intersection: bool = True) -> bool:
+        """
+        Checks if config represents a valid traffic scenario
+        :param config: dict representing the config
+        :param big_intersection: if True, the movements are checked against the ones of big-intersection,
+                                 otherwise they're checked when the network is generated
+        :return: True if valid, False otherwise
+        """
+
+        if not isinstance(config, dict):
+            return False
+        if 'Demand' in config and config['Demand'] < 0:
+            return False
+        if 'Movements' in config:
+            if not isinstance(config['Movements'], dict):
+                return False
+            for movement, demand in config['Movements'].items():
+                if (big_intersection and movement not in Movements) or demand < 0:
+                    return False
+        if 'Profile' in config:
+            if not isinstance(config['Profile'], list) or not config['Profile']:
+                return False
+            for point in config['Profile']:
+                if not isinstance(point, list) or len(point) != 2 or point[1] < 0:
+                    return False
+            times = [time for time, _ in config['Profile']]
+            if times != sorted(times):
+                return False
+        if 'Interval' in config and config['Interval'] <= 0:
+            return False
+        if 'Seed' in config and not isinstance(config['Seed'], int):
+            return False
 
         return True
 
@@ -178,6 +293,20 @@ class ConfigsParser:
 
         return True
 
+    def _check_ql_multi(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid QL_multi agent, which has the fields of a QL agent
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if not self._check_ql(config):
+            return False
+        if 'Shared' in config and not isinstance(config['Shared'], bool):
+            return False
+
+        return True
+
     def _check_dqn(self, config: dict) -> bool:
         """
         Checks if config represents a valid DQN agent
@@ -210,6 +339,20 @@ class ConfigsParser:
                 return False
             if not (0 <= config['Exp_fraction'] <= 1):
                 return False
+            if 'Num_envs' in config and config['Num_envs'] < 1:
+                return False
+            if 'Buffer_size' in config and config['Buffer_size'] < 1:
+                return False
+            if 'Replay_buffer' in config and config['Replay_buffer'] not in ReplayBufferType:
+                return False
+            if 'Priority_alpha' in config and not (0 <= config['Priority_alpha'] <= 1):
+                return False
+            if 'Priority_beta' in config and not (0 <= config['Priority_beta'] <= 1):
+                return False
+            if 'Update_to_data' in config and config['Update_to_data'] <= 0:
+                return False
+            if 'Sync_interval' in config and config['Sync_interval'] < 1:
+                return False
 
         return True
 
@@ -290,8 +433,186 @@ class ConfigsParser:
             return False
         if config['Runs'] <= 0:
             return False
+        if 'Fast_forward' in config and not isinstance(config['Fast_forward'], bool):
+            return False
+        if 'Sample_interval' in config and config['Sample_interval'] <= 0:
+            return False
+
+        return True
+
+    def _check_inference_server(self, config: dict) -> bool:
+        """
+        Checks if config represents an agent that can be tested through an inference server
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if config['Agent_type'] not in ServedAgentType:
+            return False
+        if not isinstance(config['Inference_server'], str):
+            return False
+        if 'Inference_authkey' not in config:
+            return False
+        if not isinstance(config['Inference_authkey'], str) or not config['Inference_authkey']:
+            return False
+
+        return True
+
+    def _check_early_stopping(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid early stopping rule for the sweeps
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if 'Metric' not in config:
+            return False
+        if config['Metric'] not in Metric:
+            return False
+        if 'Tolerance' in config and config['Tolerance'] < 0:
+            return False
+        if 'Min_episodes' in config and config['Min_episodes'] < 1:
+            return False
 
         return True
 
+    def _check_convergence(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid convergence monitor
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
 
+        if 'Metric' not in config:
+            return False
+        if config['Metric'] not in Metric:
+            return False
+        if 'Window' in config and config['Window'] < 1:
+            return False
+        if 'Threshold' in config and config['Threshold'] < 0:
+            return False
+        if 'Divergence_limit' in config and (isinstance(config['Divergence_limit'], bool)
+                                             or not isinstance(config['Divergence_limit'], (int, float))):
+            return False
+        if 'Patience' in config and config['Patience'] < 1:
+            return False
 
+        return True
+
+    def _check_evaluation(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid seeded evaluation
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if 'Seeds' in config:
+            seeds = config['Seeds']
+            if isinstance(seeds, int):
+                if seeds < 1:
+                    return False
+            elif not isinstance(seeds, list) or not seeds or not all(isinstance(seed, int) for seed in seeds):
+                return False
+        if 'Traffic_types' in config:
+            if not isinstance(config['Traffic_types'], list) or not config['Traffic_types']:
+                return False
+            if any(traffic_type not in TrafficType for traffic_type in config['Traffic_types']):
+                return False
+        if 'Confidence' in config and config['Confidence'] not in ConfidenceLevel:
+            return False
+
+        return True
+
+    def _check_sweep(self, config: dict) -> bool:
+        """
+        Checks if config represents a valid sweep. The values of the parameters are checked on the
+        expanded instances
+        :param config: dict representing the config
+        :return: True if valid, False otherwise
+        """
+
+        if 'Agent_type' not in config:
+            return False
+        if config['Agent_type'] not in AgentType:
+            return False
+        if 'Search' not in config:
+            return False
+        if config['Search'] not in SearchMode:
+            return False
+        if config['Search'] == 'random' and config.get('Samples', 0) < 1:
+            return False
+        if 'Parameters' not in config or not config['Parameters']:
+            return False
+        for values in config['Parameters'].values():
+            if isinstance(values, list) and not values:
+                return False
+            if isinstance(values, dict):
+                if 'Min' not in values or 'Max' not in values:
+                    return False
+                if values['Min'] > values['Max']:
+                    return False
+                if config['Search'] == 'grid' and values.get('Num', 0) < 1:
+                    return False
+
+        return True
+
+    def _expand_sweeps(self, configs: dict) -> None:
+        """
+        Adds the instances of every sweep to the learning agents configs. Each instance has the fields of the
+        sweep but Search, Samples, Seed and Parameters, one value per parameter, and the name of its sweep in Sweep.
+        Parameters can be a single value, a list of values or a range {Min, Max, Num}: grid search tries every
+        combination, with Num evenly spaced values per range, while random search draws Samples combinations,
+        with values uniformly distributed in the ranges (integers if Min and Max are integers)
+        :param configs: dict representing the learning agents configs
+        """
+        instances = configs.setdefault('Instances', {})
+
+        for sweep_name, sweep in configs['Sweeps'].items():
+            base = {key: value for key, value in sweep.items()
+                    if key not in ('Search', 'Samples', 'Seed', 'Parameters')}
+            names = list(sweep['Parameters'])
+
+            if sweep['Search'] == 'grid':
+                values = [self._grid_values(sweep['Parameters'][name]) for name in names]
+                combinations = itertools.product(*values)
+            else:
+                rng = random.Random(sweep.get('Seed'))
+                combinations = ([self._random_value(sweep['Parameters'][name], rng) for name in names]
+                                for _ in range(sweep['Samples']))
+
+            for i, combination in enumerate(combinations):
+                instances[f"{sweep_name}_{i + 1}"] = dict(base, Sweep=sweep_name, **dict(zip(names, combination)))
+
+    @staticmethod
+    def _grid_values(values) -> list:
+        """
+        Values of a sweep parameter tried by grid search
+        :param values: single value, list of values or range {Min, Max, Num}
+        :return: list of values
+        """
+        if isinstance(values, list):
+            return values
+        if not isinstance(values, dict):
+            return [values]
+
+        grid = np.linspace(values['Min'], values['Max'], values['Num'])
+        if isinstance(values['Min'], int) and isinstance(values['Max'], int):
+            return list(dict.fromkeys(int(round(value)) for value in grid))
+        return [float(value) for value in grid]
+
+    @staticmethod
+    def _random_value(values, rng: random.Random):
+        """
+        Draws a value of a sweep parameter for random search
+        :param values: single value, list of values or range {Min, Max}
+        :param rng: random number generator
+        :return: drawn value
+        """
+        if isinstance(values, list):
+            return rng.choice(values)
+        if not isinstance(values, dict):
+            return values
+
+        if isinstance(values['Min'], int) and isinstance(values['Max'], int):
+            return rng.randint(values['Min'], values['Max'])
+        return rng.uniform(values['Min'], values['Max'])
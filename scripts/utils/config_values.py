@@ -12,14 +12,69 @@ Metric = frozenset({
 # Possible agent types for training models
 AgentType = frozenset({
     'FIXED',
+    'QL',
+    'DQN',
+    'SARSA',
+    'SARSA_decay',
+    'QL_multi'
+})
+
+# Agent types whose trained models can be served by the inference server, which answers batches of observations
+ServedAgentType = frozenset({
     'QL',
     'DQN',
     'SARSA',
     'SARSA_decay'
 })
 
-# Possible traffic types to train/test models with
+# Possible traffic types to train/test models with, 'scenario' generates the route file from the Scenario field
 TrafficType = frozenset({
     'low',
-    'high'
+    'high',
+    'scenario'
+})
+
+# Possible file formats for the metrics saved during each episode
+OutputFormat = frozenset({
+    'csv',
+    'parquet',
+    'feather'
+})
+
+# Metrics for which higher values are better, lower values are better for all the others
+MaximizedMetrics = frozenset({
+    'system_mean_speed'
+})
+
+# Possible search modes of the hyperparameter sweeps
+SearchMode = frozenset({
+    'grid',
+    'random'
+})
+
+# Possible profiling modes: per phase timings only, or per phase timings and cProfile stats
+ProfilingMode = frozenset({
+    'timing',
+    'cprofile'
+})
+
+# Possible replay buffers of DQN: stable-baselines3's one, one storing each observation once in compact types,
+# and the compact one sampling by priority
+ReplayBufferType = frozenset({
+    'default',
+    'compact',
+    'prioritized'
+})
+
+# Possible confidence levels of the intervals of the evaluations
+ConfidenceLevel = frozenset({
+    0.9,
+    0.95,
+    0.99
+})
+
+# Possible aggregation modes to downsample the lines of the plots
+Aggregation = frozenset({
+    'minmax',
+    'mean'
 })
@@ -0,0 +1,84 @@
+from scripts.utils.config_values import MaximizedMetrics
+
+
+class ConvergenceMonitor:
+    """
+    ConvergenceMonitor follows a metric of config_values.Metric during training:
+    - between episodes, it compares the rolling mean of the per episode means of the metric over the last window
+      episodes with the one over the window before: training is over when the relative improvement is below
+      threshold
+    - during an episode, it reports the episode as diverged once the metric has been worse than divergence_limit
+      for patience consecutive steps, e.g. when the queue keeps growing, so that the rest of it can be skipped
+    It's an early stopping rule for LearningAgent, and its check_step is called by the run loops at every step
+    """
+
+    def __init__(self, metric: str, window: int = 3, threshold: float = 0.01, divergence_limit: float = None,
+                 patience: int = 1):
+        """
+        ConvergenceMonitor constructor
+        :param metric: metric followed, one of config_values.Metric
+        :param window: number of episodes in the rolling mean
+        :param threshold: minimum relative improvement between two consecutive windows to continue training
+        :param divergence_limit: value of the metric beyond which a step is diverged, None to never cut episodes
+        :param patience: number of consecutive diverged steps after which an episode is cut
+        """
+        self.metric = metric
+        self.window = window
+        self.threshold = threshold
+        self.divergence_limit = divergence_limit
+        self.patience = patience
+        self.maximize = metric in MaximizedMetrics
+        self.episode_values: list[float] = []
+        # consecutive diverged steps of each environment
+        self._diverged_steps: dict[int, int] = {}
+
+    def check_step(self, info: dict, env_idx: int = 0) -> bool:
+        """
+        Checks the metric of a step
+        :param info: info of the step, containing the metric
+        :param env_idx: index of the environment, when more environments are stepped together
+        :return: True if the episode has diverged, False otherwise
+        """
+        if self.divergence_limit is None or self.metric not in info:
+            return False
+
+        value = info[self.metric]
+        if value < self.divergence_limit if self.maximize else value > self.divergence_limit:
+            self._diverged_steps[env_idx] = self._diverged_steps.get(env_idx, 0) + 1
+        else:
+            self._diverged_steps[env_idx] = 0
+        return self._diverged_steps[env_idx] >= self.patience
+
+    def improvement(self) -> float | None:
+        """
+        Relative improvement of the rolling mean of the last window episodes over the window before
+        :return: improvement, positive if the metric got better, None if there aren't two full windows yet
+        """
+        if len(self.episode_values) < 2 * self.window:
+            return None
+
+        current = sum(self.episode_values[-self.window:]) / self.window
+        previous = sum(self.episode_values[-2 * self.window:-self.window]) / self.window
+        if previous == 0:
+            # the relative change is infinite, with the sign of the change for the metric
+            if current == 0:
+                return 0.
+            return float('inf') if (current > 0) == self.maximize else float('-inf')
+
+        change = (current - previous) / abs(previous)
+        return change if self.maximize else -change
+
+    def __call__(self, episode: int, summary: dict) -> bool:
+        """
+        Records the mean of the metric over an episode and checks whether training has converged
+        :param episode: episode just completed
+        :param summary: means of the metrics of the episode
+        :return: True if training has converged, False otherwise
+        """
+        self._diverged_steps.clear()
+        if self.metric not in summary:
+            return False
+
+        self.episode_values.append(summary[self.metric])
+        improvement = self.improvement()
+        return improvement is not None and improvement < self.threshold
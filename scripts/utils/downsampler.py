@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class Downsampler:
+    """
+    Downsampler reduces a series of (step, value) points in a single streaming pass, grouping
+    consecutive points in buckets of window points each:
+    - 'minmax' keeps the minimum and the maximum point of each bucket, preserving spikes
+    - 'mean' keeps the mean point of each bucket
+    If max_points is set, whenever the buckets exceed it adjacent buckets are merged and the window
+    is doubled, so the output size is bounded no matter how long the series is.
+    """
+
+    def __init__(self, mode: str, window: int, max_points: int = None):
+        """
+        Downsampler builder
+        :param mode: 'minmax' or 'mean'
+        :param window: number of points in each bucket
+        :param max_points: maximum number of buckets to keep, None for no limit
+        """
+        self.mode = mode
+        self.window = window
+        self.max_points = max_points
+        # points not yet forming a full bucket
+        self._pending_steps = np.empty(0)
+        self._pending_values = np.empty(0)
+        # completed buckets: (min step, min value, max step, max value) for minmax, (step sum, value sum, count)
+        # for mean
+        self._buckets = [np.empty(0) for _ in range(4 if mode == 'minmax' else 3)]
+
+    def add(self, steps: np.ndarray, values: np.ndarray) -> None:
+        """
+        Adds a chunk of consecutive points
+        :param steps: steps of the points
+        :param values: values of the points
+        """
+        steps = np.concatenate((self._pending_steps, np.asarray(steps, dtype=float)))
+        values = np.concatenate((self._pending_values, np.asarray(values, dtype=float)))
+
+        full = len(steps) // self.window * self.window
+        self._pending_steps, self._pending_values = steps[full:], values[full:]
+        if full == 0:
+            return
+
+        self._append_buckets(steps[:full].reshape(-1, self.window), values[:full].reshape(-1, self.window))
+
+        while self.max_points is not None and len(self._buckets[0]) > self.max_points:
+            self._merge_buckets()
+
+    def result(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the downsampled series, including the last, partial, bucket
+        :return: steps and values of the downsampled series
+        """
+        buckets = self._buckets
+        if len(self._pending_steps) > 0:
+            pending = self._reduce(self._pending_steps.reshape(1, -1), self._pending_values.reshape(1, -1))
+            buckets = [np.concatenate((bucket, new)) for bucket, new in zip(buckets, pending)]
+
+        if self.mode == 'minmax':
+            min_steps, min_values, max_steps, max_values = buckets
+            # Each bucket gives its two points ordered by step
+            min_first = min_steps <= max_steps
+            steps = np.column_stack((np.where(min_first, min_steps, max_steps),
+                                     np.where(min_first, max_steps, min_steps))).ravel()
+            values = np.column_stack((np.where(min_first, min_values, max_values),
+                                      np.where(min_first, max_values, min_values))).ravel()
+            return steps, values
+
+        step_sums, value_sums, counts = buckets
+        return step_sums / counts, value_sums / counts
+
+    def _reduce(self, steps: np.ndarray, values: np.ndarray) -> list[np.ndarray]:
+        """
+        Reduces each row of points to a bucket
+        :param steps: 2d array, one row of steps for each bucket
+        :param values: 2d array, one row of values for each bucket
+        :return: list of the bucket arrays
+        """
+        rows = np.arange(len(steps))
+        if self.mode == 'minmax':
+            argmin, argmax = values.argmin(axis=1), values.argmax(axis=1)
+            return [steps[rows, argmin], values[rows, argmin], steps[rows, argmax], values[rows, argmax]]
+        return [steps.sum(axis=1), values.sum(axis=1), np.full(len(steps), steps.shape[1], dtype=float)]
+
+    def _append_buckets(self, steps: np.ndarray, values: np.ndarray) -> None:
+        """
+        Appends new full buckets to the completed ones
+        :param steps: 2d array, one row of steps for each bucket
+        :param values: 2d array, one row of values for each bucket
+        """
+        new_buckets = self._reduce(steps, values)
+        self._buckets = [np.concatenate((bucket, new)) for bucket, new in zip(self._buckets, new_buckets)]
+
+    def _merge_buckets(self) -> None:
+        """
+        Merges pairs of adjacent buckets and doubles the window. With an odd number of buckets, the last one
+        is kept as it is
+        """
+        paired = len(self._buckets[0]) // 2 * 2
+        head = [bucket[:paired].reshape(-1, 2) for bucket in self._buckets]
+        tail = [bucket[paired:] for bucket in self._buckets]
+
+        if self.mode == 'minmax':
+            min_steps, min_values, max_steps, max_values = head
+            rows = np.arange(len(min_values))
+            argmin, argmax = min_values.argmin(axis=1), max_values.argmax(axis=1)
+            merged = [min_steps[rows, argmin], min_values[rows, argmin],
+                      max_steps[rows, argmax], max_values[rows, argmax]]
+        else:
+            merged = [bucket.sum(axis=1) for bucket in head]
+
+        self._buckets = [np.concatenate((bucket, rest)) for bucket, rest in zip(merged, tail)]
+        self.window *= 2
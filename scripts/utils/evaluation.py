@@ -0,0 +1,160 @@
+import argparse
+import copy
+import os
+import random
+import numpy as np
+import pandas as pd
+
+from scripts.agents.learning_agent import LearningAgent
+from scripts.utils.config_values import Metric
+from scripts.utils.plotter import Plotter
+from scripts.utils.runner import Runner
+
+# Two sided critical values of Student's t distribution for 1 to 30 degrees of freedom, by confidence level.
+# Values for 30 degrees of freedom are used beyond them, which slightly widens the intervals
+_T_TABLE = {
+    0.9: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812, 1.796, 1.782, 1.771, 1.761, 1.753,
+          1.746, 1.740, 1.734, 1.729, 1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697],
+    0.95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+           2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042],
+    0.99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169, 3.106, 3.055, 3.012, 2.977, 2.947,
+           2.921, 2.898, 2.878, 2.861, 2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750]
+}
+
+
+def confidence_interval(values: list[float], confidence: float = 0.95) -> tuple[float, float]:
+    """
+    Mean of some samples and half width of its confidence interval, from Student's t distribution
+    :param values: samples, e.g. the means of a metric over the episodes of each seed
+    :param confidence: confidence level, one of config_values.ConfidenceLevel
+    :return: mean and half width, the half width is nan with less than two samples
+    """
+    mean = float(np.mean(values))
+    if len(values) < 2:
+        return mean, float('nan')
+
+    t_values = _T_TABLE[confidence]
+    t_value = t_values[min(len(values) - 1, len(t_values)) - 1]
+    return mean, float(t_value * np.std(values, ddof=1) / np.sqrt(len(values)))
+
+
+class EvaluationRunner(Runner):
+    """
+    Runner testing every instance of a config with many SUMO seeds, on one or more traffic types. Each instance
+    is expanded into the instances <instance>_seed<seed>, run in parallel if Workers > 1 and saved in the usual
+    Output_csv/<traffic type>/<instance>_seed<seed> directories. The means of the metrics over the episodes of
+    each seed are then aggregated into means and confidence intervals, written to Output_csv/evaluation_summary.csv
+    """
+
+    def __init__(self, configs: dict, plotter: Plotter):
+        """
+        EvaluationRunner constructor, agents never learn
+        :param configs: dict representing runner configurations
+        :param plotter: plotter object, only used for its metrics
+        """
+        evaluation = configs.get('Evaluation', {})
+        seeds = evaluation.get('Seeds', 10)
+        self.seeds: list[int] = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+        self.traffic_types: list[str] = evaluation.get('Traffic_types', [configs['Environment']['Traffic_type']])
+        self.confidence: float = evaluation.get('Confidence', 0.95)
+        self.instances: dict = configs['Instances']
+
+        configs = copy.deepcopy(configs)
+        configs['Instances'] = {f"{name}_seed{seed}": dict(config, Sumo_seed=seed)
+                                for name, config in self.instances.items() for seed in self.seeds}
+        super().__init__(configs, plotter, False)
+
+    def run(self) -> None:
+        """
+        runs every seed of every instance on every traffic type, then writes the summary table
+        """
+        csvs_paths = {}
+
+        for traffic_type in self.traffic_types:
+            self.configs['Environment']['Traffic_type'] = traffic_type
+            self._set_environment()
+            output_path = os.path.join(self.configs['Output_csv'], traffic_type)
+
+            print("\nEvaluating on " + traffic_type + " traffic")
+            if self.configs.get('Workers', 1) > 1:
+                csvs_paths[traffic_type] = self._run_parallel(output_path)
+            else:
+                csvs_paths[traffic_type] = self._run_instances(list(self.configs['Instances']), output_path)
+
+        summary_path = os.path.join(self.configs['Output_csv'], 'evaluation_summary.csv')
+        os.makedirs(self.configs['Output_csv'], exist_ok=True)
+        self._get_summary(csvs_paths).to_csv(summary_path, index=False)
+        print("\nSummary saved in " + summary_path)
+
+    def _run_agent(self, agent: LearningAgent, output_path: str) -> str:
+        """
+        runs an agent with the random generators seeded with its SUMO seed, so that its exploration is
+        reproducible too, then saves the summaries of its episodes in <agent>_summary.json next to its csvs
+        :param agent: agent to run
+        :param output_path: path in which to save the csvs
+        :return: path containing the csv output files
+        """
+        seed = agent.config['Sumo_seed']
+        random.seed(seed)
+        np.random.seed(seed)
+        if hasattr(agent.agent, 'set_random_seed'):
+            # stable-baselines3 models also seed torch
+            agent.agent.set_random_seed(seed)
+
+        csvs_path = super()._run_agent(agent, output_path)
+        self._save_summary(agent, csvs_path)
+
+        return csvs_path
+
+    def _get_summary(self, csvs_paths: dict[str, dict[str, str]]) -> pd.DataFrame:
+        """
+        Builds the summary table: one row per traffic type and instance, with the mean and the half width of the
+        confidence interval of each metric over the seeds. The value of a seed is the mean of the metric over its
+        episodes
+        :param csvs_paths: dict containing, for each traffic type, the expanded instances and their csvs paths
+        :return: DataFrame containing the summary
+        """
+        metrics = self.plotter.metrics if self.plotter is not None and self.plotter.metrics else sorted(Metric)
+        rows = []
+
+        for traffic_type, paths in csvs_paths.items():
+            for name, config in self.instances.items():
+                episodes = [self._read_summary(f"{name}_seed{seed}", paths[f"{name}_seed{seed}"])['episodes']
+                            for seed in self.seeds]
+                row = {
+                    'Traffic_type': traffic_type,
+                    'Instance': name,
+                    'Agent_type': config['Agent_type'],
+                    'Seeds': len(self.seeds),
+                    'Episodes': sum(len(seed_episodes) for seed_episodes in episodes)
+                }
+                for metric in metrics:
+                    values = [np.mean([episode[metric] for episode in seed_episodes])
+                              for seed_episodes in episodes if seed_episodes and metric in seed_episodes[0]]
+                    mean, half_width = confidence_interval(values, self.confidence) if values else (None, None)
+                    row[metric + '_mean'] = mean
+                    row[metric + '_ci'] = half_width
+                rows.append(row)
+
+        return pd.DataFrame(rows)
+
+
+def main() -> None:
+    from scripts.utils.config_parser import ConfigsParser
+
+    parser = argparse.ArgumentParser(description='Test every instance of a config with many seeds and summarize '
+                                                 'the metrics with confidence intervals')
+    parser.add_argument('config', help='yaml config file')
+    args = parser.parse_args()
+
+    config_parser = ConfigsParser(args.config)
+    config_parser.parse()
+
+    plotter = Plotter()
+    plotter.set_configs(config_parser.get_plotter_config())
+
+    EvaluationRunner(config_parser.get_runner_config(), plotter).run()
+
+
+if __name__ == '__main__':
+    main()
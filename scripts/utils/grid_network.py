@@ -0,0 +1,103 @@
+import os
+import string
+import subprocess
+import sumolib
+import xml.etree.ElementTree as ElementTree
+
+from scripts.utils.snapshot_cache import content_hash
+
+# Vehicles per hour entering from each approach with the traffic types of the fixed route files, the same of
+# big-intersection, where each approach has 3 movements of 50 or 150 vehicles per hour
+Approach_demand = {
+    'low': 150,
+    'high': 450
+}
+
+
+class GridNetwork:
+    """
+    GridNetwork generates, with SUMO's netgenerate, a square grid of size x size junctions, all controlled by
+    traffic signals. Every fringe junction gets an extra edge, so that vehicles enter and leave the grid through
+    dead ends. Net files are named after the hash of their parameters, so that each grid is generated once
+    and then reused
+    """
+
+    def __init__(self, directory: str, size: int, length: float = 200, lanes: int = 1):
+        """
+        GridNetwork constructor
+        :param directory: directory containing the generated net files
+        :param size: number of junctions per side
+        :param length: length of the edges in meters
+        :param lanes: number of lanes of the edges
+        """
+        self.directory = directory
+        self.size = size
+        self.length = length
+        self.lanes = lanes
+
+    def get_ts_ids(self) -> list[str]:
+        """
+        Ids of the junctions controlled by traffic signals, named by netgenerate after their column (letter)
+        and row (number)
+        :return: list of the ids
+        """
+        return [column + str(row) for column in string.ascii_uppercase[:self.size] for row in range(self.size)]
+
+    def get_net_file(self) -> str:
+        """
+        Path of the net file of the grid, generated if it doesn't exist yet
+        :return: path of the net file
+        """
+        params = {'size': self.size, 'length': self.length, 'lanes': self.lanes}
+        path = os.path.join(self.directory, f"grid_{self.size}x{self.size}_{content_hash([], params)}.net.xml")
+
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            # written to a temporary file first, so that parallel workers never read a partial net file
+            tmp_path = path.replace('.net.xml', f".{os.getpid()}.tmp.net.xml")
+            subprocess.run([
+                sumolib.checkBinary('netgenerate'),
+                '--grid',
+                '--grid.number', str(self.size),
+                '--grid.length', str(self.length),
+                '--grid.attach-length', str(self.length),
+                '--default.lanenumber', str(self.lanes),
+                '--tls.set', ','.join(self.get_ts_ids()),
+                '--no-turnarounds', 'true',
+                '--no-warnings', 'true',
+                '--output-file', tmp_path
+            ], check=True, stdout=subprocess.DEVNULL)
+            os.replace(tmp_path, path)
+
+        return path
+
+    def get_movements(self) -> dict[str, tuple[str, str]]:
+        """
+        Movements of the grid, for scenario_generator.ScenarioGenerator: one from every edge entering the grid
+        to every edge leaving it, except the one back to the same dead end
+        :return: first and last edge of each movement, named <first edge>_<last edge>
+        """
+        ts_ids = set(self.get_ts_ids())
+        sources, sinks = [], []
+
+        for edge in ElementTree.parse(self.get_net_file()).getroot().iter('edge'):
+            if edge.get('function') == 'internal':
+                continue
+            if edge.get('from') not in ts_ids:
+                sources.append(edge)
+            elif edge.get('to') not in ts_ids:
+                sinks.append(edge)
+
+        return {source.get('id') + '_' + sink.get('id'): (source.get('id'), sink.get('id'))
+                for source in sources for sink in sinks if sink.get('to') != source.get('from')}
+
+    def get_scenario(self, traffic_type: str) -> dict:
+        """
+        Scenario equivalent to the fixed route files of a traffic type: every approach gets the same vehicles per
+        hour of an approach of big-intersection, split evenly among its movements
+        :param traffic_type: 'low' or 'high'
+        :return: dict representing the scenario
+        """
+        movements = self.get_movements()
+        sources = {origin for origin, _ in movements.values()}
+        return {'Demand': Approach_demand[traffic_type] * len(sources) / len(movements)}
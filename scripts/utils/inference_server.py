@@ -0,0 +1,262 @@
+import argparse
+import ipaddress
+import queue
+import secrets
+import socket
+import threading
+import time
+import numpy as np
+
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from scripts.agents.learning_agent import LearningAgent
+from scripts.utils.config_values import ServedAgentType
+
+
+class InferenceServer:
+    """
+    InferenceServer answers action requests for a trained agent loaded once. Requests submitted
+    concurrently, in process or through a local socket, are micro-batched: the observations collected
+    within max_delay seconds (up to max_batch of them) are answered with a single call to the agent's
+    predict_batch, i.e. one forward pass or table lookup.
+    """
+
+    def __init__(self, agent: LearningAgent, max_batch: int = 64, max_delay: float = 0.002):
+        """
+        InferenceServer builder
+        :param agent: trained agent, with a predict_batch method
+        :param max_batch: maximum number of observations answered together
+        :param max_delay: maximum time in seconds to wait for other requests once one is received
+        """
+        if not hasattr(agent, 'predict_batch'):
+            raise TypeError(agent.__class__.__name__ + ' does not support batched predictions, possible agent types: '
+                            + ', '.join(sorted(ServedAgentType)))
+        self.agent = agent
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._requests = queue.Queue()
+        self._batcher = None
+        self._serving = None
+
+    def start(self) -> None:
+        """
+        Starts the thread batching the requests
+        """
+        if self._batcher is None:
+            self._batcher = threading.Thread(target=self._batch_loop, daemon=True)
+            self._batcher.start()
+
+    def stop(self) -> None:
+        """
+        Stops the batching thread and the socket listener, if any
+        """
+        if self._serving is not None:
+            # accept doesn't return when the listener is closed by another thread, so it is woken up by a connection
+            address, authkey = self._serving
+            self._serving = None
+            Client(address, authkey=authkey).close()
+        if self._batcher is not None:
+            self._requests.put(None)
+            self._batcher.join()
+            self._batcher = None
+
+    def submit(self, observation: np.ndarray) -> Future:
+        """
+        Submits an action request
+        :param observation: observation of the environment
+        :return: future holding the chosen action
+        """
+        future = Future()
+        self._requests.put((np.asarray(observation), future))
+        return future
+
+    def act(self, observation: np.ndarray) -> int:
+        """
+        Chooses the action for an observation, waiting for the batch containing it
+        :param observation: observation of the environment
+        :return: chosen action
+        """
+        return self.submit(observation).result()
+
+    def serve(self, address: tuple[str, int] | str, authkey: bytes) -> None:
+        """
+        Accepts InferenceClient connections on a local socket until stop is called. Each connection is
+        handled by its own thread, and its requests are batched together with all the others. The requests are
+        unpickled, so only the clients knowing authkey are accepted
+        :param address: (host, port) tuple, or path of a unix socket
+        :param authkey: key the clients must use to connect
+        """
+        if not authkey:
+            raise ValueError('an authkey is required to serve')
+        self.start()
+        self._serving = (address, authkey)
+
+        with Listener(address, authkey=authkey) as listener:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, ConnectionError):
+                    # a client with a wrong key, or gone during the handshake, is refused without stopping the server
+                    continue
+                if self._serving is None:
+                    connection.close()
+                    break
+                threading.Thread(target=self._handle_connection, args=(connection,), daemon=True).start()
+
+    def _handle_connection(self, connection) -> None:
+        """
+        Answers the requests of a client until it disconnects
+        :param connection: connection to the client
+        """
+        with connection:
+            while True:
+                try:
+                    observation = connection.recv()
+                except EOFError:
+                    break
+                connection.send(self.act(observation))
+
+    def _batch_loop(self) -> None:
+        """
+        Collects requests into batches and answers them
+        """
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+
+            batch = [request]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                batch.append(request)
+
+            try:
+                actions = self.agent.predict_batch(np.stack([observation for observation, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), action in zip(batch, actions):
+                future.set_result(int(action))
+
+
+class InferenceClient:
+    """
+    InferenceClient requests actions to an InferenceServer serving on a local socket
+    """
+
+    def __init__(self, address: tuple[str, int] | str, authkey: bytes):
+        """
+        InferenceClient builder
+        :param address: address the server is listening on
+        :param authkey: key used by the server
+        """
+        self._connection = Client(address, authkey=authkey)
+
+    def act(self, observation: np.ndarray) -> int:
+        """
+        Chooses the action for an observation
+        :param observation: observation of the environment
+        :return: chosen action
+        """
+        self._connection.send(np.asarray(observation))
+        return self._connection.recv()
+
+    def close(self) -> None:
+        """
+        Closes the connection to the server
+        """
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_address(address: str) -> tuple[str, int] | str:
+    """
+    Parses the address of an inference server
+    :param address: '<host>:<port>', or path of a unix socket
+    :return: (host, port) tuple, or path of the unix socket
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def is_loopback(host: str) -> bool:
+    """
+    Checks whether a host name resolves to a loopback address
+    :param host: host name or IP address
+    :return: True if only this machine can reach it, False otherwise
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def main() -> None:
+    from scripts.utils.config_parser import ConfigsParser
+    from scripts.utils.runner import Runner
+
+    parser = argparse.ArgumentParser(description='Serve the greedy actions of a trained model on a local socket')
+    parser.add_argument('config', help='yaml config file containing the instance')
+    parser.add_argument('instance', help='name of the instance to serve, it must have the Model field')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6000)
+    parser.add_argument('--authkey', default=None,
+                        help='key the clients must use, a random one is generated and printed if missing')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay', type=float, default=0.002, help='seconds to wait to fill a batch')
+    args = parser.parse_args()
+    # the requests are unpickled, so a server reachable from other machines must not use a key printed on its console
+    if args.authkey is None and not is_loopback(args.host):
+        parser.error('--authkey is required to serve on a non loopback host')
+
+    config_parser = ConfigsParser(args.config)
+    config_parser.parse()
+    configs = config_parser.get_runner_config()
+    if args.instance not in configs['Instances']:
+        parser.error('no instance ' + args.instance + ' in ' + args.config)
+    # checked before starting SUMO, the other agents don't support batched predictions
+    if configs['Instances'][args.instance]['Agent_type'] not in ServedAgentType:
+        parser.error(configs['Instances'][args.instance]['Agent_type'] + ' agents can\'t be served, possible types: '
+                     + ', '.join(sorted(ServedAgentType)))
+
+    # The environment is only needed to know the spaces of the agent, its simulation is closed right away. A test
+    # runner keeps SUMO alive across agents, so it's shut down rather than closed
+    runner = Runner(configs, None, False)
+    agent = runner._build_agent(args.instance, configs['Instances'][args.instance])
+    runner._close_shared_env()
+
+    authkey = args.authkey
+    if authkey is None:
+        authkey = secrets.token_bytes(16).hex()
+        print("Generated authkey: " + authkey)
+
+    server = InferenceServer(agent, args.max_batch, args.max_delay)
+    print(f"Serving {args.instance} on {args.host}:{args.port}")
+    try:
+        server.serve((args.host, args.port), authkey.encode())
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
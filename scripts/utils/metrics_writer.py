@@ -0,0 +1,203 @@
+import csv
+import os
+
+from scripts.utils.config_values import Metric
+
+
+class MetricsWriter:
+    """
+    MetricsWriter streams per step metrics to a csv file. Rows are kept in memory only until
+    flush_interval of them have been collected, then they are appended to the file, so memory
+    stays flat for arbitrarily long episodes and a crash loses at most flush_interval rows.
+    It also keeps the running mean, minimum and maximum of every column, so the episode can be summarized without
+    reading the file back.
+    """
+
+    def __init__(self, path: str, columns: list[str] = None, flush_interval: int = 1000):
+        """
+        MetricsWriter builder
+        :param path: path of the file to write
+        :param columns: columns to write, other keys of the rows are ignored. If None, the keys of
+                        the first row are used
+        :param flush_interval: number of rows buffered before being written to the file
+        """
+        self.path = path
+        self.columns = columns
+        self.flush_interval = flush_interval
+        self.rows = []
+        self._file = None
+        self._writer = None
+        self._sums: dict[str, float] = {}
+        self._counts: dict[str, int] = {}
+        self._mins: dict[str, float] = {}
+        self._maxs: dict[str, float] = {}
+
+    def write(self, row: dict) -> None:
+        """
+        Adds a row to the file, flushing the buffered rows if flush_interval is reached
+        :param row: dict mapping columns to values
+        """
+        self.rows.append(row)
+        for column, value in row.items():
+            if column in self._counts:
+                self._sums[column] += value
+                self._counts[column] += 1
+                if value < self._mins[column]:
+                    self._mins[column] = value
+                elif value > self._maxs[column]:
+                    self._maxs[column] = value
+            else:
+                self._sums[column] = value
+                self._counts[column] = 1
+                self._mins[column] = self._maxs[column] = value
+        if len(self.rows) >= self.flush_interval:
+            self.flush()
+
+    def summary(self) -> dict[str, float]:
+        """
+        Mean of every column over the rows written so far
+        :return: dict mapping columns to their mean
+        """
+        return {column: total / self._counts[column] for column, total in self._sums.items()}
+
+    def statistics(self) -> dict[str, dict[str, float]]:
+        """
+        Mean, minimum and maximum of every column over the rows written so far
+        :return: dict mapping columns to a dict containing their mean, min and max
+        """
+        return {column: {'mean': total / self._counts[column], 'min': self._mins[column], 'max': self._maxs[column]}
+                for column, total in self._sums.items()}
+
+    def flush(self) -> None:
+        """
+        Writes the buffered rows to the file
+        """
+        if not self.rows:
+            return
+
+        if self._writer is None:
+            self._open()
+        self._write_rows()
+        self.rows = []
+
+    def close(self) -> None:
+        """
+        Flushes the buffered rows and closes the file. The file is created even if no row was written
+        """
+        self.flush()
+        if self._writer is None and self.columns is not None:
+            self._open()
+        if self._writer is not None:
+            self._close()
+            self._writer = None
+
+    def _open(self) -> None:
+        """
+        Creates the file and writes the header
+        """
+        if self.columns is None:
+            self.columns = list(self.rows[0])
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def _write_rows(self) -> None:
+        """
+        Appends the buffered rows to the file
+        """
+        self._writer.writerows(self.rows)
+        self._file.flush()
+
+    def _close(self) -> None:
+        """
+        Closes the file
+        """
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ColumnarMetricsWriter(MetricsWriter):
+    """
+    ColumnarMetricsWriter streams the step and the metrics in config_values.Metric to a typed, columnar
+    parquet or feather file. Each flush is appended as a row group (parquet) or record batch (feather).
+    It needs pyarrow to be installed.
+    """
+
+    # columns stored as integers, all the others are stored as floats
+    _Integer_columns = frozenset({'system_total_stopped'})
+
+    def __init__(self, path: str, output_format: str, flush_interval: int = 1000):
+        """
+        ColumnarMetricsWriter builder
+        :param path: path of the file to write
+        :param output_format: 'parquet' or 'feather'
+        :param flush_interval: number of rows buffered before being written to the file
+        """
+        super().__init__(path, ['step'] + sorted(Metric), flush_interval)
+        self.output_format = output_format
+        self._schema = None
+
+    def _open(self) -> None:
+        """
+        Creates the file with the schema of the metric columns
+        """
+        import pyarrow as pa
+
+        self._schema = pa.schema([(column, pa.int64() if column in self._Integer_columns else pa.float64())
+                                  for column in self.columns])
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        else:
+            self._writer = pa.ipc.new_file(self.path, self._schema)
+
+    def _write_rows(self) -> None:
+        """
+        Appends the buffered rows to the file
+        """
+        import pyarrow as pa
+
+        self._writer.write_table(pa.Table.from_pylist(self.rows, schema=self._schema))
+
+    def _close(self) -> None:
+        """
+        Closes the file
+        """
+        self._writer.close()
+
+
+def get_metrics_writer(path: str, output_format: str = 'csv', columns: list[str] = None,
+                       flush_interval: int = 1000) -> MetricsWriter:
+    """
+    Builds the metrics writer for the given format
+    :param path: path of the file to write, without extension
+    :param output_format: one of config_values.OutputFormat
+    :param columns: columns to write, only used by csv since columnar formats write the metric columns
+    :param flush_interval: number of rows buffered before being written to the file
+    :return: MetricsWriter object
+    """
+    if output_format == 'csv':
+        return MetricsWriter(path + '.csv', columns, flush_interval)
+    return ColumnarMetricsWriter(path + '.' + output_format, output_format, flush_interval)
+
+
+def merge_statistics(statistics: list[dict[str, dict[str, float]]]) -> dict[str, dict[str, float]]:
+    """
+    Merges the statistics of writers of the same number of rows, e.g. the environments of a VecEnv
+    :param statistics: statistics of each writer, as returned by MetricsWriter.statistics
+    :return: dict mapping columns to a dict containing their mean, min and max over all the writers
+    """
+    return {column: {'mean': sum(stats[column]['mean'] for stats in statistics) / len(statistics),
+                     'min': min(stats[column]['min'] for stats in statistics),
+                     'max': max(stats[column]['max'] for stats in statistics)}
+            for column in statistics[0]}
@@ -1,11 +1,15 @@
 
 import os
+import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
 from re import split
 from os import listdir
-from os.path import join, isdir
+from os.path import join, isdir, splitext
+from scripts.utils.config_values import OutputFormat
+from scripts.utils.downsampler import Downsampler
 
 
 class Plotter:
@@ -32,20 +36,34 @@ class Plotter:
         'size': 18,
     }
 
-    def __init__(self, output=None, metrics=None, width=3840, height=1080):
+    # number of rows read at once from a metrics file when aggregating
+    _chunk_size = 50000
+
+    def __init__(self, output=None, metrics=None, width=3840, height=1080, workers=1, aggregation=None, window=1,
+                 max_points=None):
         """
         Plotter builder
         :param output: path to output file
         :param metrics: metric to use for plotting data
         :param width: output image width in pixels
         :param height: output image height in pixels
+        :param workers: number of processes used to render the plots of the metrics
+        :param aggregation: None to plot every point, 'minmax' or 'mean' to downsample each line (see Downsampler)
+        :param window: number of points aggregated in each bucket
+        :param max_points: maximum number of buckets per line, None for no limit
         """
         self.output = output
         self.height = height / 96
         self.width = width / 96
+        self.workers = workers
+        self.aggregation = aggregation
+        self.window = window
+        self.max_points = max_points
         self.df = []
         self.csv_files = []
         self.metrics = metrics
+        # dict mapping each file already read to its modification time, the aggregation settings and its content
+        self._cache: dict[str, tuple[float, tuple, pd.DataFrame | dict]] = {}
 
     def set_configs(self, configs) -> None:
         """
@@ -57,25 +75,101 @@ class Plotter:
             self.height = configs['Height'] / 96
         if 'Width' in configs:
             self.width = configs['Width'] / 96
+        if 'Workers' in configs:
+            self.workers = configs['Workers']
+        if 'Aggregation' in configs:
+            self.aggregation = configs['Aggregation']
+            self.window = configs['Window']
+            self.max_points = configs.get('Max_points')
         self.metrics = configs['Metrics']
 
+    @staticmethod
+    def is_metrics_file(path: str) -> bool:
+        """
+        is_metrics_file checks if a file is a metrics file, in any of the formats in config_values.OutputFormat
+        :param path: path of the file
+        :return: True if the extension of the file is a supported output format, False otherwise
+        """
+        return splitext(path)[1][1:] in OutputFormat
+
     def add_csv(self, input_path) -> None:
         """
-        add_csv adds one (or more) csv file to the csv collection
-        :param input_path: can be a dir with multiple csv files or a single csv file
+        add_csv adds one (or more) metrics file (csv, parquet or feather) to the csv collection
+        :param input_path: can be a dir with multiple metrics files or a single metrics file
         """
-        if input_path.endswith('.csv'):
+        if self.is_metrics_file(input_path):
             self.csv_files.append(input_path)
         elif isdir(input_path):
             self.csv_files.extend(join(input_path, f) for f in listdir(input_path)
-                                  if join(input_path, f).endswith('.csv'))
+                                  if self.is_metrics_file(f))
 
     def read_csvs(self) -> None:
         """
-        read_csvs loads the content of the csv in the dataframe collection
+        read_csvs loads the content of the metrics files in the dataframe collection.
+        If aggregation is set, each file is downsampled while it is read, and the collection holds a dict
+        mapping each metric to its (steps, values) arrays instead of the whole dataframe.
+        Each file is parsed only once, as long as it and the settings don't change, then its content is
+        taken from the cache
         """
+        settings = (self.aggregation, self.window, self.max_points, tuple(self.metrics or ()))
+
         for csv in self.csv_files:
-            self.df.append(pd.read_csv(csv))
+            mtime = os.path.getmtime(csv)
+            cached = self._cache.get(csv)
+            if cached is None or cached[0] != mtime or cached[1] != settings:
+                if self.aggregation is None:
+                    cached = (mtime, settings, self._read_file(csv))
+                else:
+                    cached = (mtime, settings, self._aggregate_file(csv))
+                self._cache[csv] = cached
+            self.df.append(cached[2])
+
+    def _aggregate_file(self, path: str) -> dict[str, tuple]:
+        """
+        _aggregate_file downsamples each metric of a file in a single streaming pass over its rows
+        :param path: path of the file
+        :return: dict mapping each metric to the steps and values of its downsampled line
+        """
+        samplers = {metric: Downsampler(self.aggregation, self.window, self.max_points) for metric in self.metrics}
+
+        for chunk in self._iter_chunks(path, ['step'] + list(self.metrics)):
+            steps = chunk['step'].to_numpy()
+            for metric, sampler in samplers.items():
+                sampler.add(steps, chunk[metric].to_numpy())
+
+        return {metric: sampler.result() for metric, sampler in samplers.items()}
+
+    def _iter_chunks(self, path: str, columns: list[str]):
+        """
+        _iter_chunks reads the given columns of a metrics file in chunks of rows
+        :param path: path of the file
+        :param columns: columns to read
+        :return: generator of dataframes
+        """
+        output_format = splitext(path)[1][1:]
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=self._chunk_size, columns=columns):
+                yield batch.to_pandas()
+        elif output_format == 'feather':
+            # feather files are memory mapped, so they are read at once
+            yield pd.read_feather(path, columns=columns)
+        else:
+            yield from pd.read_csv(path, usecols=columns, chunksize=self._chunk_size)
+
+    @staticmethod
+    def _read_file(path: str) -> pd.DataFrame:
+        """
+        _read_file reads a metrics file, choosing the reader from its extension
+        :param path: path of the file
+        :return: dataframe with the content of the file
+        """
+        output_format = splitext(path)[1][1:]
+        if output_format == 'parquet':
+            return pd.read_parquet(path)
+        if output_format == 'feather':
+            return pd.read_feather(path)
+        return pd.read_csv(path)
 
     def build_plot(self, out_folder: str = None) -> None:
         """
@@ -93,29 +187,67 @@ class Plotter:
 
         self.read_csvs()
 
-        # For each metric, build and save corresponding plot
-        for metric in self.metrics:
-            fig = plt.figure(figsize=(self.width, self.height))
+        # Using regex split to remove file path and keep only file name
+        legend = [split(r'[/\\]', item)[-1] for item in self.csv_files]
+        out_path = self._get_out_path(out_folder)
 
-            plt.title(self._Titles[metric], fontdict=self._labels_font)
-            plt.xlabel('step', fontdict=self._labels_font)
-            plt.ylabel(self._Ylabels[metric], fontdict=self._labels_font)
+        plots = [(metric,
+                  [self._get_line(data, metric) for data in self.df],
+                  legend,
+                  (self.width, self.height),
+                  out_path + '/' + metric) for metric in self.metrics]
 
-            for data in self.df:
-                plt.plot(data.get('step'), data.get(metric))
+        # For each metric, build and save corresponding plot, in parallel if more workers are set
+        if self.workers > 1 and len(plots) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(plots)),
+                                     initializer=_use_non_interactive_backend) as pool:
+                list(pool.map(Plotter._render_plot, *zip(*plots)))
+        else:
+            for plot in plots:
+                self._render_plot(*plot)
+
+    @staticmethod
+    def _get_line(data: pd.DataFrame | dict, metric: str) -> tuple:
+        """
+        _get_line returns the points of a metric from an element of the dataframe collection
+        :param data: dataframe, or dict of aggregated lines
+        :param metric: metric to plot
+        :return: steps and values of the line
+        """
+        if isinstance(data, dict):
+            return data[metric]
+        return data['step'].to_numpy(), data[metric].to_numpy()
+
+    @staticmethod
+    def _render_plot(metric: str, lines: list, legend: list[str], figsize: tuple[float, float],
+                     output_file: str) -> None:
+        """
+        _render_plot renders the plot of a metric and saves it. It is static so that it can run in worker processes
+        :param metric: metric used in plot. Needed to set title and labels
+        :param lines: list of (steps, values) pairs, one for each line to plot
+        :param legend: label of each line
+        :param figsize: size of the figure in inches
+        :param output_file: file in which to save the plot
+        """
+        fig = plt.figure(figsize=figsize)
+
+        plt.title(Plotter._Titles[metric], fontdict=Plotter._labels_font)
+        plt.xlabel('step', fontdict=Plotter._labels_font)
+        plt.ylabel(Plotter._Ylabels[metric], fontdict=Plotter._labels_font)
 
-            # Using regex split to remove file path and keep only file name
-            plt.legend([split(r'[/\\]', item)[-1] for item in self.csv_files], loc="upper right")
+        for steps, values in lines:
+            plt.plot(steps, values)
 
-            self._save_plot(fig, metric, out_folder)
-            plt.close()
+        plt.legend(legend, loc="upper right")
 
-    def _save_plot(self, fig: plt.figure, metric: str, out_folder: str) -> None:
+        fig.savefig(output_file, dpi=96)
+        plt.close(fig)
+
+    def _get_out_path(self, out_folder: str) -> str:
         """
-        save_plot saves the plot following the format in input
-        :param fig: figure to save
-        :param metric: metric used in plot. Needed to set file name
+        _get_out_path creates the folder in which to save the plots
         :param out_folder: folder in which to save the plots
+        :return: path of the folder
         """
         if out_folder is not None:
             out_path = os.path.join(self.output, out_folder)
@@ -124,8 +256,7 @@ class Plotter:
 
         os.makedirs(out_path, exist_ok=True)
 
-        output_file = out_path + '/' + metric
-        fig.savefig(output_file, dpi=96)
+        return out_path
 
     def clear(self) -> None:
         """
@@ -133,3 +264,16 @@ class Plotter:
         """
         self.csv_files = []
         self.df = []
+
+    def clear_cache(self) -> None:
+        """
+        clear_cache drops the content of all the files read so far
+        """
+        self._cache = {}
+
+
+def _use_non_interactive_backend() -> None:
+    """
+    Initializer of the rendering worker processes, they only save figures to file
+    """
+    matplotlib.use('Agg')
@@ -0,0 +1,178 @@
+import cProfile
+import json
+import os
+import time
+
+from contextlib import nullcontext
+from typing import Callable
+
+
+class _PhaseTimer:
+    """
+    Context manager adding the time spent inside it to a phase of a StepProfiler
+    """
+
+    def __init__(self, totals: list[float]):
+        """
+        _PhaseTimer constructor
+        :param totals: [seconds, count] of the phase, updated in place
+        """
+        self.totals = totals
+        self._start = 0.
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.totals[0] += time.perf_counter() - self._start
+        self.totals[1] += 1
+
+
+class StepProfiler:
+    """
+    StepProfiler records the time spent and the number of calls of each phase of a run (e.g. sumo_step, act,
+    learn), in total and per episode, together with the simulated seconds per wall second.
+    When disabled, phase returns a shared no-op context manager, so the instrumentation can stay in the run loops.
+    Other profilers (e.g. cProfile, or a sampling profiler) can be attached with add_hook, so that they only cover
+    the run of the agent
+    """
+
+    _Null_phase = nullcontext()
+
+    def __init__(self, enabled: bool = False, cprofile: bool = False):
+        """
+        StepProfiler constructor
+        :param enabled: if False, nothing is recorded
+        :param cprofile: if True, cProfile runs between start and stop, and its stats are saved with the summary
+        """
+        self.enabled = enabled
+        self._totals: dict[str, list[float]] = {}
+        self._timers: dict[str, _PhaseTimer] = {}
+        self._episodes = []
+        self._hooks: list[tuple[Callable[[], None], Callable[[], None]]] = []
+        self._start = None
+        self._wall_seconds = 0.
+        self._episode_start = None
+        self._episode_totals = {}
+
+        self._cprofile = None
+        if enabled and cprofile:
+            self._cprofile = cProfile.Profile()
+            self.add_hook(self._cprofile.enable, self._cprofile.disable)
+
+    def add_hook(self, start: Callable[[], None], stop: Callable[[], None]) -> None:
+        """
+        Adds a profiler to start and stop together with this one
+        :param start: function called by start
+        :param stop: function called by stop
+        """
+        self._hooks.append((start, stop))
+
+    def phase(self, name: str):
+        """
+        Context manager timing a phase
+        :param name: name of the phase
+        :return: context manager
+        """
+        if not self.enabled:
+            return self._Null_phase
+
+        timer = self._timers.get(name)
+        if timer is None:
+            self._totals[name] = [0., 0]
+            timer = self._timers[name] = _PhaseTimer(self._totals[name])
+        return timer
+
+    def start(self) -> None:
+        """
+        Starts measuring the run and the hooked profilers
+        """
+        if not self.enabled:
+            return
+        self._start = time.perf_counter()
+        self.start_episode()
+        for start, _ in self._hooks:
+            start()
+
+    def stop(self) -> None:
+        """
+        Stops measuring the run and the hooked profilers
+        """
+        if not self.enabled or self._start is None:
+            return
+        for _, stop in reversed(self._hooks):
+            stop()
+        self._wall_seconds += time.perf_counter() - self._start
+        self._start = None
+
+    def start_episode(self) -> None:
+        """
+        Starts measuring a new episode. It is called by start and end_episode, so the agents only need to
+        call end_episode
+        """
+        self._episode_start = time.perf_counter()
+        self._episode_totals = {name: totals.copy() for name, totals in self._totals.items()}
+
+    def end_episode(self, episode: int, sim_seconds: float) -> None:
+        """
+        Records the breakdown of the episode just finished and starts measuring the next one
+        :param episode: number of the episode
+        :param sim_seconds: simulated seconds in the episode
+        """
+        if not self.enabled:
+            return
+
+        wall_seconds = time.perf_counter() - self._episode_start
+        self._episodes.append({
+            'episode': episode,
+            'wall_seconds': wall_seconds,
+            'sim_seconds': sim_seconds,
+            'sim_seconds_per_wall_second': sim_seconds / wall_seconds if wall_seconds > 0 else None,
+            'phases': {name: totals[0] - self._episode_totals.get(name, (0., 0))[0]
+                       for name, totals in self._totals.items()}
+        })
+        self.start_episode()
+
+    def summary(self) -> dict:
+        """
+        Summary of the run
+        :return: dict containing the totals of the run, of each phase and of each episode
+        """
+        wall_seconds = self._wall_seconds
+        if self._start is not None:
+            wall_seconds += time.perf_counter() - self._start
+        sim_seconds = sum(episode['sim_seconds'] for episode in self._episodes)
+        phases_seconds = sum(seconds for seconds, _ in self._totals.values())
+
+        return {
+            'wall_seconds': wall_seconds,
+            'sim_seconds': sim_seconds,
+            'sim_seconds_per_wall_second': sim_seconds / wall_seconds if wall_seconds > 0 else None,
+            # time not spent in any phase, e.g. in the agent's libraries or in resets
+            'other_seconds': wall_seconds - phases_seconds,
+            'phases': {
+                name: {
+                    'seconds': seconds,
+                    'count': count,
+                    'mean_ms': 1000 * seconds / count if count > 0 else None,
+                    'share': seconds / wall_seconds if wall_seconds > 0 else None
+                }
+                for name, (seconds, count) in sorted(self._totals.items(), key=lambda item: -item[1][0])
+            },
+            'episodes': self._episodes
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Saves the summary to path + '_profile.json', and the cProfile stats to path + '_profile.prof' if enabled.
+        The stats can be read with pstats or visualizers like snakeviz
+        :param path: path of the files, without suffix and extension
+        """
+        if not self.enabled:
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '_profile.json', 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(path + '_profile.prof')
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import sqlite3
+import pandas as pd
+
+from contextlib import closing
+from scripts.utils.config_values import MaximizedMetrics, Metric
+from scripts.utils.snapshot_cache import content_hash
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instance TEXT NOT NULL,
+    agent_type TEXT NOT NULL,
+    traffic_type TEXT NOT NULL,
+    learn INTEGER NOT NULL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    csvs_path TEXT NOT NULL,
+    model_path TEXT,
+    started REAL NOT NULL,
+    wall_seconds REAL NOT NULL,
+    episodes INTEGER NOT NULL,
+    stopped_early INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    episode INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    mean REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (run_id, metric, episode)
+);
+CREATE INDEX IF NOT EXISTS runs_traffic_type ON runs(traffic_type, agent_type);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs(config_hash);
+"""
+
+
+class ResultsIndex:
+    """
+    ResultsIndex keeps, in a SQLite database, a row for every agent run with its configuration, its timing and
+    its model, and the mean, minimum and maximum of every metric of each of its episodes. It's filled as the runs
+    finish, also by parallel workers, so that runs can be compared without reading their csvs back
+    """
+
+    def __init__(self, path: str = 'output/results.db'):
+        """
+        ResultsIndex constructor, the database is created if it doesn't exist yet
+        :param path: path of the SQLite database
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Opens a connection to the database. Writers wait for each other instead of failing, and the write ahead log
+        lets readers query while a worker is writing
+        :return: Connection object
+        """
+        connection = sqlite3.connect(self.path, timeout=60)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    @staticmethod
+    def get_config_hash(config: dict, env_config: dict) -> str:
+        """
+        Hash of the configuration of a run, equal for runs of the same agent on the same environment whatever
+        their instance names
+        :param config: dict containing the configuration of the agent
+        :param env_config: dict containing the configuration of the environment
+        :return: 16 hexadecimal digits hash
+        """
+        return content_hash([], {'Agent': config, 'Environment': env_config})
+
+    def add_run(self, name: str, config: dict, env_config: dict, learn: bool, csvs_path: str, model_path: str | None,
+                started: float, wall_seconds: float, episode_statistics: list[dict], stopped_early: bool) -> int:
+        """
+        Adds a run and the statistics of its episodes, in a single transaction
+        :param name: name of the instance
+        :param config: dict containing the configuration of the agent
+        :param env_config: dict containing the configuration of the environment
+        :param learn: True if the agent learned, False if it was tested
+        :param csvs_path: path containing the csv output files of the run
+        :param model_path: path of the model saved (learning) or loaded (testing), None if there is no model
+        :param started: time at which the run started, in seconds since the epoch
+        :param wall_seconds: duration of the run in seconds
+        :param episode_statistics: for each episode, its number and the mean, min and max of each metric
+        :param stopped_early: True if the run was stopped before its last episode
+        :return: id of the run
+        """
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                'INSERT INTO runs (instance, agent_type, traffic_type, learn, config_hash, config, csvs_path, '
+                'model_path, started, wall_seconds, episodes, stopped_early) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, config['Agent_type'], env_config['Traffic_type'], learn,
+                 self.get_config_hash(config, env_config), json.dumps(config, sort_keys=True), csvs_path, model_path,
+                 started, wall_seconds, len(episode_statistics), stopped_early))
+            run_id = cursor.lastrowid
+            connection.executemany(
+                'INSERT INTO episodes (run_id, episode, metric, mean, min, max) VALUES (?, ?, ?, ?, ?, ?)',
+                [(run_id, statistics['episode'], metric, values['mean'], values['min'], values['max'])
+                 for statistics in episode_statistics
+                 for metric, values in statistics.items() if metric in Metric])
+        return run_id
+
+    def runs(self, traffic_type: str = None, agent_type: str = None, instance: str = None,
+             learn: bool = None) -> pd.DataFrame:
+        """
+        Runs in the index, optionally filtered
+        :param traffic_type: traffic type of the runs, None for any
+        :param agent_type: agent type of the runs, None for any
+        :param instance: name of the instance, None for any
+        :param learn: True for learning runs only, False for test runs only, None for both
+        :return: DataFrame containing a row per run, from the oldest
+        """
+        where, params = self._filter(traffic_type, agent_type, instance, learn)
+        with closing(self._connect()) as connection, connection:
+            return pd.read_sql_query('SELECT id, instance, agent_type, traffic_type, learn, config_hash, csvs_path, '
+                                     'model_path, started, wall_seconds, episodes, stopped_early FROM runs r'
+                                     + where + ' ORDER BY id', connection, params=params)
+
+    def episodes(self, run_id: int, metric: str = None) -> pd.DataFrame:
+        """
+        Statistics of the episodes of a run
+        :param run_id: id of the run
+        :param metric: metric, None for all of them
+        :return: DataFrame containing a row per episode and metric
+        """
+        query = 'SELECT episode, metric, mean, min, max FROM episodes WHERE run_id = ?'
+        params = [run_id]
+        if metric is not None:
+            query += ' AND metric = ?'
+            params.append(metric)
+        with closing(self._connect()) as connection, connection:
+            return pd.read_sql_query(query + ' ORDER BY episode, metric', connection, params=params)
+
+    def best(self, metric: str, traffic_type: str = None, agent_type: str = None, learn: bool = None,
+             last_episode: bool = True, limit: int = 10) -> pd.DataFrame:
+        """
+        Runs ranked by a metric, from the best: the lowest values first, or the highest for MaximizedMetrics
+        :param metric: metric ranking the runs, one of config_values.Metric
+        :param traffic_type: traffic type of the runs, None for any
+        :param agent_type: agent type of the runs, None for any
+        :param learn: True for learning runs only, False for test runs only, None for both
+        :param last_episode: if True runs are ranked by the mean of the metric over their last episode, otherwise
+        by the mean over all their episodes
+        :param limit: maximum number of runs returned
+        :return: DataFrame containing a row per run, with the value ranking it
+        """
+        if metric not in Metric:
+            raise ValueError('unknown metric ' + repr(metric) + ', possible values: ' + ', '.join(sorted(Metric)))
+        where, params = self._filter(traffic_type, agent_type, None, learn)
+        value = 'e.mean' if last_episode else 'AVG(e.mean)'
+        episode = ' AND e.episode = (SELECT MAX(episode) FROM episodes WHERE run_id = r.id AND metric = e.metric)' \
+            if last_episode else ''
+        order = 'DESC' if metric in MaximizedMetrics else 'ASC'
+
+        with closing(self._connect()) as connection, connection:
+            results = pd.read_sql_query(
+                f'SELECT r.id, r.instance, r.agent_type, r.traffic_type, r.learn, r.config_hash, r.model_path, '
+                f'r.episodes, {value} AS value FROM runs r JOIN episodes e ON e.run_id = r.id AND e.metric = ?'
+                f'{episode}{where} GROUP BY r.id ORDER BY value {order} LIMIT ?',
+                connection, params=[metric] + params + [limit])
+        return results.rename(columns={'value': metric})
+
+    @staticmethod
+    def _filter(traffic_type: str | None, agent_type: str | None, instance: str | None,
+                learn: bool | None) -> tuple[str, list]:
+        """
+        WHERE clause filtering the runs, on the columns of the runs table aliased as r
+        :param traffic_type: traffic type of the runs, None for any
+        :param agent_type: agent type of the runs, None for any
+        :param instance: name of the instance, None for any
+        :param learn: True for learning runs only, False for test runs only, None for both
+        :return: clause, empty if there is no filter, and its parameters
+        """
+        conditions, params = [], []
+        for column, value in (('traffic_type', traffic_type), ('agent_type', agent_type), ('instance', instance),
+                              ('learn', learn)):
+            if value is not None:
+                conditions.append(f'r.{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Query the index of the results of the agent runs')
+    parser.add_argument('--db', default='output/results.db', help='path of the results index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    runs_parser = subparsers.add_parser('runs', help='list the runs')
+    best_parser = subparsers.add_parser('best', help='rank the runs by a metric')
+    best_parser.add_argument('metric', choices=sorted(Metric))
+    best_parser.add_argument('--all-episodes', action='store_true',
+                             help='rank by the mean over all the episodes instead of the last one')
+    best_parser.add_argument('--limit', type=int, default=10)
+    for subparser in (runs_parser, best_parser):
+        subparser.add_argument('--traffic', default=None, help='traffic type of the runs')
+        subparser.add_argument('--agent', default=None, help='agent type of the runs')
+        subparser.add_argument('--mode', choices=['learn', 'test'], default=None, help='learning or test runs only')
+    runs_parser.add_argument('--instance', default=None, help='name of the instance')
+
+    episodes_parser = subparsers.add_parser('episodes', help='show the statistics of the episodes of a run')
+    episodes_parser.add_argument('run_id', type=int)
+    episodes_parser.add_argument('--metric', choices=sorted(Metric), default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error('no results index in ' + args.db)
+    index = ResultsIndex(args.db)
+
+    if args.command == 'episodes':
+        results = index.episodes(args.run_id, args.metric)
+    else:
+        learn = None if args.mode is None else args.mode == 'learn'
+        if args.command == 'runs':
+            results = index.runs(args.traffic, args.agent, args.instance, learn)
+        else:
+            results = index.best(args.metric, args.traffic, args.agent, learn, not args.all_episodes, args.limit)
+
+    print(results.to_string(index=False) if not results.empty else 'No results')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,25 @@
 
+import json
 import os
+import re
+import time
 
+from concurrent.futures import ProcessPoolExecutor
 from scripts.agents.dqn_agent import DQNAgent
 from scripts.agents.fixed_cycle import FixedCycleAgent
 from scripts.agents.learning_agent import LearningAgent
+from scripts.agents.multi_ql_agent import MultiQLearningAgent
 from scripts.agents.ql_agent import QLearningAgent
 from scripts.agents.sarsa_agent import SarsaAgent
 from scripts.agents.sarsa_agent_decay import SarsaDecayAgent
 from scripts.custom.custom_environment import CustomEnvironment
+from scripts.utils.convergence_monitor import ConvergenceMonitor
+from scripts.utils.grid_network import GridNetwork
+from scripts.utils.inference_server import InferenceClient, parse_address
 from scripts.utils.plotter import Plotter
+from scripts.utils.profiler import StepProfiler
+from scripts.utils.results_index import ResultsIndex
+from scripts.utils.scenario_generator import ScenarioGenerator
 
 
 class Runner:
@@ -16,17 +27,22 @@ class Runner:
     Runner class that allows to run multiple tests on agents with different configurations
     """
 
-    def __init__(self, configs: dict, plotter: Plotter, learn: bool = True):
+    def __init__(self, configs: dict, plotter: Plotter, learn: bool = True, resume: bool = False):
         """
         Runner constructor
         :param configs: dict representing runner configurations
         :param plotter: plotter object to plot results
         :param learn: boolean, if True agents will learn, if False it won't
+        :param resume: boolean, if True agents continue from their last checkpoint, skipping the completed episodes
         """
         self.configs: dict = configs
         self.plotter: Plotter = plotter
         self.learn: bool = learn
+        self.resume: bool = resume
         self.agents: [LearningAgent] = []
+        # environment shared by the agents when evaluating, with the (fixed, single_agent) kind it was built for
+        self._shared_env = None
+        self._shared_env_kind = None
         self._set_environment()
 
     def _set_environment(self) -> None:
@@ -34,6 +50,7 @@ class Runner:
         custom setter, sets up custom from configs
         """
         env_config = self.configs['Environment']
+        net_file = "big-intersection/BI.net.xml"
         route_file = None
 
         if env_config['Traffic_type'] == 'low':
@@ -41,7 +58,24 @@ class Runner:
         if env_config['Traffic_type'] == 'high':
             route_file = "big-intersection/BI_150_test.rou.xml"
 
+        if 'Network' in env_config:
+            # generated grid, its route files are always generated too
+            network_config = env_config['Network']
+            network = GridNetwork(network_config.get('Directory', 'output/networks'), network_config['Grid_size'],
+                                  network_config.get('Length', 200), network_config.get('Lanes', 1))
+            net_file = network.get_net_file()
+            scenario = env_config.get('Scenario') if env_config['Traffic_type'] == 'scenario' \
+                else network.get_scenario(env_config['Traffic_type'])
+            generator = ScenarioGenerator(env_config.get('Scenario', {}).get('Directory', 'output/scenarios'),
+                                          network.get_movements())
+            route_file = generator.get_route_file(scenario, env_config.get('Warmup', 0) + env_config['Num_seconds'])
+        elif env_config['Traffic_type'] == 'scenario':
+            scenario = env_config['Scenario']
+            generator = ScenarioGenerator(scenario.get('Directory', 'output/scenarios'))
+            route_file = generator.get_route_file(scenario, env_config.get('Warmup', 0) + env_config['Num_seconds'])
+
         self.env = CustomEnvironment(
+            net_file=net_file,
             route_file=route_file,
             gui=env_config['Gui'],
             num_seconds=env_config['Num_seconds'],
@@ -49,6 +83,11 @@ class Runner:
             max_green=env_config['Max_green'],
             yellow_time=env_config['Yellow_time'],
             delta_time=env_config['Delta_time'],
+            libsumo=env_config.get('Libsumo', False),
+            flush_interval=self.configs.get('Flush_interval', 1000),
+            output_format=self.configs.get('Output_format', 'csv'),
+            warmup=env_config.get('Warmup', 0),
+            snapshot_dir=env_config.get('Snapshot_dir', 'output/snapshots'),
         )
 
     def run(self) -> None:
@@ -57,25 +96,108 @@ class Runner:
         """
         if self.env is None:
             self._set_environment()
-        if not self.agents:
-            self._load_agents()
 
         traffic_type = self.configs['Environment']['Traffic_type']
         output_path = os.path.join(self.configs['Output_csv'], traffic_type)
-        output_csvs_paths: dict[str, str] = {}
 
-        for agent in self.agents:
-            print("\nRunning agent: " + agent.get_name())
-            csvs_path = agent.run(self.learn, output_path)
-            output_csvs_paths[agent.get_name()] = csvs_path
+        if self.configs.get('Workers', 1) > 1:
+            output_csvs_paths = self._run_parallel(output_path)
+        else:
+            output_csvs_paths = self._run_sequential(output_path)
 
         print("\nPlotting agents")
         self._plot_per_agent(output_csvs_paths)
         self._plot_last_episode(output_csvs_paths)
 
+    def _run_sequential(self, output_path: str) -> dict[str, str]:
+        """
+        runs all the agents one after another in the current process, saving each model (if learning) after its run
+        :param output_path: path in which to save the csvs
+        :return: dict containing the agent and its path to csv files
+        """
+        output_csvs_paths: dict[str, str] = {}
+
+        try:
+            for agent in self._iter_agents():
+                output_csvs_paths[agent.get_name()] = self._run_agent(agent, output_path)
+                # saved right away, so that a model is on disk as soon as its run is in the results index
+                if self.learn:
+                    os.makedirs(self.configs['Output_model'], exist_ok=True)
+                    self._save_agent_to_file(agent)
+        finally:
+            self._close_shared_env()
+
+        return output_csvs_paths
+
+    def _iter_agents(self):
+        """
+        yields the agents to run. If they weren't loaded before, each agent is built right before being run, so
+        that only one simulation at a time is alive in this process, as required by libsumo
+        :return: generator of the agents
+        """
+        if self.agents:
+            yield from self.agents
+            return
+
+        for name, config in self.configs['Instances'].items():
+            agent = self._build_agent(name, config)
+            self.agents.append(agent)
+            yield agent
+
+    def _run_parallel(self, output_path: str, names: list[str] = None) -> dict[str, str]:
+        """
+        runs each instance in a separate worker process, using at most self.configs['Workers'] processes.
+        Every worker builds its own agent, and so its own SUMO connection, then saves the model if learning.
+        When evaluating, each worker runs instead a contiguous share of the instances one after another, so that
+        they reuse the same SUMO process
+        :param output_path: path in which to save the csvs
+        :param names: names of the instances to run, all the config instances if None
+        :return: dict containing the agent and its path to csv files, in the same order as names
+        """
+        if names is None:
+            names = list(self.configs['Instances'])
+
+        with ProcessPoolExecutor(max_workers=self.configs['Workers']) as pool:
+            if self.learn:
+                futures = {name: pool.submit(_run_instance, self, name, output_path) for name in names}
+                return {name: futures[name].result() for name in names}
+
+            size = -(-len(names) // self.configs['Workers'])
+            futures = [pool.submit(_run_instances, self, names[i:i + size], output_path)
+                       for i in range(0, len(names), size)]
+            output_csvs_paths = {}
+            for future in futures:
+                output_csvs_paths.update(future.result())
+            return {name: output_csvs_paths[name] for name in names}
+
+    def _run_instances(self, names: list[str], output_path: str) -> dict[str, str]:
+        """
+        builds, runs and (if learning) saves some agent instances one after another, then closes the environment
+        they shared, if any
+        :param names: names of the instances in self.configs['Instances']
+        :param output_path: path in which to save the csvs
+        :return: dict containing the agent and its path to csv files
+        """
+        try:
+            return {name: self._run_instance(name, output_path) for name in names}
+        finally:
+            self._close_shared_env()
+
+    def _run_instance(self, name: str, output_path: str) -> str:
+        """
+        builds, runs and (if learning) saves a single agent instance
+        :param name: name of the instance in self.configs['Instances']
+        :param output_path: path in which to save the csvs
+        :return: path containing the csv output files
+        """
+        agent = self._build_agent(name, self.configs['Instances'][name])
+        csvs_path = self._run_agent(agent, output_path)
+
         if self.learn:
-            print("Saving models")
-            self._save_agents_to_file()
+            os.makedirs(self.configs['Output_model'], exist_ok=True)
+            self._save_agent_to_file(agent)
+
+        return csvs_path
 
     def _plot_per_agent(self, csvs_paths: dict[str, str]) -> None:
         """
@@ -89,55 +211,220 @@ class Runner:
 
     def _plot_last_episode(self, csvs_path: dict[str, str]) -> None:
         """
-        plots results of last episode of each agent using self.plotter
+        plots results of last episode of each agent using self.plotter, the one of every environment if an agent
+        ran many of them. Agents without metrics files are skipped
         :param csvs_path: dict containing the agent and its path to csv files
         """
+        plotted = False
         for path in csvs_path.values():
-            csv_files = [f for f in os.listdir(path) if f.endswith('.csv')]
-            last_episode = os.path.join(path, csv_files[-1])
-            self.plotter.add_csv(last_episode)
+            # files of each episode, as (environment index, name) pairs
+            episodes: dict[int, list[tuple[int, str]]] = {}
+            for file in os.listdir(path):
+                match = re.search(r'(?:_env(\d+))?_ep(\d+)\.\w+$', file)
+                if match and Plotter.is_metrics_file(file):
+                    episodes.setdefault(int(match.group(2)), []).append((int(match.group(1) or 0), file))
+            if not episodes:
+                continue
 
-        self.plotter.build_plot('last_episodes')
+            for _, file in sorted(episodes[max(episodes)]):
+                self.plotter.add_csv(os.path.join(path, file))
+            plotted = True
+
+        if plotted:
+            self.plotter.build_plot('last_episodes')
         self.plotter.clear()
 
-    def _load_agents(self):
+    def _run_agent(self, agent: LearningAgent, output_path: str) -> str:
         """
-        load (untrained) agents from config file and appends them to the agents list.
-        if 'Model' field is in configs, it loads the agents from save files
+        sets up checkpointing, resuming, convergence monitoring, profiling and the inference client for an agent,
+        then runs it and adds the run to the results index, if any
+        :param agent: agent to run
+        :param output_path: path in which to save the csvs
+        :return: path containing the csv output files
         """
-        for name, config in self.configs['Instances'].items():
-            if config['Agent_type'] == 'QL':
-                if 'Model' in config:
-                    agent = QLearningAgent(config, None, name)
-                    agent.load(config['Model'], self.env.get_sumo_env(False))
-                else:
-                    agent = QLearningAgent(config, self.env.get_sumo_env(False), name)
-            if config['Agent_type'] == 'DQN':
-                if 'Model' in config:
-                    agent = DQNAgent(config, None, name)
-                    agent.load(config['Model'], self.env.get_sumo_env(False))
-                else:
-                    agent = DQNAgent(config, self.env.get_sumo_env(False), name)
-            if config['Agent_type'] == 'SARSA':
-                if 'Model' in config:
-                    agent = SarsaAgent(config, self.env.get_sumo_env(False), name)
-                    agent.load(config['Model'], self.env.get_sumo_env(False))
-                else:
-                    agent = SarsaAgent(config, self.env.get_sumo_env(False), name)
-            if config['Agent_type'] == 'SARSA_decay':
-                if 'Model' in config:
-                    agent = SarsaDecayAgent(config, self.env.get_sumo_env(False), name)
-                    agent.load(config['Model'], self.env.get_sumo_env(False))
-                else:
-                    agent = SarsaDecayAgent(config, self.env.get_sumo_env(False), name)
-            if config['Agent_type'] == 'FIXED':
-                agent = FixedCycleAgent(config, self.env.get_sumo_env(True), name)
-            self.agents.append(agent)
+        if self.learn and 'Checkpoint_interval' in self.configs:
+            checkpoint_path = os.path.join(self.configs['Output_model'], 'checkpoints', agent.get_name())
+            agent.set_checkpoint(checkpoint_path, self.configs['Checkpoint_interval'])
+        if self.resume:
+            agent.resume(self.learn, output_path)
+        if self.learn and 'Convergence' in self.configs and agent.config['Agent_type'] != 'FIXED':
+            convergence = self.configs['Convergence']
+            agent.set_convergence_monitor(ConvergenceMonitor(convergence['Metric'], convergence.get('Window', 3),
+                                                             convergence.get('Threshold', 0.01),
+                                                             convergence.get('Divergence_limit'),
+                                                             convergence.get('Patience', 1)))
+        if 'Profiling' in self.configs:
+            agent.set_profiler(StepProfiler(True, self.configs['Profiling'] == 'cprofile'))
+        if not self.learn and 'Inference_server' in agent.config:
+            agent.set_inference_client(InferenceClient(parse_address(agent.config['Inference_server']),
+                                                       agent.config['Inference_authkey'].encode()))
 
-    def _save_agents_to_file(self) -> None:
+        print("\nRunning agent: " + agent.get_name())
+        started, start = time.time(), time.perf_counter()
+        agent.profiler.start()
+        try:
+            csvs_path = agent.run(self.learn, output_path)
+        finally:
+            if agent.inference_client is not None:
+                agent.inference_client.close()
+        agent.profiler.stop()
+        wall_seconds = time.perf_counter() - start
+        agent.profiler.save(os.path.join(csvs_path, agent.get_name()))
+
+        if 'Results_index' in self.configs:
+            # the model of a learning agent is saved right after its run
+            model_path = self.configs['Output_model'] + '/' + agent.get_name() + '.pkl' if self.learn \
+                else agent.config.get('Model')
+            ResultsIndex(self.configs['Results_index']).add_run(
+                agent.get_name(), agent.config, self.configs['Environment'], self.learn, csvs_path, model_path,
+                started, wall_seconds, agent.episode_statistics, agent.stopped_early)
+
+        return csvs_path
+
+    @staticmethod
+    def _save_summary(agent: LearningAgent, csvs_path: str) -> None:
+        """
+        saves the summaries of the episodes of an agent in <agent>_summary.json next to its csvs, so that they can
+        be read after running in a worker process. When resuming, the summaries of the episodes skipped are kept
+        :param agent: agent run
+        :param csvs_path: path containing the csv output files of the agent
+        """
+        path = os.path.join(csvs_path, agent.get_name() + '_summary.json')
+        episodes, stopped_early = agent.episode_summaries, agent.stopped_early
+        if agent.start_run > 0 and os.path.exists(path):
+            # a resumed agent only knows the episodes it ran, the ones skipped are kept from the previous summary
+            with open(path) as f:
+                previous = json.load(f)
+            episodes = [episode for episode in previous['episodes'] if episode['episode'] < agent.start_run] \
+                + episodes
+            stopped_early = stopped_early or (not agent.episode_summaries and previous['stopped_early'])
+
+        with open(path, 'w') as f:
+            json.dump({'episodes': episodes, 'stopped_early': stopped_early}, f, indent=2)
+
+    @staticmethod
+    def _read_summary(name: str, csvs_path: str) -> dict:
+        """
+        Reads the summary saved by _save_summary
+        :param name: name of the instance
+        :param csvs_path: path containing the csv output files of the instance
+        :return: dict containing the episode summaries and whether the instance stopped early
+        """
+        with open(os.path.join(csvs_path, name + '_summary.json')) as f:
+            return json.load(f)
+
+    def _get_sumo_env(self, fixed: bool, single_agent: bool = True, sumo_seed: int | str = 'random'):
+        """
+        environment on which to run an agent. When evaluating, agents reuse the same environment, and so the same
+        SUMO process, which is reloaded on reset instead of restarted. It's replaced, after being closed, only when
+        an agent needs another kind of environment, so that a single simulation at a time is alive as required by
+        libsumo
+        :param fixed: True for fixed cycle, False for learning agent
+        :param single_agent: False for agents controlling all the traffic signals
+        :param sumo_seed: seed used by SUMO, 'random' for a random seed at every episode
+        :return: CustomSumoEnvironment object
+        """
+        if self.learn:
+            return self.env.get_sumo_env(fixed, sumo_seed, single_agent)
+
+        if self._shared_env is None or self._shared_env_kind != (fixed, single_agent):
+            self._close_shared_env()
+            self._shared_env = self.env.get_sumo_env(fixed, sumo_seed, single_agent, keep_alive=True)
+            self._shared_env_kind = (fixed, single_agent)
+        else:
+            # the seed is passed to SUMO when it's reloaded on reset
+            self._shared_env.sumo_seed = sumo_seed
+            self._shared_env.snapshot_path = self.env.get_snapshot_path(sumo_seed)
+        return self._shared_env
 
-        os.makedirs(self.configs['Output_model'], exist_ok=True)
+    def _close_shared_env(self) -> None:
+        """
+        closes the environment shared by the agents when evaluating, if any
+        """
+        if self._shared_env is not None:
+            self._shared_env.shutdown()
+            self._shared_env = None
+            self._shared_env_kind = None
+
+    def _build_agent(self, name: str, config: dict) -> LearningAgent:
+        """
+        builds a single (untrained) agent from its config.
+        if 'Model' field is in config, it loads the agent from save file
+        :param name: name of the agent
+        :param config: dict representing the agent configuration
+        :return: the agent object
+        """
+        agent = None
+        sumo_seed = config.get('Sumo_seed', 'random')
+        if config['Agent_type'] == 'QL':
+            if 'Model' in config:
+                agent = QLearningAgent(config, None, name)
+                agent.load(config['Model'], self._get_sumo_env(False, sumo_seed=sumo_seed))
+            else:
+                agent = QLearningAgent(config, self._get_sumo_env(False, sumo_seed=sumo_seed), name)
+        if config['Agent_type'] == 'DQN':
+            if 'Model' in config:
+                agent = DQNAgent(config, None, name)
+                agent.load(config['Model'], self._get_sumo_env(False, sumo_seed=sumo_seed))
+            elif self.learn and config.get('Num_envs', 1) > 1:
+                agent = DQNAgent(config, self.env.get_sumo_vec_env(False, config['Num_envs'], sumo_seed), name)
+            else:
+                agent = DQNAgent(config, self._get_sumo_env(False, sumo_seed=sumo_seed), name)
+        if config['Agent_type'] == 'SARSA':
+            if 'Model' in config:
+                agent = SarsaAgent(config, None, name)
+                agent.load(config['Model'], self._get_sumo_env(False, sumo_seed=sumo_seed))
+            else:
+                agent = SarsaAgent(config, self._get_sumo_env(False, sumo_seed=sumo_seed), name)
+        if config['Agent_type'] == 'SARSA_decay':
+            if 'Model' in config:
+                agent = SarsaDecayAgent(config, None, name)
+                agent.load(config['Model'], self._get_sumo_env(False, sumo_seed=sumo_seed))
+            else:
+                agent = SarsaDecayAgent(config, self._get_sumo_env(False, sumo_seed=sumo_seed), name)
+        if config['Agent_type'] == 'QL_multi':
+            if 'Model' in config:
+                agent = MultiQLearningAgent(config, None, name)
+                agent.load(config['Model'], self._get_sumo_env(False, False, sumo_seed))
+            else:
+                agent = MultiQLearningAgent(config, self._get_sumo_env(False, False, sumo_seed), name)
+        if config['Agent_type'] == 'FIXED':
+            metrics = list(self.plotter.metrics) if self.plotter is not None and self.plotter.metrics is not None \
+                else None
+            if metrics is not None:
+                # the metrics compared with the baseline and followed for convergence are needed in fast forward
+                for section in ('Early_stopping', 'Convergence'):
+                    if section in self.configs and self.configs[section]['Metric'] not in metrics:
+                        metrics.append(self.configs[section]['Metric'])
+            agent = FixedCycleAgent(config, self._get_sumo_env(True, sumo_seed=sumo_seed), name, metrics)
+        return agent
+
+    def _save_agent_to_file(self, agent: LearningAgent) -> None:
+        """
+        saves a trained agent into the Output_model directory
+        :param agent: agent to save
+        """
+        out_file = self.configs['Output_model'] + '/' + agent.get_name() + '.pkl'
+        agent.save(out_file)
 
-        for agent in self.agents:
-            out_file = self.configs['Output_model'] + '/' + agent.get_name() + '.pkl'
-            agent.save(out_file)
+
+def _run_instances(runner: Runner, names: list[str], output_path: str) -> dict[str, str]:
+    """
+    Entry point of the worker processes used by Runner in parallel evaluation
+    :param runner: runner object, copied into the worker process
+    :param names: names of the instances to run
+    :param output_path: path in which to save the csvs
+    :return: dict containing the agent and its path to csv files
+    """
+    return runner._run_instances(names, output_path)
+
+
+def _run_instance(runner: Runner, name: str, output_path: str) -> str:
+    """
+    Entry point of the worker processes used by Runner in parallel mode
+    :param runner: runner object, copied into the worker process
+    :param name: name of the instance to run
+    :param output_path: path in which to save the csvs
+    :return: path containing the csv output files
+    """
+    return runner._run_instance(name, output_path)
@@ -0,0 +1,165 @@
+import numpy as np
+import os
+
+from scripts.utils.snapshot_cache import content_hash
+
+# Movements of big-intersection/BI.net.xml, from the origin to the destination side of the intersection,
+# with their first and last edges
+Movements = {origin + '2' + destination: (origin + '2TL', 'TL2' + destination)
+             for origin in 'ENSW' for destination in 'ENSW' if origin != destination}
+
+# Default values of the optional fields of a scenario
+_DEFAULTS = {
+    'Demand': 100,
+    'Movements': {},
+    'Profile': [[0, 1.0]],
+    'Interval': 300,
+    'Seed': None
+}
+
+
+class ScenarioGenerator:
+    """
+    ScenarioGenerator writes the route files of a network from a compact spec:
+    - Demand: vehicles per hour of every movement
+    - Movements: vehicles per hour of some movements (e.g. {N2S: 300}), overriding Demand, 0 to disable them
+    - Profile: [time, factor] points scaling the demand over time, linearly interpolated and constant after the
+      last point, e.g. [[0, 0.5], [1800, 2.0], [3600, 0.5]] for a rush hour peak
+    - Interval: seconds during which the demand is constant, each interval uses the profile at its middle
+    - Seed: if set, departures are drawn as Poisson arrivals with this seed, otherwise evenly spaced flows are used
+    Vehicles are routed by SUMO from the first to the last edge of their movement.
+    Route files are named after the hash of the spec, of the movements and of the simulated seconds, so that
+    each scenario is generated once and then reused
+    """
+
+    def __init__(self, directory: str, movements: dict[str, tuple[str, str]] = None):
+        """
+        ScenarioGenerator constructor
+        :param directory: directory containing the generated route files
+        :param movements: first and last edge of each movement, None for the ones of big-intersection/BI.net.xml
+        """
+        self.directory = directory
+        self.movements = movements if movements is not None else Movements
+
+    def get_route_file(self, spec: dict, end: int) -> str:
+        """
+        Path of the route file of a scenario, generated if it doesn't exist yet
+        :param spec: dict representing the scenario
+        :param end: simulated seconds covered by the route file, warm up included
+        :return: path of the route file
+        """
+        spec = self.complete(spec)
+        unknown = set(spec['Movements']) - set(self.movements)
+        if unknown:
+            raise ValueError('unknown movements: ' + ', '.join(sorted(unknown)))
+
+        key = content_hash([], dict(spec, End=end, Network=self.movements))
+        path = os.path.join(self.directory, 'scenario_' + key + '.rou.xml')
+
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            # written to a temporary file first, so that parallel workers never read a partial route file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(self.generate(spec, end))
+            os.replace(tmp_path, path)
+
+        return path
+
+    @staticmethod
+    def complete(spec: dict) -> dict:
+        """
+        Fills the missing optional fields of a spec with their defaults, ignoring the fields not used by the
+        generation (e.g. Directory), so that equivalent specs have the same hash
+        :param spec: dict representing the scenario
+        :return: dict representing the complete scenario
+        """
+        return {key: spec.get(key, default) for key, default in _DEFAULTS.items()}
+
+    def get_rates(self, spec: dict, end: int) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """
+        Vehicles per hour of each movement in each interval
+        :param spec: dict representing the complete scenario
+        :param end: simulated seconds covered by the route file
+        :return: start times of the intervals, and rates of each enabled movement in each interval
+        """
+        begins = np.arange(0, end, spec['Interval'])
+        middles = (begins + np.minimum(begins + spec['Interval'], end)) / 2
+        times, factors = zip(*spec['Profile'])
+        scale = np.interp(middles, times, factors)
+
+        rates = {}
+        for movement in self.movements:
+            demand = spec['Movements'].get(movement, spec['Demand'])
+            if demand > 0:
+                rates[movement] = demand * scale
+        return begins, rates
+
+    def generate(self, spec: dict, end: int) -> str:
+        """
+        Builds the content of the route file of a scenario
+        :param spec: dict representing the complete scenario
+        :param end: simulated seconds covered by the route file
+        :return: content of the route file
+        """
+        begins, rates = self.get_rates(spec, end)
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '',
+            '<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">'
+        ]
+
+        if spec['Seed'] is None:
+            lines += self._get_flows(begins, rates, spec['Interval'], end)
+        else:
+            lines += self._get_trips(begins, rates, spec['Interval'], end, spec['Seed'])
+
+        lines.append('</routes>')
+        return '\n'.join(lines) + '\n'
+
+    def _get_flows(self, begins: np.ndarray, rates: dict[str, np.ndarray], interval: int, end: int) -> list[str]:
+        """
+        Evenly spaced departures: one flow per movement and interval, sorted by begin as required by SUMO
+        :param begins: start times of the intervals
+        :param rates: rates of each movement in each interval
+        :param interval: seconds per interval
+        :param end: simulated seconds covered by the route file
+        :return: lines of the flows
+        """
+        lines = []
+        for i, begin in enumerate(begins):
+            for movement, movement_rates in rates.items():
+                if movement_rates[i] > 0:
+                    origin, destination = self.movements[movement]
+                    lines.append(f'    <flow id="f_{movement}_{i}" begin="{begin:.2f}" departLane="best" '
+                                 f'departSpeed="max" from="{origin}" to="{destination}" '
+                                 f'end="{min(begin + interval, end):.2f}" vehsPerHour="{movement_rates[i]:.2f}"/>')
+        return lines
+
+    def _get_trips(self, begins: np.ndarray, rates: dict[str, np.ndarray], interval: int, end: int,
+                   seed: int) -> list[str]:
+        """
+        Poisson arrivals: the number of vehicles of each movement in each interval is drawn from a Poisson
+        distribution and their departures are uniformly distributed in the interval, sorted by departure
+        :param begins: start times of the intervals
+        :param rates: rates of each movement in each interval
+        :param interval: seconds per interval
+        :param end: simulated seconds covered by the route file
+        :param seed: seed of the random generator
+        :return: lines of the trips
+        """
+        rng = np.random.default_rng(seed)
+        ends = np.minimum(begins + interval, end)
+        departs, routes = [], []
+
+        for movement, movement_rates in rates.items():
+            counts = rng.poisson(movement_rates * (ends - begins) / 3600)
+            departs.append(rng.uniform(np.repeat(begins, counts), np.repeat(ends, counts)))
+            routes += [movement] * int(counts.sum())
+
+        departs = np.concatenate(departs) if departs else np.empty(0)
+        order = np.argsort(departs, kind='stable')
+        return [f'    <trip id="v_{routes[j]}_{i}" depart="{departs[j]:.2f}" departLane="best" departSpeed="max" '
+                f'from="{self.movements[routes[j]][0]}" to="{self.movements[routes[j]][1]}"/>'
+                for i, j in enumerate(order)]
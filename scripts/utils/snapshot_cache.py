@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import re
+
+
+def content_hash(files: list[str], params: dict) -> str:
+    """
+    Hash of the content of some files and of some parameters, so that it changes whenever any of them does
+    :param files: paths of the files
+    :param params: json serializable parameters
+    :return: 16 hexadecimal digits hash
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+class SnapshotCache:
+    """
+    SnapshotCache names the SUMO state files saved after the warm up of a simulation. Each snapshot is keyed by
+    the content of the net and route files and by the parameters affecting the warm up, e.g. the SUMO seed. A
+    snapshot is kept for every parameter set, while the snapshots of a net and route file pair are deleted once
+    the content of the files changes
+    """
+
+    def __init__(self, directory: str):
+        """
+        SnapshotCache constructor
+        :param directory: directory containing the snapshots
+        """
+        self.directory = directory
+
+    def get_path(self, net_file: str, route_file: str, params: dict) -> str:
+        """
+        Path of the snapshot of a simulation, the file may not exist yet
+        :param net_file: path of the net file
+        :param route_file: path of the route file
+        :param params: json serializable parameters affecting the warm up
+        :return: path of the snapshot
+        """
+        prefix = f"{self._stem(net_file)}_{self._stem(route_file)}_"
+        files_hash = content_hash([net_file, route_file], {})
+        name = f"{prefix}{files_hash}_{content_hash([], params)}.xml.gz"
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._evict(prefix, files_hash)
+
+        return os.path.join(self.directory, name)
+
+    def _evict(self, prefix: str, files_hash: str) -> None:
+        """
+        Deletes the snapshots of the same net and route files taken when their content was different
+        :param prefix: prefix of the snapshots of the net and route files
+        :param files_hash: hash of the current content of the net and route files
+        """
+        pattern = re.compile(re.escape(prefix) + r'([0-9a-f]{16})_[0-9a-f]{16}\.xml\.gz$')
+        for file in os.listdir(self.directory):
+            match = pattern.match(file)
+            if match and match.group(1) != files_hash:
+                try:
+                    os.remove(os.path.join(self.directory, file))
+                except FileNotFoundError:
+                    # already evicted by another process
+                    pass
+
+    @staticmethod
+    def _stem(path: str) -> str:
+        """
+        Name of a file without directory and extensions
+        :param path: path of the file
+        :return: name of the file up to its first dot
+        """
+        return os.path.basename(path).split('.')[0]
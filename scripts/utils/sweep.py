@@ -0,0 +1,173 @@
+import argparse
+import os
+import pandas as pd
+
+from scripts.agents.learning_agent import LearningAgent
+from scripts.utils.config_values import MaximizedMetrics, Metric
+from scripts.utils.plotter import Plotter
+from scripts.utils.runner import Runner
+
+
+class BaselineStopping:
+    """
+    Early stopping rule for the sweeps: an agent is stopped when the mean of a metric over its last episode is
+    clearly worse than the one of the fixed cycle baseline, i.e. worse by more than tolerance (relative)
+    """
+
+    def __init__(self, metric: str, baseline: float, tolerance: float = 0.25, min_episodes: int = 1):
+        """
+        BaselineStopping constructor
+        :param metric: metric compared, one of config_values.Metric
+        :param baseline: mean of the metric over the last episode of the baseline
+        :param tolerance: relative difference from the baseline allowed, e.g. 0.25 for 25%
+        :param min_episodes: number of episodes always run before comparing
+        """
+        self.metric = metric
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.min_episodes = min_episodes
+
+    def __call__(self, episode: int, summary: dict) -> bool:
+        """
+        Checks whether an agent must stop
+        :param episode: episode just completed
+        :param summary: means of the metrics of the episode
+        :return: True if the agent must stop, False otherwise
+        """
+        if episode + 1 < self.min_episodes or self.metric not in summary:
+            return False
+        if self.metric in MaximizedMetrics:
+            return summary[self.metric] < self.baseline * (1 - self.tolerance)
+        return summary[self.metric] > self.baseline * (1 + self.tolerance)
+
+
+class SweepRunner(Runner):
+    """
+    Runner for configs with sweeps: the FIXED instances run first as baseline, then all the others run on the
+    worker pool, stopping early the ones clearly worse than the baseline if Early_stopping is set.
+    The means of the metrics over the last episode of every instance are written to sweep_results.csv
+    """
+
+    def __init__(self, configs: dict, plotter: Plotter, resume: bool = False):
+        """
+        SweepRunner constructor, agents always learn
+        :param configs: dict representing runner configurations
+        :param plotter: plotter object, only used for its metrics
+        :param resume: boolean, if True agents continue from their last checkpoint, skipping the completed episodes
+        """
+        super().__init__(configs, plotter, True, resume)
+        # mean of the early stopping metric over the last episode of the baselines, None to never stop early
+        self.baseline = None
+
+    def run(self) -> None:
+        """
+        runs the baselines, then the other instances, and writes the results table
+        """
+        traffic_type = self.configs['Environment']['Traffic_type']
+        output_path = os.path.join(self.configs['Output_csv'], traffic_type)
+        instances = self.configs['Instances']
+
+        baselines = [name for name, config in instances.items() if config['Agent_type'] == 'FIXED']
+        csvs_paths = self._run_names(baselines, output_path)
+
+        if 'Early_stopping' in self.configs and baselines:
+            metric = self.configs['Early_stopping']['Metric']
+            # a baseline has no episodes if its run was interrupted before its summary was saved
+            values = [episodes[-1][metric] for episodes in
+                      (self._read_summary(name, csvs_paths[name])['episodes'] for name in baselines) if episodes]
+            if values:
+                self.baseline = sum(values) / len(values)
+                print(f"\nBaseline {metric}: {self.baseline}")
+            else:
+                print("\nNo baseline episodes, agents won't be stopped early")
+
+        csvs_paths.update(self._run_names([name for name in instances if name not in baselines], output_path))
+
+        results_path = os.path.join(output_path, 'sweep_results.csv')
+        self._get_results(csvs_paths).to_csv(results_path, index=False)
+        print("\nResults saved in " + results_path)
+
+    def _run_names(self, names: list[str], output_path: str) -> dict[str, str]:
+        """
+        runs some instances, on the worker pool if Workers > 1
+        :param names: names of the instances to run
+        :param output_path: path in which to save the csvs
+        :return: dict containing the agent and its path to csv files
+        """
+        if self.configs.get('Workers', 1) > 1 and len(names) > 1:
+            return self._run_parallel(output_path, names)
+        return {name: self._run_instance(name, output_path) for name in names}
+
+    def _run_agent(self, agent: LearningAgent, output_path: str) -> str:
+        """
+        runs an agent with the early stopping rule, then saves the summaries of its episodes
+        in <agent>_summary.json next to its csvs
+        :param agent: agent to run
+        :param output_path: path in which to save the csvs
+        :return: path containing the csv output files
+        """
+        if self.baseline is not None and agent.config['Agent_type'] != 'FIXED':
+            early_stopping = self.configs['Early_stopping']
+            agent.add_early_stopping(BaselineStopping(early_stopping['Metric'], self.baseline,
+                                                      early_stopping.get('Tolerance', 0.25),
+                                                      early_stopping.get('Min_episodes', 1)))
+
+        csvs_path = super()._run_agent(agent, output_path)
+        self._save_summary(agent, csvs_path)
+
+        return csvs_path
+
+    def _get_results(self, csvs_paths: dict[str, str]) -> pd.DataFrame:
+        """
+        Builds the results table: one row per instance, with its sweep, parameters, episodes run and the means of
+        the metrics over its last episode. Rows are sorted from best to worst by the early stopping metric, if set
+        :param csvs_paths: dict containing the agent and its path to csv files
+        :return: DataFrame containing the results
+        """
+        metrics = self.plotter.metrics if self.plotter is not None and self.plotter.metrics else sorted(Metric)
+        columns = ['Instance', 'Sweep', 'Agent_type']
+        rows = []
+
+        for name, path in csvs_paths.items():
+            config = self.configs['Instances'][name]
+            summary = self._read_summary(name, path)
+            last_episode = summary['episodes'][-1] if summary['episodes'] else {}
+
+            row = {'Instance': name, 'Sweep': config.get('Sweep'), 'Agent_type': config['Agent_type']}
+            for key, value in config.items():
+                if key not in row and key != 'Model':
+                    row[key] = value
+                    if key not in columns:
+                        columns.append(key)
+            row['Episodes'] = len(summary['episodes'])
+            row['Stopped_early'] = summary['stopped_early']
+            row.update({metric: last_episode.get(metric) for metric in metrics})
+            rows.append(row)
+
+        results = pd.DataFrame(rows, columns=columns + ['Episodes', 'Stopped_early'] + list(metrics))
+        if 'Early_stopping' in self.configs:
+            metric = self.configs['Early_stopping']['Metric']
+            if metric in results:
+                results = results.sort_values(metric, ascending=metric not in MaximizedMetrics)
+        return results
+
+
+def main() -> None:
+    from scripts.utils.config_parser import ConfigsParser
+
+    parser = argparse.ArgumentParser(description='Train every instance and sweep of a config and compare them')
+    parser.add_argument('config', help='yaml config file')
+    parser.add_argument('--resume', action='store_true', help='continue the instances from their last checkpoint')
+    args = parser.parse_args()
+
+    config_parser = ConfigsParser(args.config)
+    config_parser.parse()
+
+    plotter = Plotter()
+    plotter.set_configs(config_parser.get_plotter_config())
+
+    SweepRunner(config_parser.get_runner_config(), plotter, args.resume).run()
+
+
+if __name__ == '__main__':
+    main()